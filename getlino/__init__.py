@@ -4,7 +4,18 @@
 
    configure
    startsite
+   startsites
+   wheelhouse
+   tuning
+   compress
+   snapshot
+   health
+   pgbouncer
+   migrate_engine
+   timing
+   executor
    utils
+   facts
    cli
 
 """
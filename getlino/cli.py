@@ -5,24 +5,36 @@
 """
 
 import click
-import distro
 
 from .setup_info import SETUP_INFO
 
 from .configure import configure
 from .startsite import startsite
+from .startsites import startsites
+from .wheelhouse import wheelhouse
+from .tuning import tune, db_tune
+from .snapshot import snapshot
+from .health import health
+from .migrate_engine import migrate_engine
 
 @click.group(help="""
 A command-line tool for installing Lino in different environments.
 See http://getlino.lino-framework.org for more information.
 
-This is getlino version {} running on {}.
-""".format(SETUP_INFO['version'], distro.name(pretty=True)))
+This is getlino version {}.
+""".format(SETUP_INFO['version']))
 def main():
     pass
 
 main.add_command(configure)
 main.add_command(startsite)
+main.add_command(startsites)
+main.add_command(wheelhouse)
+main.add_command(tune)
+main.add_command(db_tune)
+main.add_command(snapshot)
+main.add_command(health)
+main.add_command(migrate_engine)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,169 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Precompress the static files of a site.
+
+nginx serves a file :file:`foo.js.gz` (or :file:`foo.js.br`) instead of
+:file:`foo.js` to browsers that accept it when ``gzip_static`` (or
+``brotli_static``) is on.  So the files don't need to be compressed for every
+request.
+
+"""
+
+import os
+import gzip
+import json
+import shutil
+import subprocess
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import atomic_write
+
+# the extensions of the files that are worth compressing
+EXTENSIONS = set("""
+.js .css .html .htm .json .map .svg .txt .xml .ico .ttf .otf .eot
+""".split())
+
+# files smaller than this are not worth compressing
+MIN_SIZE = 1024
+
+SUFFIXES = ('.gz', '.br')
+
+# The name of the file below the static root that lists the compressed files
+# which are not written because they wouldn't be smaller than the original.
+INCOMPRESSIBLE = '.getlino-incompressible'
+
+
+def gzip_compress(data):
+    # mtime=0 makes the result depend only on the data
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def get_brotli():
+    """Return a function that compresses bytes using brotli, or `None` if
+    neither the :mod:`brotli` module nor the :cmd:`brotli` command is
+    available."""
+    try:
+        import brotli
+    except ImportError:
+        pth = shutil.which('brotli')
+        if pth is None:
+            return None
+
+        def compress(data):
+            cp = subprocess.run([pth, '-c', '-q', '11'], input=data,
+                                stdout=subprocess.PIPE, check=True)
+            return cp.stdout
+        return compress
+    return lambda data: brotli.compress(data, quality=11)
+
+
+def is_compressible(fn):
+    return os.path.splitext(fn)[1].lower() in EXTENSIONS
+
+
+def compress_file(src, compressors, incompressible=None):
+    """Write the compressed siblings of the file `src` unless they are up to
+    date.
+
+    `compressors` maps a suffix to a compression function.  A sibling is up
+    to date when it has the same modification time as `src`.  A sibling that
+    would not be smaller than `src` is not written (and removed if it exists).
+    `incompressible` is a dict mapping the names of such siblings to the
+    modification time of `src`.  It is updated, and these siblings are not
+    compressed again as long as `src` doesn't change.
+    Return the number of written siblings.
+
+    """
+    if incompressible is None:
+        incompressible = {}
+    st = os.stat(src)
+    data = None
+    written = 0
+    for suffix, compress in compressors.items():
+        dst = src + suffix
+        if incompressible.get(dst) == st.st_mtime_ns:
+            continue
+        try:
+            if os.stat(dst).st_mtime_ns == st.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(src, 'rb') as fd:
+                data = fd.read()
+        cdata = compress(data)
+        if len(cdata) >= len(data):
+            if os.path.exists(dst):
+                os.remove(dst)
+            incompressible[dst] = st.st_mtime_ns
+            continue
+        # several sites may share their static files and compress them at
+        # the same time
+        atomic_write(dst, cdata)
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+        written += 1
+    return written
+
+
+def read_incompressible(root):
+    """Return the dict of incompressible files below `root` as stored by
+    :func:`write_incompressible`."""
+    try:
+        with open(join(root, INCOMPRESSIBLE)) as fd:
+            names = json.load(fd)
+    except (OSError, ValueError):
+        return {}
+    return {join(root, k): v for k, v in names.items()}
+
+
+def write_incompressible(root, incompressible):
+    """Store the dict of incompressible files below `root`, forgetting those
+    whose original file no longer exists."""
+    names = {os.path.relpath(k, root): v for k, v in incompressible.items()
+             if os.path.exists(os.path.splitext(k)[0])}
+    data = json.dumps(names, indent=0, sort_keys=True).encode('utf-8')
+    pth = join(root, INCOMPRESSIBLE)
+    try:
+        with open(pth, 'rb') as fd:
+            if fd.read() == data:
+                return
+    except OSError:
+        pass
+    atomic_write(pth, data)
+
+
+def compress_static(root, jobs=1):
+    """Precompress the static files below `root` using `jobs` threads.
+
+    Return a tuple `(written, checked, removed)`: the number of written
+    compressed files, the number of checked static files and the number of
+    removed compressed files whose original file no longer exists.
+
+    """
+    compressors = {'.gz': gzip_compress}
+    br = get_brotli()
+    if br is not None:
+        compressors['.br'] = br
+    todo = []
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        names = set(filenames)
+        for fn in filenames:
+            pth = join(dirpath, fn)
+            base, ext = os.path.splitext(fn)
+            if ext in SUFFIXES and is_compressible(base):
+                if base not in names:
+                    os.remove(pth)
+                    removed += 1
+                continue
+            if is_compressible(fn) and os.path.getsize(pth) >= MIN_SIZE:
+                todo.append(pth)
+    incompressible = read_incompressible(root)
+    # zlib and brotli release the GIL while compressing, so threads help
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        written = sum(pool.map(
+            lambda pth: compress_file(pth, compressors, incompressible), todo))
+    write_incompressible(root, incompressible)
+    return written, len(todo), removed
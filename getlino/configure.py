@@ -5,7 +5,6 @@ import os
 import sys
 import stat
 import shutil
-import distro
 import configparser
 import subprocess
 import click
@@ -16,8 +15,10 @@ from contextlib import contextmanager
 from os.path import join
 
 from .utils import CONFIG, CONF_FILES, FOUND_CONFIG_FILES, DEFAULTSECTION
-from .utils import KNOWN_REPOS, DB_ENGINES, BATCH_HELP, FRONT_ENDS
-from .utils import Installer, ifroot
+from .utils import KNOWN_REPOS, DB_ENGINES, BATCH_HELP, JOBS_HELP, PLAN_HELP, TRACE_HELP, FRONT_ENDS
+from .utils import Installer, ifroot, apt_lists_age, apt_update_reason
+from .pgbouncer import use_pgbouncer, configure_pgbouncer
+from .tuning import site_db_loads, STORAGE_TYPES
 
 CERTBOT_AUTO_RENEW = """
 # generated by getlino
@@ -26,7 +27,8 @@ CERTBOT_AUTO_RENEW = """
 
 MONIT_CONF = """
 # generated by getlino
-check program status with path /usr/local/bin/healthcheck.sh
+check program status with path "{getlino_cmd} health"
+    with timeout 60 seconds
     if status != 0 then alert
 """
 
@@ -50,6 +52,11 @@ STATIC_ROOT = 'env/static_root'
 TIME_ZONE = "{time_zone}"
 """
 
+SHARED_REDIS_SETTINGS = """
+# the Redis server used by the sites for their cache and sessions
+REDIS_URL = 'redis://127.0.0.1:6379/0'
+"""
+
 BASH_ALIASES = """
 # generated by getlino
 alias a='. env/bin/activate'
@@ -137,6 +144,8 @@ add('--usergroup', 'www-data', "User group for files to be shared with the web s
 add('--supervisor-dir', '/etc/supervisor/conf.d', "Directory for supervisor config files", root_only=True)
 add('--env-link', 'env', "link to virtualenv (relative to project dir)")
 add('--repos-link', 'repositories', "link to code repositories (relative to virtualenv)")
+add('--env-templates/--no-env-templates', False,
+    "Whether to create the virtualenv of new sites by cloning a template virtualenv")
 add('--appy/--no-appy', ifroot, "Whether this server provides appypod and LibreOffice", root_only=True)
 add('--redis/--no-redis', ifroot, "Whether this server provides redis")
 add('--devtools/--no-devtools', lambda: not ifroot(),
@@ -145,9 +154,18 @@ add('--server-domain', 'localhost', "Domain name of this server")
 add('--https/--no-https', False, "Whether this server uses secure http", root_only=True)
 add('--ldap/--no-ldap', False, "Whether this server works as an LDAP server", root_only=True)
 add('--monit/--no-monit', True, "Whether this server uses monit", root_only=True)
+add('--apt-max-age', 24.0, "Maximum age in hours of the package lists "
+    "before getlino runs apt-get update", float, root_only=True)
 add('--db-engine', default_db_engine, "Default database engine for new sites.",
     click.Choice([e.name for e in DB_ENGINES]))
 add('--db-port', '', "Default database port to use for new sites.")
+add('--pgbouncer/--no-pgbouncer', False,
+    "Whether PostgreSQL sites connect via the PgBouncer connection pooler",
+    root_only=True)
+add('--expected-sites', 0, "Number of sites for which to tune the database server "
+    "(0 means the number of existing sites)", int, root_only=True)
+add('--db-storage', 'ssd', "Type of storage used by the database server",
+    click.Choice(STORAGE_TYPES), root_only=True)
 add('--db-host', 'localhost', "Default database host name for new sites.")
 add('--db-user', '', "Default database user name for new sites. Leave empty to use the project name.")
 add('--db-password', '', "Default database password for new sites. Leave empty to generate a secure password.")
@@ -161,12 +179,14 @@ add('--front-end', 'lino.modlib.extjs', "The front end to use on new sites",
     click.Choice([r.front_end for r in FRONT_ENDS]))
 
 
-def configure(ctx, batch,
+def configure(ctx, batch, jobs, plan, trace, upgrade, refresh,
               sites_base, local_prefix, shared_env, repos_base,
               clone, branch, webdav, backups_base, log_base, usergroup,
-              supervisor_dir, env_link, repos_link,
+              supervisor_dir, env_link, repos_link, env_templates,
               appy, redis, devtools, server_domain, https, ldap, monit,
-              db_engine, db_port, db_host,
+              apt_max_age,
+              db_engine, db_port, pgbouncer, expected_sites,
+              db_storage, db_host,
               db_user, db_password,
               admin_name, admin_email, time_zone,
               linod, languages, front_end):
@@ -194,7 +214,10 @@ def configure(ctx, batch,
         "django_settings_module": '',
         "dev_packages": ' '.join([a.nickname for a in KNOWN_REPOS if a.git_repo]),
         "pip_packages": '',
-        "python_path": ''
+        "pip_options": '',
+        "python_path": '',
+        # the command to use in scripts that run getlino
+        "getlino_cmd": "{} -m getlino.cli".format(sys.executable),
     })
 
     conffile = ifroot(CONF_FILES[0], CONF_FILES[1])
@@ -245,12 +268,8 @@ def configure(ctx, batch,
     if db_user and not db_password:
         raise click.Error("If you set a shared --db-user you must also set a shared --db-password")
 
-    if not i.yes_or_no("Start configuring your system using above options?"):
-        raise click.Abort()
-
-    with open(conffile, 'w') as fd:
-        CONFIG.write(fd)
-    click.echo("Wrote config file " + conffile)
+    # The steps below are first added to a plan and then run.  Independent
+    # steps can run in parallel when in batch mode.
 
     # click.echo("20200727 os.geteuid() is {}".format(os.geteuid()))
     if ifroot():
@@ -259,25 +278,44 @@ def configure(ctx, batch,
             # click.echo("20200727 Install monit...")
             # Debian buster didn't include monit for administrative reasons,
             # so we must add a backport.
-            if distro.id() == "debian" and distro.codename() == "buster":
-                click.echo("Add backport for monit on Debian buster...")
-                if batch or i.yes_or_no("Add backport for monit on Debian buster?", default=True):
-                    with i.override_batch(True):
-                        pth = Path("/etc/apt/sources.list.d/buster-backports.list")
-                        myline = "deb http://ftp.de.debian.org/debian buster-backports main"
-                        if pth.is_file():
-                            content = pth.open().read()
-                            if not myline in content:
-                                content += "\n" + myline + "\n"
-                        else:
-                            content = myline + "\n"
-                        i.write_file(pth, content)
-                        # i.runcmd('printf "%s\\n" "deb http://ftp.de.debian.org/debian buster-backports main" | sudo tee /etc/apt/sources.list.d/buster-backports.list')
-                        # i.runcmd('echo "deb http://ftp.de.debian.org/debian buster-backports main" >> /etc/apt/sources.list.d/buster-backports.list')
-        if batch or i.yes_or_no("Upgrade the system?", default=True):
+            if i.facts.distro_id == "debian" and i.facts.distro_codename == "buster":
+                def add_backport():
+                    click.echo("Add backport for monit on Debian buster...")
+                    if batch or i.yes_or_no("Add backport for monit on Debian buster?", default=True):
+                        with i.override_batch(True):
+                            pth = Path("/etc/apt/sources.list.d/buster-backports.list")
+                            myline = "deb http://ftp.de.debian.org/debian buster-backports main"
+                            if pth.is_file():
+                                content = pth.open().read()
+                                if not myline in content:
+                                    content += "\n" + myline + "\n"
+                            else:
+                                content = myline + "\n"
+                            i.write_file(pth, content)
+                            # i.runcmd('printf "%s\\n" "deb http://ftp.de.debian.org/debian buster-backports main" | sudo tee /etc/apt/sources.list.d/buster-backports.list')
+                            # i.runcmd('echo "deb http://ftp.de.debian.org/debian buster-backports main" >> /etc/apt/sources.list.d/buster-backports.list')
+                i.add_step('apt-sources', add_backport)
+
+        def update_system():
+            # The package lists are updated only when they are older than
+            # --apt-max-age.  Upgrading the system is done only on request.
+            age = apt_lists_age()
+            reason = apt_update_reason(
+                age, DEFAULTSECTION.getfloat('apt_max_age', 24.0), refresh)
             with i.override_batch(True):
-                i.runcmd("apt-get update -y")
-                i.runcmd("apt-get upgrade -y")
+                if reason:
+                    click.echo("Run apt-get update because {}.".format(reason))
+                    i.runcmd("apt-get update -y")
+                else:
+                    click.echo("Skip apt-get update because package lists are "
+                               "{:.1f} hours old.".format(age))
+                if upgrade or refresh:
+                    click.echo("Run apt-get upgrade because --{} was given.".format(
+                        'upgrade' if upgrade else 'refresh'))
+                    i.runcmd("apt-get upgrade -y")
+                else:
+                    click.echo("Skip apt-get upgrade (use --upgrade to run it).")
+        i.add_step('apt-update', update_system, ['apt-sources'])
 
     i.apt_install(
         "git subversion python3 python3-dev python3-setuptools python3-pip supervisor")
@@ -292,7 +330,7 @@ def configure(ctx, batch,
         i.apt_install("cron")
         i.apt_install("nginx uwsgi-plugin-python3")
         i.apt_install("logrotate")
-        i.must_restart('nginx')
+        i.apt_install("zstd pigz")  # multi-threaded compression of snapshots
 
     if DEFAULTSECTION.getboolean('devtools'):
         i.apt_install("graphviz sqlite3")
@@ -304,11 +342,9 @@ def configure(ctx, batch,
         i.apt_install("redis-server")
 
     i.apt_install(db_engine.apt_packages)
-    if db_engine.service:
-        i.must_restart(e.service)
 
-    if db_user:
-        db_engine.setup_user(i, context)
+    if ifroot() and use_pgbouncer():
+        i.apt_install("pgbouncer")
 
     if DEFAULTSECTION.getboolean('appy'):
         i.apt_install("libreoffice python3-uno")
@@ -318,20 +354,27 @@ def configure(ctx, batch,
         i.apt_install("slapd ldap-utils")
 
     if ifroot():
-        for k in ("log_base", "backups_base"):
-            pth = DEFAULTSECTION.get(k)
-            if not pth:
-                print("Strange: {} is empty...".format(k))
-                continue
-            if not os.path.exists(pth):
-                if batch or i.yes_or_no(
-                        "Create {} {} ?".format(k, pth), default=True):
-                    os.makedirs(pth, exist_ok=True)
-            i.check_permissions(pth)
+        def create_base_dirs():
+            for k in ("log_base", "backups_base"):
+                pth = DEFAULTSECTION.get(k)
+                if not pth:
+                    print("Strange: {} is empty...".format(k))
+                    continue
+                if not os.path.exists(pth):
+                    if batch or i.yes_or_no(
+                            "Create {} {} ?".format(k, pth), default=True):
+                        os.makedirs(pth, exist_ok=True)
+                i.check_permissions(pth)
+        i.add_step('base-dirs', create_base_dirs)
         i.apt_install("zip")
 
-    i.run_apt_install()
-    i.restart_services()
+    i.add_step('apt', i.run_apt_install, ['apt-update'])
+    if ifroot() and use_pgbouncer():
+        i.add_step('pgbouncer', lambda: configure_pgbouncer(i), ['apt'])
+    if ifroot():
+        # MySQL might ask for the password of its administrator
+        i.add_step('db-tune', lambda: db_engine.tune(i, site_db_loads()),
+                   ['apt'], interactive=db_engine.interactive)
 
     go_bases = []
 
@@ -343,107 +386,162 @@ def configure(ctx, batch,
         repos_base = DEFAULTSECTION.get('repos_base')
         if not repos_base:
             repos_base = join(shared_env, DEFAULTSECTION.get('repos_link'))
+        repos = [r for r in KNOWN_REPOS if r.git_repo]
 
-        if not os.path.exists(repos_base):
-            if batch or i.yes_or_no(
-                    "Create base directory for repositories {} ?".format(repos_base),
-                    default=True):
-                os.makedirs(repos_base, exist_ok=True)
-        i.check_permissions(repos_base)
+        def create_shared_env():
+            if not os.path.exists(repos_base):
+                if batch or i.yes_or_no(
+                        "Create base directory for repositories {} ?".format(repos_base),
+                        default=True):
+                    os.makedirs(repos_base, exist_ok=True)
+            i.check_permissions(repos_base)
+            i.check_virtualenv(shared_env, context)
+
+        def clone_repos():
+            if batch or i.yes_or_no("Clone repositories to {} ?".format(repos_base), default=True):
+                with i.override_batch(True):
+                    i.clone_repos(repos, repos_base, jobs)
 
-        i.check_virtualenv(shared_env, context)
-        os.chdir(repos_base)
-        repos = [r for r in KNOWN_REPOS if r.git_repo]
-        if batch or i.yes_or_no("Clone repositories to {} ?".format(repos_base), default=True):
-            with i.override_batch(True):
-                for repo in repos:
-                    i.clone_repo(repo)
-        if batch or i.yes_or_no("Install cloned repositories to {} ?".format(shared_env), default=True):
-            with i.override_batch(True):
-                for repo in repos:
-                    i.install_repo(repo, shared_env)
-        go_bases.append(repos_base)
+        def install_repos():
+            if batch or i.yes_or_no("Install cloned repositories to {} ?".format(shared_env), default=True):
+                with i.override_batch(True):
+                    i.install_repos(repos, shared_env, repos_base)
 
-    pth = DEFAULTSECTION.get('sites_base')
-    if not os.path.exists(pth):
-        if batch or i.yes_or_no("Create base directory for sites {} ?".format(pth), default=True):
-            os.makedirs(pth, exist_ok=True)
-    i.check_permissions(pth)
+        i.add_step('shared-env', create_shared_env)
+        i.add_step('clone', clone_repos, ['shared-env', 'apt'])
+        i.add_step('install-repos', install_repos, ['clone'])
+        go_bases.append(repos_base)
 
     local_prefix = DEFAULTSECTION.get('local_prefix')
-    pth = join(DEFAULTSECTION.get('sites_base'), local_prefix)
-    if os.path.exists(pth):
-        i.check_permissions(pth)
-    elif batch or i.yes_or_no("Create shared settings package {} ?".format(pth), default=True):
-        os.makedirs(pth, exist_ok=True)
+    local_pth = join(DEFAULTSECTION.get('sites_base'), local_prefix)
+
+    def create_sites_base():
+        pth = DEFAULTSECTION.get('sites_base')
+        if not os.path.exists(pth):
+            if batch or i.yes_or_no("Create base directory for sites {} ?".format(pth), default=True):
+                os.makedirs(pth, exist_ok=True)
         i.check_permissions(pth)
-    with i.override_batch(True):
+
+        pth = local_pth
+        if os.path.exists(pth):
+            i.check_permissions(pth)
+        elif batch or i.yes_or_no("Create shared settings package {} ?".format(pth), default=True):
+            os.makedirs(pth, exist_ok=True)
+            i.check_permissions(pth)
+        with i.override_batch(True):
+            i.check_permissions(pth)
+            i.write_file(join(pth, '__init__.py'), '')
+        content = SHARED_SETTINGS.format(**DEFAULTSECTION)
+        if DEFAULTSECTION.getboolean('redis'):
+            content += SHARED_REDIS_SETTINGS
+        i.write_file(join(pth, 'settings.py'), content)
+    i.add_step('sites-base', create_sites_base)
+    go_bases.append(local_pth)
+
+    def write_bash_aliases():
+        pth = ifroot('/etc/getlino/lino_bash_aliases', os.path.expanduser('~/.lino_bash_aliases'))
+        ctx = dict(DEFAULTSECTION)
+        content = BASH_ALIASES.format(**ctx)
+        if len(go_bases):
+            ctx.update(go_bases=" ".join(go_bases))
+            content += BASH_ALIASES_GO.format(**ctx)
+        if DEFAULTSECTION.getboolean('devtools'):
+            content += BASH_ALIASES_DEV
+        i.write_file(pth, content)
         i.check_permissions(pth)
-        i.write_file(join(pth, '__init__.py'), '')
-    i.write_file(join(pth, 'settings.py'),
-                 SHARED_SETTINGS.format(**DEFAULTSECTION))
-    go_bases.append(pth)
-
-    pth = ifroot('/etc/getlino/lino_bash_aliases', os.path.expanduser('~/.lino_bash_aliases'))
-    ctx = dict(DEFAULTSECTION)
-    content = BASH_ALIASES.format(**ctx)
-    if len(go_bases):
-        ctx.update(go_bases=" ".join(go_bases))
-        content += BASH_ALIASES_GO.format(**ctx)
-    if DEFAULTSECTION.getboolean('devtools'):
-        content += BASH_ALIASES_DEV
-    i.write_file(pth, content)
-    i.check_permissions(pth)
-    click.echo("Note: please add manually the following line to your .bashrc file:\nsource {}".format(pth))
+        click.echo("Note: please add manually the following line to your .bashrc file:\nsource {}".format(pth))
+    i.add_step('bash-aliases', write_bash_aliases)
 
     if ifroot():
-        i.write_logrotate_conf(
-            'supervisor.conf', '/var/log/supervisor/supervisord.log')
-        i.must_restart('supervisor')
+        def write_logrotate_conf():
+            i.write_logrotate_conf(
+                'supervisor.conf', '/var/log/supervisor/supervisord.log')
+        i.add_step('logrotate', write_logrotate_conf, ['apt'])
 
         if DEFAULTSECTION.getboolean('monit'):
-            pth = '/usr/local/bin/healthcheck.sh'
-            i.jinja_write(pth, **context)
-            i.check_permissions(pth, executable=True)
-            i.write_file('/etc/monit/conf.d/lino.conf', MONIT_CONF)
-            # seems that monit creates its own logrotate config file
-            # i.write_logrotate_conf(
-            #     'monit.conf', '/var/log/monit.log')
+            def write_monit_conf():
+                pth = '/usr/local/bin/healthcheck.sh'
+                i.jinja_write(pth, **context)
+                i.check_permissions(pth, executable=True)
+                if i.write_file('/etc/monit/conf.d/lino.conf',
+                                MONIT_CONF.format(**context)):
+                    i.must_reload('monit')
+                # seems that monit creates its own logrotate config file
+                # i.write_logrotate_conf(
+                #     'monit.conf', '/var/log/monit.log')
+            i.add_step('monit', write_monit_conf, ['apt'])
 
         if DEFAULTSECTION.getboolean('appy'):
-            i.write_supervisor_conf(
-                'libreoffice.conf',
-                LIBREOFFICE_SUPERVISOR_CONF.format(**DEFAULTSECTION))
-            i.must_restart('supervisor')
+            def write_libreoffice_conf():
+                i.write_supervisor_conf(
+                    'libreoffice.conf',
+                    LIBREOFFICE_SUPERVISOR_CONF.format(**DEFAULTSECTION))
+            i.add_step('libreoffice', write_libreoffice_conf, ['apt'])
 
         # if DEFAULTSECTION.get('db_engine') == 'mysql':
         #     i.runcmd("mysql_secure_installation")
         # not tested because it interactively asks for root password
 
         if DEFAULTSECTION.getboolean('https'):
-            if shutil.which("certbot-auto"):
-                click.echo("certbot-auto already installed")
-            elif batch or i.yes_or_no("Install certbot-auto?", default=True):
-                with i.override_batch(True):
-                    i.runcmd("wget https://dl.eff.org/certbot-auto")
-                    i.runcmd("mv certbot-auto /usr/local/bin/certbot-auto")
-                    i.runcmd("chown root /usr/local/bin/certbot-auto")
-                    i.runcmd("chmod 0755 /usr/local/bin/certbot-auto")
-                    i.runcmd("certbot-auto -n")
-                    i.runcmd("certbot-auto register --agree-tos -m {} -n".format(DEFAULTSECTION.get('admin_email')))
-            if batch or i.yes_or_no("Set up automatic certificate renewal?", default=True):
-                i.write_file('/etc/cron.d/getlino-certbot.conf', CERTBOT_AUTO_RENEW)
+            def install_certbot():
+                if shutil.which("certbot-auto"):
+                    click.echo("certbot-auto already installed")
+                elif batch or i.yes_or_no("Install certbot-auto?", default=True):
+                    with i.override_batch(True):
+                        i.runcmd("wget https://dl.eff.org/certbot-auto")
+                        i.runcmd("mv certbot-auto /usr/local/bin/certbot-auto")
+                        i.runcmd("chown root /usr/local/bin/certbot-auto")
+                        i.runcmd("chmod 0755 /usr/local/bin/certbot-auto")
+                        i.runcmd("certbot-auto -n")
+                        i.runcmd("certbot-auto register --agree-tos -m {} -n".format(DEFAULTSECTION.get('admin_email')))
+                if batch or i.yes_or_no("Set up automatic certificate renewal?", default=True):
+                    i.write_file('/etc/cron.d/getlino-certbot.conf', CERTBOT_AUTO_RENEW)
+            i.add_step('certbot', install_certbot, ['apt'], interactive=True)
 
         if DEFAULTSECTION.getboolean('ldap'):
-            i.runcmd("dpkg-reconfigure slapd")
+            i.add_step('ldap', lambda: i.runcmd("dpkg-reconfigure slapd"),
+                       ['apt'], interactive=True)
+
+    # activate the changes of the system configuration before creating the
+    # database user
+    i.add_step('services', i.restart_services, [
+        'apt', 'pgbouncer', 'db-tune', 'logrotate', 'monit', 'libreoffice'])
+
+    if db_user:
+        i.add_step('db-user', lambda: db_engine.setup_user(i, context),
+                   ['services'], interactive=True)
+
+    if plan:
+        i.print_plan()
+        return
+
+    if not i.yes_or_no("Start configuring your system using above options?"):
+        raise click.Abort()
+
+    with i.lock():
+        with open(conffile, 'w') as fd:
+            CONFIG.write(fd)
+        click.echo("Wrote config file " + conffile)
 
-    i.restart_services()
+        i.run_plan(jobs)
+        i.restart_services()
+        i.print_summary()
+        i.write_trace(trace)
 
     click.echo("getlino configure completed.")
 
 
 params = [
              click.Option(['--batch/--no-batch'], default=False, help=BATCH_HELP),
+             click.Option(['--jobs'], default=4, type=int, help=JOBS_HELP),
+             click.Option(['--plan/--no-plan'], default=False, help=PLAN_HELP),
+             click.Option(['--trace'], default=None,
+                          type=click.Path(dir_okay=False), help=TRACE_HELP),
+             click.Option(['--upgrade/--no-upgrade'], default=False,
+                          help="Whether to upgrade the installed system packages."),
+             click.Option(['--refresh/--no-refresh'], default=False,
+                          help="Whether to run apt-get update and upgrade "
+                               "regardless of the age of the package lists."),
          ] + CONFIGURE_OPTIONS
 configure = click.pass_context(configure)
 configure = click.Command('configure', callback=configure,
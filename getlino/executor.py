@@ -0,0 +1,125 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Run the shell commands of getlino.
+
+Every :class:`Installer <getlino.utils.Installer>` runs its shell commands
+through an *executor*.  The default :class:`Executor` runs them as
+subprocesses.  A :class:`RecordingExecutor` records them and can replay a
+recording, which is used by the test suite and the benchmarks to run the
+complete :cmd:`getlino configure` and :cmd:`getlino startsite` flows without
+actually installing anything.
+
+"""
+
+import json
+import fnmatch
+import threading
+import subprocess
+import click
+
+
+class Executor(object):
+    """Runs shell commands as subprocesses."""
+
+    def run(self, cmd, output=None, input=None, **kw):
+        """Run the shell command `cmd` and return its return code.
+
+        When `output` is given, it is called with every line written by the
+        subprocess to stdout or stderr.  Otherwise the subprocess writes
+        directly to the terminal.  `input` is a string to send to the stdin
+        of the subprocess (e.g. a SQL script).  Other keyword arguments are
+        forwarded to :mod:`subprocess` (e.g. `cwd`).
+        """
+        kw.update(shell=True)
+        kw.update(universal_newlines=True)
+        if output is None:
+            return subprocess.run(cmd, input=input, **kw).returncode
+        kw.update(stdout=subprocess.PIPE)
+        kw.update(stderr=subprocess.STDOUT)
+        if input is not None:
+            kw.update(stdin=subprocess.PIPE)
+        p = subprocess.Popen(cmd, **kw)
+        if input is not None:
+            # feed the input in another thread so that a subprocess which
+            # writes much output before reading all its input cannot block us
+            def feed():
+                try:
+                    with p.stdin:
+                        p.stdin.write(input)
+                except OSError:  # the subprocess ended before reading it
+                    pass
+            threading.Thread(target=feed, daemon=True).start()
+        for ln in p.stdout:
+            output(ln.rstrip())
+        return p.wait()
+
+
+class RecordingExecutor(Executor):
+    """An executor that records the commands it is asked to run.
+
+    `replay` is a list of dicts with the keys `cmd`, `returncode` and
+    `output` (a list of lines), e.g. the :attr:`commands` of another
+    recording.  When asked to run a command, we use the first unused entry
+    whose `cmd` is equal to the command or matches it as a shell-style
+    pattern (e.g. ``"pip install *"``).  Commands without an entry in the
+    replay succeed without output, unless `passthrough` is True, in which case
+    they are actually run (and their output is recorded).
+
+    Safe to be used by several threads at the same time.
+
+    """
+
+    def __init__(self, replay=(), passthrough=False):
+        self.replay = [dict(e) for e in replay]
+        self.passthrough = passthrough
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def find(self, cmd):
+        """Return and consume the replay entry for `cmd`, or `None`."""
+        with self._lock:
+            for e in self.replay:
+                if e['cmd'] == cmd:
+                    self.replay.remove(e)
+                    return e
+            for e in self.replay:
+                if fnmatch.fnmatchcase(cmd, e['cmd']):
+                    self.replay.remove(e)
+                    return e
+        return None
+
+    def run(self, cmd, output=None, input=None, **kw):
+        entry = self.find(cmd)
+        if entry is not None:
+            lines = list(entry.get('output', []))
+            returncode = entry.get('returncode', 0)
+        elif self.passthrough:
+            lines = []
+            returncode = super().run(cmd, lines.append, input, **kw)
+        else:
+            lines = []
+            returncode = 0
+        entry = dict(cmd=cmd, returncode=returncode, output=lines)
+        if input is not None:
+            entry.update(input=input)
+        with self._lock:
+            self.commands.append(entry)
+        for ln in lines:
+            if output is None:
+                click.echo(ln)
+            else:
+                output(ln)
+        return returncode
+
+    def save(self, fn):
+        """Write the recorded commands to the JSON file `fn`."""
+        with open(fn, 'w') as fd:
+            json.dump(self.commands, fd, indent=1)
+
+    @classmethod
+    def load(cls, fn, **kwargs):
+        """Return an executor that replays the recording in JSON file
+        `fn`."""
+        with open(fn) as fd:
+            return cls(json.load(fd), **kwargs)
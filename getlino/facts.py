@@ -0,0 +1,232 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Facts about the machine on which getlino is running.
+
+Collecting these facts takes time (asking :mod:`distro`, running
+:cmd:`dpkg-query`, looking up group names, ...), so we collect them only once
+and store them in a cache file, which is reused by subsequent invocations as
+long as its invalidation key doesn't change.
+
+The facts are available as :attr:`Installer.facts
+<getlino.utils.Installer.facts>` and as a variable ``facts`` in every template.
+
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+from os.path import join, expanduser
+from functools import lru_cache
+try:
+    import grp
+except ImportError:
+    grp = None  # e.g. on Windows
+
+from .setup_info import SETUP_INFO
+
+# increment this when the structure of the collected facts changes
+FACTS_VERSION = 2
+
+CACHE_FILENAME = 'facts.json'
+
+# Files whose modification time changes when the facts might have changed.
+# /var/lib/dpkg/status changes with every apt-get install, /etc/os-release
+# with a distribution upgrade and /etc/group when group memberships change.
+# The invalidation key also contains the content of
+# /proc/sys/kernel/random/boot_id, which changes with every reboot (which is
+# when the number of CPUs and the RAM can change).
+WATCHED_FILES = ['/var/lib/dpkg/status', '/etc/os-release', '/etc/group']
+
+# The command-line tools whose availability getlino might want to know.
+TOOLS = """
+apt-get dpkg-query sudo git pip3 nginx uwsgi supervisorctl monit
+mysql psql pgbouncer redis-server libreoffice certbot-auto
+zip gzip pigz zstd brotli
+""".split()
+
+
+@lru_cache(maxsize=None)
+def is_root():
+    return hasattr(os, 'geteuid') and os.geteuid() == 0
+
+
+def default_cache_dir():
+    if is_root():
+        return '/var/cache/getlino'
+    return expanduser('~/.cache/getlino')
+
+
+class Facts(object):
+    """The collected facts about this machine.
+
+    .. attribute:: distro_id
+    .. attribute:: distro_name
+    .. attribute:: distro_codename
+    .. attribute:: cpu_count
+    .. attribute:: mem_total
+
+        Total amount of physical memory, in bytes.
+
+    .. attribute:: packages
+
+        The set of installed system packages.
+
+    .. attribute:: groups
+
+        The names of the user groups we belong to.
+
+    .. attribute:: tools
+
+        A dict mapping every available tool of :data:`TOOLS` to its full path.
+
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+        self.packages = set(self.packages)
+
+    @property
+    def mem_total_mb(self):
+        return self.mem_total // (1024 * 1024)
+
+    def as_dict(self):
+        d = dict(self.__dict__)
+        d.update(packages=sorted(self.packages))
+        return d
+
+
+def invalidation_key():
+    """Return a string that changes whenever the cached facts might be
+    outdated.
+
+    This must be cheap to compute.
+    """
+    parts = [SETUP_INFO['version'], str(FACTS_VERSION), os.environ.get('PATH', '')]
+    if hasattr(os, 'geteuid'):
+        parts.append(str(os.geteuid()))
+        parts.append(' '.join([str(g) for g in os.getgroups()]))
+    for fn in WATCHED_FILES:
+        try:
+            parts.append("{}={}".format(fn, os.stat(fn).st_mtime_ns))
+        except OSError:
+            parts.append(fn)
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as fd:
+            parts.append(fd.read().strip())
+    except OSError:
+        pass
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def get_cpu_count():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_mem_total():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def get_installed_packages():
+    """Return the names of all installed system packages, using a single call
+    to :cmd:`dpkg-query`."""
+    if shutil.which('dpkg-query') is None:
+        return []
+    cp = subprocess.run(
+        ['dpkg-query', '-W', '-f', '${Package}\t${db:Status-Abbrev}\n'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True)
+    packages = []
+    for ln in cp.stdout.splitlines():
+        name, _, status = ln.partition('\t')
+        # "ii" means desired=install and status=installed, "hi" is the same
+        # for a package on hold
+        if status[:2] in ('ii', 'hi'):
+            packages.append(name)
+    return packages
+
+
+def get_group_names():
+    if grp is None or not hasattr(os, 'getgroups'):
+        return []
+    names = []
+    for gid in os.getgroups():
+        try:
+            names.append(grp.getgrgid(gid).gr_name)
+        except KeyError:
+            pass
+    return names
+
+
+def collect_facts(key):
+    import distro
+    tools = {}
+    for name in TOOLS:
+        pth = shutil.which(name)
+        if pth:
+            tools[name] = pth
+    return Facts(
+        key=key,
+        euid=os.geteuid() if hasattr(os, 'geteuid') else None,
+        distro_id=distro.id(),
+        distro_name=distro.name(pretty=True),
+        distro_codename=distro.codename(),
+        distro_version=distro.version(),
+        cpu_count=get_cpu_count(),
+        mem_total=get_mem_total(),
+        packages=get_installed_packages(),
+        groups=get_group_names(),
+        tools=tools)
+
+
+def load_facts(fn, key):
+    """Return the facts cached in file `fn` or `None` if there is no such file
+    or if its invalidation key is not `key`.
+    """
+    try:
+        with open(fn) as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if data.get('key') != key:
+        return None
+    return Facts(**data)
+
+
+def save_facts(fn, facts):
+    """Store the facts to file `fn`.  Silently skip if we cannot write."""
+    # imported here because utils imports this module
+    from .utils import atomic_write
+    data = json.dumps(facts.as_dict(), indent=1).encode('utf-8')
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        atomic_write(fn, data)
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_facts(cache_dir=None):
+    """Return the facts about this machine, collecting them only when the
+    cached facts are outdated."""
+    fn = join(cache_dir or default_cache_dir(), CACHE_FILENAME)
+    key = invalidation_key()
+    facts = load_facts(fn, key)
+    if facts is None:
+        facts = collect_facts(key)
+        save_facts(fn, facts)
+    return facts
+
+
+def invalidate_facts():
+    """Forget the facts of this process, e.g. after installing system
+    packages.  The next call to :func:`get_facts` will check the invalidation
+    key again."""
+    get_facts.cache_clear()
@@ -0,0 +1,239 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""The :cmd:`getlino health` command.
+
+Sends a real request to every site of this server and measures how long it
+takes to get the response.  The request is sent either directly to the uwsgi
+socket of the site (speaking the uwsgi protocol, so that nginx is not
+involved) or to nginx.
+
+"""
+
+import os
+import json
+import time
+import socket
+import struct
+import subprocess
+import click
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import DEFAULTSECTION, USE_NGINX, ifroot, get_project_dir
+
+# exit codes, as used by monitoring tools
+OK, WARNING, CRITICAL = 0, 1, 2
+
+STATES = {OK: 'ok', WARNING: 'warning', CRITICAL: 'critical'}
+
+# the maximum number of bytes to read from a response
+MAX_RESPONSE = 1024 * 1024
+
+
+def get_sites():
+    """Return the names of the sites of this server that run under uwsgi."""
+    base = join(DEFAULTSECTION.get('sites_base'), DEFAULTSECTION.get('local_prefix'))
+    if not os.path.isdir(base):
+        return []
+    return [prjname for prjname in sorted(os.listdir(base))
+            if os.path.exists(join(base, prjname, 'nginx', 'uwsgi.ini'))]
+
+
+def get_site_domain(prjname):
+    """Return the domain name of site `prjname` as set by :cmd:`getlino
+    startsite`."""
+    server_domain = DEFAULTSECTION.get('server_domain')
+    if ifroot() and USE_NGINX:
+        return prjname + "." + server_domain
+    return server_domain
+
+
+def uwsgi_packet(variables):
+    """Return a uwsgi request packet with the given dict of variables."""
+    body = b''
+    for k, v in variables.items():
+        k = k.encode('utf-8')
+        v = v.encode('utf-8')
+        body += struct.pack('<H', len(k)) + k + struct.pack('<H', len(v)) + v
+    # modifier1 = 0 means a WSGI request, modifier2 is unused
+    return struct.pack('<BHB', 0, len(body), 0) + body
+
+
+def parse_status(response):
+    """Return the status code of the given raw HTTP response."""
+    line = response.split(b'\r\n', 1)[0].decode('latin-1')
+    parts = line.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise ValueError("Invalid response {!r}".format(line[:80]))
+    return int(parts[1])
+
+
+def uwsgi_request(sockpath, host, path='/', timeout=10, https=False):
+    """Send a GET request for `path` to the uwsgi socket `sockpath` and
+    return the status code of the response."""
+    variables = {
+        'REQUEST_METHOD': 'GET',
+        'REQUEST_URI': path,
+        'PATH_INFO': path.split('?')[0],
+        'QUERY_STRING': path.split('?')[1] if '?' in path else '',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '443' if https else '80',
+        'HTTP_HOST': host,
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_USER_AGENT': 'getlino health',
+    }
+    if https:
+        variables['UWSGI_SCHEME'] = 'https'
+        variables['HTTPS'] = 'on'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(sockpath)
+        s.sendall(uwsgi_packet(variables))
+        response = b''
+        while len(response) < MAX_RESPONSE:
+            data = s.recv(65536)
+            if not data:
+                break
+            response += data
+    return parse_status(response)
+
+
+def http_request(host, path='/', timeout=10, address='127.0.0.1', port=80):
+    """Send a GET request for `path` with the given `host` header to the web
+    server at `address` and return the status code of the response."""
+    import http.client
+    conn = http.client.HTTPConnection(address, port, timeout=timeout)
+    try:
+        conn.request('GET', path, headers={
+            'Host': host, 'User-Agent': 'getlino health'})
+        response = conn.getresponse()
+        response.read(MAX_RESPONSE)
+        return response.status
+    finally:
+        conn.close()
+
+
+def probe_site(prjname, via='socket', path='/', timeout=10):
+    """Send a request to site `prjname` and return a dict with the result:
+    the status code (or `None`), the response time in seconds and an error
+    message (or `None`)."""
+    import http.client
+    host = get_site_domain(prjname)
+    started = time.monotonic()
+    status = error = None
+    try:
+        if via == 'socket':
+            sockpath = join(get_project_dir(prjname), 'nginx.sock')
+            status = uwsgi_request(sockpath, host, path, timeout,
+                                   DEFAULTSECTION.getboolean('https', False))
+        else:
+            status = http_request(host, path, timeout)
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        error = str(e) or e.__class__.__name__
+    return dict(site=prjname, status=status, error=error,
+                seconds=round(time.monotonic() - started, 3))
+
+
+def evaluate(result, warning=2.0, critical=10.0):
+    """Return the state of the given probe `result`: :data:`CRITICAL` when
+    the request failed, when the status code is not a success or a
+    redirection, or when it took longer than `critical` seconds,
+    :data:`WARNING` when it took longer than `warning` seconds, otherwise
+    :data:`OK`."""
+    if result['error'] or not (200 <= result['status'] < 400):
+        return CRITICAL
+    if result['seconds'] > critical:
+        return CRITICAL
+    if result['seconds'] > warning:
+        return WARNING
+    return OK
+
+
+# the states of a supervisor program, see
+# http://supervisord.org/subprocess.html#process-states
+SUPERVISOR_STATES = {'STOPPED', 'STARTING', 'RUNNING', 'BACKOFF', 'STOPPING',
+                     'EXITED', 'FATAL', 'UNKNOWN'}
+
+
+def supervisor_results():
+    """Return a result for every supervisor program that is not running.
+
+    Return a single result when :cmd:`supervisorctl` cannot be run or
+    doesn't report the state of any program.
+    """
+    try:
+        cp = subprocess.run(
+            ['supervisorctl', 'status'], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+    except OSError as e:
+        return [dict(site='supervisor', status=None, seconds=0,
+                     error="cannot run supervisorctl: {}".format(e))]
+    results = []
+    found = False
+    for ln in cp.stdout.splitlines():
+        parts = ln.split()
+        # other lines are e.g. error messages or the output of a program
+        if len(parts) < 2 or parts[1] not in SUPERVISOR_STATES:
+            continue
+        found = True
+        if parts[1] != 'RUNNING':
+            results.append(dict(
+                site=parts[0], status=None, seconds=0,
+                error="supervisor program is {}".format(parts[1])))
+    if not found and cp.returncode != 0:
+        return [dict(site='supervisor', status=None, seconds=0,
+                     error="supervisorctl failed: {}".format(cp.stdout.strip()))]
+    return results
+
+
+@click.command()
+@click.argument('sites', nargs=-1)
+@click.option('--via', type=click.Choice(['socket', 'http']), default='socket',
+              help="Whether to send the requests directly to the uwsgi socket "
+                   "of every site or to nginx.")
+@click.option('--path', default='/', help="The URL path to request.")
+@click.option('--warning', default=2.0, type=float,
+              help="Response time in seconds above which a site is in "
+                   "warning state.")
+@click.option('--critical', default=10.0, type=float,
+              help="Response time in seconds above which a site is in "
+                   "critical state.  Also the timeout for every request.")
+@click.option('--supervisor/--no-supervisor', default=lambda: ifroot(),
+              help="Whether to also check that all supervisor programs "
+                   "are running.")
+@click.option('--json', 'as_json', is_flag=True,
+              help="Print the results as JSON.")
+@click.option('--jobs', default=8, type=int,
+              help="Maximum number of sites to probe at the same time.")
+@click.pass_context
+def health(ctx, sites, via, path, warning, critical, supervisor, as_json, jobs):
+    """
+    Check whether the sites of this server respond quickly.
+
+    SITES are the names of the sites to check.  Default is all sites of this
+    server.  Exits with 1 when some site is in warning state and with 2 when
+    some site is in critical state.
+    """
+    sites = list(sites) or get_sites()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(
+            lambda prjname: probe_site(prjname, via, path, critical), sites))
+    if supervisor:
+        results += supervisor_results()
+    for r in results:
+        r['state'] = STATES[evaluate(r, warning, critical)]
+    if as_json:
+        click.echo(json.dumps(results, indent=1))
+    else:
+        for r in results:
+            msg = "{state:<8} {site} {seconds:.3f}s".format(**r)
+            if r['status'] is not None:
+                msg += " HTTP {}".format(r['status'])
+            if r['error']:
+                msg += " " + r['error']
+            click.echo(msg)
+        if not results:
+            click.echo("No sites to check.")
+    ctx.exit(max([evaluate(r, warning, critical) for r in results] or [OK]))
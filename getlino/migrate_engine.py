@@ -0,0 +1,69 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""The :cmd:`getlino migrate-engine` command.
+
+Sites created by older versions of getlino on a MySQL server use the MyISAM
+storage engine.  This command converts their tables to InnoDB, which has row
+level locking and is crash safe.
+
+"""
+
+import os
+import shlex
+import click
+from os.path import join
+
+from .utils import DEFAULTSECTION, BATCH_HELP
+from .utils import Installer, get_project_dir
+
+OLD_INIT_COMMAND = "SET default_storage_engine=MyISAM"
+NEW_INIT_COMMAND = "SET default_storage_engine=InnoDB"
+
+# Run by manage.py shell.  Uses the database connection of the site, so we
+# don't need the password of the database administrator.
+CONVERT_SCRIPT = """
+from django.db import connection
+with connection.cursor() as c:
+    c.execute("SELECT TABLE_NAME FROM information_schema.TABLES "
+              "WHERE TABLE_SCHEMA = DATABASE() AND ENGINE = %s", [{engine!r}])
+    tables = [row[0] for row in c.fetchall()]
+    for name in tables:
+        print("Convert table {{}} to {new}".format(name))
+        c.execute("ALTER TABLE `{{}}` ENGINE={new}".format(name))
+print("Converted {{}} tables to {new}.".format(len(tables)))
+"""
+
+
+@click.command('migrate-engine')
+@click.argument('prjname')
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+def migrate_engine(prjname, batch):
+    """
+    Convert the MyISAM tables of a site to InnoDB.
+
+    PRJNAME is the name of the site.  The site must use MySQL.  The tables
+    are locked while they are being converted, so better run this when
+    nobody is working, and make a snapshot before.
+    """
+    i = Installer(batch)
+    project_dir = get_project_dir(prjname)
+    pth = join(project_dir, 'settings.py')
+    if not os.path.exists(pth):
+        raise click.ClickException(
+            "{} does not exist.  Is {} a site on this server?".format(
+                pth, prjname))
+    with open(pth) as fd:
+        content = fd.read()
+    if 'django.db.backends.mysql' not in content:
+        raise click.ClickException("Site {} doesn't use MySQL.".format(prjname))
+    if not i.yes_or_no("Convert the tables of {} to InnoDB?".format(prjname)):
+        raise click.Abort()
+    envdir = join(project_dir, DEFAULTSECTION.get('env_link'))
+    script = CONVERT_SCRIPT.format(engine='MyISAM', new='InnoDB')
+    with i.lock(), i.override_batch(True):
+        # new tables must be created with the new engine as well
+        i.update_file(pth, content.replace(OLD_INIT_COMMAND, NEW_INIT_COMMAND))
+        i.run_in_env(envdir, "python manage.py shell -c {}".format(
+            shlex.quote(script)), cwd=project_dir)
+        i.print_summary()
@@ -0,0 +1,154 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Connection pooling for PostgreSQL sites using PgBouncer.
+
+Every uwsgi process, :manage:`linod` and cron job of every site opens its own
+PostgreSQL connection.  With :option:`getlino configure --pgbouncer`, the
+sites connect to a local PgBouncer instead, which shares a small number of
+server connections among them (in *transaction pooling* mode).
+
+:cmd:`getlino configure` writes the main configuration file
+:xfile:`/etc/pgbouncer/pgbouncer.ini`, which includes the list of databases
+maintained by :cmd:`getlino startsite` in
+:xfile:`/etc/pgbouncer/getlino-databases.ini`.  The credentials of the site
+users are in :xfile:`/etc/pgbouncer/userlist.txt`.
+
+"""
+
+import os
+import re
+import shutil
+from os.path import join
+
+from .utils import DEFAULTSECTION, ifroot
+
+PGBOUNCER_DIR = '/etc/pgbouncer'
+PGBOUNCER_INI = join(PGBOUNCER_DIR, 'pgbouncer.ini')
+DATABASES_INI = join(PGBOUNCER_DIR, 'getlino-databases.ini')
+USERLIST_TXT = join(PGBOUNCER_DIR, 'userlist.txt')
+
+# the address where the sites connect to PgBouncer
+PGBOUNCER_HOST = '127.0.0.1'
+PGBOUNCER_PORT = 6432
+
+PGBOUNCER_CONF = """
+; generated by getlino
+[databases]
+%include {databases_ini}
+
+[pgbouncer]
+listen_addr = {host}
+listen_port = {port}
+unix_socket_dir = /var/run/postgresql
+auth_type = md5
+auth_file = {userlist_txt}
+admin_users = postgres
+pool_mode = transaction
+max_client_conn = {max_client_conn}
+default_pool_size = {default_pool_size}
+reserve_pool_size = 2
+server_idle_timeout = 60
+ignore_startup_parameters = extra_float_digits
+logfile = /var/log/postgresql/pgbouncer.log
+pidfile = /var/run/postgresql/pgbouncer.pid
+"""
+
+DATABASE_LINE = "{name} = host={host} port={port} dbname={name}"
+
+# lines of the databases file and of the userlist
+DATABASE_RE = re.compile(r'^(\S+)\s*=')
+USER_RE = re.compile(r'^"((?:[^"]|"")*)"')
+
+
+def use_pgbouncer():
+    """Whether the sites on this server connect to PostgreSQL via
+    PgBouncer."""
+    return DEFAULTSECTION.getboolean('pgbouncer', False) and \
+        DEFAULTSECTION.get('db_engine') == 'postgresql'
+
+
+def pgbouncer_conf(facts):
+    """Return the content of :xfile:`pgbouncer.ini`.
+
+    The pool size of a database is the number of server connections per
+    database and user.  It depends on the number of CPUs because PostgreSQL
+    cannot run more queries in parallel anyway.
+    """
+    return PGBOUNCER_CONF.format(
+        databases_ini=DATABASES_INI, userlist_txt=USERLIST_TXT,
+        host=PGBOUNCER_HOST, port=PGBOUNCER_PORT,
+        max_client_conn=1000,
+        default_pool_size=max(5, 2 * facts.cpu_count))
+
+
+def quote_userlist(s):
+    return '"' + s.replace('"', '""') + '"'
+
+
+def merge_lines(content, new, regex):
+    """Return `content` with the lines `new` merged into it.  A new line
+    replaces the old line with the same key (as matched by `regex`)."""
+    keys = {}
+    for ln in new:
+        keys[regex.match(ln).group(1)] = ln
+    lines = []
+    for ln in content.splitlines():
+        m = regex.match(ln)
+        if m and m.group(1) in keys:
+            continue
+        if ln.strip():
+            lines.append(ln)
+    return '\n'.join(lines + new) + '\n'
+
+
+def read_file(pth):
+    if not os.path.exists(pth):
+        return ''
+    with open(pth) as fd:
+        return fd.read()
+
+
+def write_private_file(i, pth, content):
+    """Write a file that must be readable only by PgBouncer.  Return True if
+    it has changed."""
+    changed = i.update_file(pth, content)
+    if changed and ifroot():
+        shutil.chown(pth, 'postgres', 'postgres')
+        os.chmod(pth, 0o640)
+    return changed
+
+
+def configure_pgbouncer(i):
+    """Write the configuration files of PgBouncer."""
+    if i.update_file(PGBOUNCER_INI, pgbouncer_conf(i.facts)):
+        i.must_restart('pgbouncer')
+    for pth in (DATABASES_INI, USERLIST_TXT):
+        if not os.path.exists(pth):
+            write_private_file(i, pth, "; generated by getlino\n")
+
+
+def register_databases(i, sites):
+    """Register the given databases in PgBouncer.
+
+    `sites` is a list of `(database, user, password)` tuples.  An existing
+    entry for a same database or user is replaced.  PgBouncer is reloaded
+    immediately so that the sites can use their database.
+    """
+    db_host = DEFAULTSECTION.get('db_host') or 'localhost'
+    db_port = DEFAULTSECTION.get('db_port') or '5432'
+    databases = [DATABASE_LINE.format(name=db, host=db_host, port=db_port)
+                 for db, user, password in sites]
+    users = []
+    for db, user, password in sites:
+        ln = "{} {}".format(quote_userlist(user), quote_userlist(password))
+        if ln not in users:
+            users.append(ln)
+    changed = write_private_file(i, DATABASES_INI, merge_lines(
+        read_file(DATABASES_INI), databases, DATABASE_RE))
+    if write_private_file(i, USERLIST_TXT, merge_lines(
+            read_file(USERLIST_TXT), users, USER_RE)):
+        changed = True
+    if changed:
+        with i.override_batch(True):
+            i.runcmd("sudo service pgbouncer reload")
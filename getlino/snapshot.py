@@ -0,0 +1,575 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""The :cmd:`getlino snapshot` command.
+
+A snapshot of a site contains a Python dump of its database (made by
+:cmd:`dump2py`), the output of :cmd:`pip freeze`, its local fixtures, the
+:file:`media/webdav` and :file:`media/beid` directories and the :file:`*.py`
+and :file:`*.sh` files of the project directory.
+
+The snapshots of all sites of a server are stored in a single *repository*,
+a directory :file:`repository` below the :option:`getlino configure
+--backups-base`.  Every file is split into chunks, and every chunk is stored
+only once, in a compressed file named after the SHA-256 hash of its content.
+So a file that didn't change since the previous snapshot (e.g. a big document
+in :file:`media/webdav`, or the dump of a table that didn't change) doesn't
+take any additional space.  A snapshot itself is a small JSON file listing
+the files and their chunks.
+
+The chunks are compressed in parallel by a pool of threads, using zstd when
+the :mod:`zstandard` module is installed, otherwise zlib.  Both release the
+GIL while compressing.  A snapshot can also be streamed into a single tar
+archive (e.g. for copying it to another machine), which is then compressed by
+a multi-threaded :cmd:`zstd` or :cmd:`pigz` when available.
+
+"""
+
+import os
+import json
+import zlib
+import gzip
+import time
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import datetime
+import subprocess
+import collections
+import click
+from os.path import join
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import DEFAULTSECTION, BATCH_HELP
+from .utils import Installer, get_project_dir, atomic_write
+
+REPOSITORY_DIRNAME = 'repository'
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+NAME_FORMAT = '%Y%m%d_%H%M%S'
+
+# the directories of a project directory that are part of a snapshot
+SNAPSHOT_DIRS = ['fixtures', join('media', 'webdav'), join('media', 'beid')]
+
+# the name of the directory with the database dump in a snapshot, which is
+# also the one used by the former make_snapshot.sh script
+DUMP_DIRNAME = 'snapshot'
+
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+KEEP_MONTHLY = 12
+
+# the first bytes of a zstd frame, used to recognize zstd compressed chunks
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+DEFAULT_LEVELS = dict(zstd=3, zlib=6, gzip=6)
+
+COMPRESSIONS = ('auto', 'zstd', 'zlib')
+
+
+def get_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def get_compressor(compression='auto', level=None):
+    """Return a tuple `(name, func)` where `func` compresses bytes using the
+    given `compression` (one of :data:`COMPRESSIONS`) and `level`."""
+    zstandard = get_zstandard()
+    if compression == 'auto':
+        compression = 'zlib' if zstandard is None else 'zstd'
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    if compression == 'zstd':
+        if zstandard is None:
+            raise click.ClickException(
+                "zstd compression requires the zstandard module "
+                "(pip install zstandard).")
+        # a ZstdCompressor must not be used by several threads at once
+        return compression, lambda data: zstandard.ZstdCompressor(
+            level=level).compress(data)
+    return compression, lambda data: zlib.compress(data, level)
+
+
+def decompress(data):
+    if data.startswith(ZSTD_MAGIC):
+        zstandard = get_zstandard()
+        if zstandard is None:
+            raise click.ClickException(
+                "Reading zstd compressed chunks requires the zstandard module "
+                "(pip install zstandard).")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class Repository(object):
+    """A directory containing content-addressed chunks and the snapshots
+    that refer to them.
+
+    The chunks are in :file:`chunks/ab/abcdef...`, the snapshots of a site
+    ``foo`` in :file:`snapshots/foo/20200718_031500.json`.
+
+    """
+
+    def __init__(self, root, compression='auto', level=None):
+        self.root = root
+        self.chunks_dir = join(root, 'chunks')
+        self.snapshots_dir = join(root, 'snapshots')
+        self.compression, self.compress = get_compressor(compression, level)
+
+    def chunk_path(self, digest):
+        return join(self.chunks_dir, digest[:2], digest)
+
+    def put_chunk(self, data):
+        """Store the bytes `data` unless the repository already has them.
+        Return a tuple `(digest, written)` where `written` is the number of
+        bytes written to disk."""
+        digest = hashlib.sha256(data).hexdigest()
+        pth = self.chunk_path(digest)
+        if os.path.exists(pth):
+            return digest, 0
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        cdata = self.compress(data)
+        atomic_write(pth, cdata)
+        return digest, len(cdata)
+
+    def get_chunk(self, digest):
+        with open(self.chunk_path(digest), 'rb') as fd:
+            data = decompress(fd.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise click.ClickException("Chunk {} is corrupt".format(digest))
+        return data
+
+    def is_unchanged(self, previous, st):
+        """Whether a file with the given :func:`os.stat` result is unchanged
+        since the `previous` snapshot, so that we can reuse its chunks
+        without even reading it."""
+        return previous is not None and previous['size'] == st.st_size \
+            and previous['mtime'] == st.st_mtime_ns \
+            and all([os.path.exists(self.chunk_path(d))
+                     for d in previous['chunks']])
+
+    def iter_chunks(self, digests, pool, ahead):
+        """Yield the content of the given chunks, reading and decompressing
+        up to `ahead` of them in advance using the threads of `pool`."""
+        pending = collections.deque()
+        for digest in digests:
+            pending.append(pool.submit(self.get_chunk, digest))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def site_dir(self, site):
+        return join(self.snapshots_dir, site)
+
+    def list_snapshots(self, site):
+        """Return the names of the snapshots of `site`, oldest first."""
+        pth = self.site_dir(site)
+        if not os.path.isdir(pth):
+            return []
+        return sorted([fn[:-5] for fn in os.listdir(pth) if fn.endswith('.json')])
+
+    def load_snapshot(self, site, name):
+        pth = join(self.site_dir(site), name + '.json')
+        if not os.path.exists(pth):
+            raise click.ClickException(
+                "There is no snapshot {} of {}".format(name, site))
+        with open(pth) as fd:
+            return json.load(fd)
+
+    def save_snapshot(self, site, name, snapshot):
+        os.makedirs(self.site_dir(site), exist_ok=True)
+        atomic_write(join(self.site_dir(site), name + '.json'),
+                     json.dumps(snapshot, indent=1).encode('utf-8'))
+
+    def delete_snapshot(self, site, name):
+        os.remove(join(self.site_dir(site), name + '.json'))
+
+    def make_snapshot(self, site, files, name=None, jobs=1):
+        """Make a new snapshot of `site` containing the given `files`, a list
+        of `(arcname, pth)` tuples.  Return the name of the snapshot and a
+        dict with statistics.
+
+        The files are read one after the other, and their chunks are hashed,
+        compressed and written by a pool of `jobs` threads.  At most two
+        chunks per thread are waiting, which limits the memory used.
+
+        """
+        started = time.monotonic()
+        name = name or datetime.datetime.now().strftime(NAME_FORMAT)
+        previous = {}
+        names = self.list_snapshots(site)
+        if names:
+            for entry in self.load_snapshot(site, names[-1])['files']:
+                previous[entry['path']] = entry
+        stats = dict(files=0, read=0, reused=0, written=0)
+        entries = []
+        inflight = collections.deque()
+        jobs = max(1, jobs)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for arcname, pth in files:
+                st = os.stat(pth)
+                entry = dict(path=arcname, size=st.st_size,
+                             mtime=st.st_mtime_ns, mode=st.st_mode & 0o7777,
+                             chunks=[])
+                entries.append(entry)
+                stats['files'] += 1
+                prev = previous.get(arcname)
+                if self.is_unchanged(prev, st):
+                    stats['reused'] += st.st_size
+                    entry['chunks'] = prev['chunks']
+                    continue
+                # the file may change while we read it, and the size must
+                # match the chunks
+                entry['size'] = 0
+                with open(pth, 'rb') as fd:
+                    while True:
+                        data = fd.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        entry['size'] += len(data)
+                        stats['read'] += len(data)
+                        f = pool.submit(self.put_chunk, data)
+                        entry['chunks'].append(f)
+                        inflight.append(f)
+                        while len(inflight) > 2 * jobs:
+                            inflight.popleft().result()
+        for entry in entries:
+            chunks = []
+            for c in entry['chunks']:
+                if not isinstance(c, str):
+                    c, written = c.result()
+                    stats['written'] += written
+                chunks.append(c)
+            entry['chunks'] = chunks
+        self.save_snapshot(site, name, dict(
+            site=site, name=name, compression=self.compression, files=entries))
+        stats['seconds'] = time.monotonic() - started
+        return name, stats
+
+    def extract(self, site, name, target, jobs=1):
+        """Write the files of the given snapshot into directory `target`."""
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            for entry in self.load_snapshot(site, name)['files']:
+                pth = join(target, entry['path'])
+                os.makedirs(os.path.dirname(pth), exist_ok=True)
+                with open(pth, 'wb') as fd:
+                    for data in self.iter_chunks(entry['chunks'], pool, 2 * jobs):
+                        fd.write(data)
+                os.chmod(pth, entry['mode'])
+                os.utime(pth, ns=(entry['mtime'], entry['mtime']))
+
+    def write_archive(self, site, name, fn, jobs=1, level=None):
+        """Stream the files of the given snapshot into a single tar archive
+        `fn`, compressed according to its extension (:file:`.tar.zst`,
+        :file:`.tar.gz`, :file:`.tgz` or :file:`.tar`).
+
+        No temporary file is written.  The chunks are decompressed by a pool
+        of `jobs` threads, the archive is compressed by an external
+        multi-threaded :cmd:`zstd` or :cmd:`pigz` when available.  Return the
+        size of the uncompressed data.
+
+        """
+        snapshot = self.load_snapshot(site, name)
+        size = 0
+        with open_archive(fn, jobs, level) as fileobj:
+            with tarfile.open(fileobj=fileobj, mode='w|') as tar, \
+                    ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+                for entry in snapshot['files']:
+                    ti = tarfile.TarInfo(entry['path'])
+                    ti.size = entry['size']
+                    ti.mode = entry['mode']
+                    ti.mtime = entry['mtime'] // 10 ** 9
+                    tar.addfile(ti, ChunkReader(
+                        self.iter_chunks(entry['chunks'], pool, 2 * jobs)))
+                    size += entry['size']
+        return size
+
+    def prune(self, site, daily=KEEP_DAILY, weekly=KEEP_WEEKLY,
+              monthly=KEEP_MONTHLY):
+        """Delete the snapshots of `site` that are not to be kept according
+        to the retention policy.  Return the names of deleted snapshots."""
+        names = self.list_snapshots(site)
+        keep = snapshots_to_keep(names, daily, weekly, monthly)
+        deleted = [n for n in names if n not in keep]
+        for name in deleted:
+            self.delete_snapshot(site, name)
+        return deleted
+
+    def collect_garbage(self):
+        """Delete the chunks that are not used by any snapshot of any site.
+        Return the number of deleted chunks and the number of freed bytes.
+
+        This must not run while another process is making a snapshot.
+        """
+        used = set()
+        if os.path.isdir(self.snapshots_dir):
+            for site in os.listdir(self.snapshots_dir):
+                for name in self.list_snapshots(site):
+                    for entry in self.load_snapshot(site, name)['files']:
+                        used.update(entry['chunks'])
+        count = freed = 0
+        if not os.path.isdir(self.chunks_dir):
+            return count, freed
+        for sub in os.listdir(self.chunks_dir):
+            for digest in os.listdir(join(self.chunks_dir, sub)):
+                if digest not in used:
+                    pth = join(self.chunks_dir, sub, digest)
+                    freed += os.path.getsize(pth)
+                    os.remove(pth)
+                    count += 1
+        return count, freed
+
+
+class ChunkReader(object):
+    """A file-like object that reads from an iterator over chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+        self.pos = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.pos >= len(self.buffer):
+                self.buffer = next(self.chunks, b'')
+                self.pos = 0
+                if not self.buffer:
+                    break
+            if size < 0:
+                end = len(self.buffer)
+            else:
+                end = min(len(self.buffer), self.pos + size)
+                size -= end - self.pos
+            parts.append(self.buffer[self.pos:end])
+            self.pos = end
+        return b''.join(parts)
+
+
+@contextmanager
+def open_archive(fn, jobs=1, level=None):
+    """Yield a binary file object where to write the uncompressed content of
+    the archive `fn`."""
+    jobs = max(1, jobs)
+    process = None
+    if fn.endswith('.tar.zst') or fn.endswith('.tzst'):
+        level = level or DEFAULT_LEVELS['zstd']
+        zstd = shutil.which('zstd')
+        if zstd is not None:
+            process = subprocess.Popen(
+                [zstd, '-q', '-f', '-T{}'.format(jobs), '-{}'.format(level),
+                 '-o', fn], stdin=subprocess.PIPE)
+        else:
+            zstandard = get_zstandard()
+            if zstandard is None:
+                raise click.ClickException(
+                    "Writing {} requires zstd (apt install zstd).".format(fn))
+            cctx = zstandard.ZstdCompressor(level=level, threads=jobs)
+            with open(fn, 'wb') as fd, cctx.stream_writer(fd) as writer:
+                yield writer
+            return
+    elif fn.endswith('.tar.gz') or fn.endswith('.tgz'):
+        level = level or DEFAULT_LEVELS['gzip']
+        pigz = shutil.which('pigz')
+        if pigz is None:
+            # single-threaded fallback
+            with gzip.open(fn, 'wb', compresslevel=level) as fd:
+                yield fd
+            return
+        with open(fn, 'wb') as fd:
+            process = subprocess.Popen(
+                [pigz, '-p', str(jobs), '-{}'.format(level)],
+                stdin=subprocess.PIPE, stdout=fd)
+    elif fn.endswith('.tar'):
+        with open(fn, 'wb') as fd:
+            yield fd
+        return
+    else:
+        raise click.ClickException(
+            "Unknown archive type {} "
+            "(use .tar.zst, .tar.gz, .tgz or .tar)".format(fn))
+    try:
+        yield process.stdin
+    finally:
+        process.stdin.close()
+        rc = process.wait()
+    if rc != 0:
+        raise click.ClickException(
+            "Compressing {} failed with return code {}".format(fn, rc))
+
+
+def snapshots_to_keep(names, daily=KEEP_DAILY, weekly=KEEP_WEEKLY,
+                      monthly=KEEP_MONTHLY):
+    """Return the set of snapshot names to keep.
+
+    We keep the newest snapshot of each of the last `daily` days, `weekly`
+    weeks and `monthly` months that have snapshots.  The newest snapshot is
+    always kept, and so are names that are not in the usual format.
+
+    """
+    dated = []
+    keep = set()
+    for name in names:
+        try:
+            dated.append((datetime.datetime.strptime(name, NAME_FORMAT), name))
+        except ValueError:
+            keep.add(name)
+    dated.sort(reverse=True)
+    if dated:
+        keep.add(dated[0][1])
+    periods = (
+        (daily, lambda d: d.date()),
+        (weekly, lambda d: d.isocalendar()[:2]),
+        (monthly, lambda d: (d.year, d.month)))
+    for count, period in periods:
+        seen = set()
+        for d, name in dated:
+            p = period(d)
+            if p in seen:
+                continue
+            if len(seen) >= count:
+                break
+            seen.add(p)
+            keep.add(name)
+    return keep
+
+
+def site_files(project_dir, dumpdir):
+    """Return the `(arcname, pth)` tuples of the files to put into a snapshot
+    of the site in `project_dir`, whose database has been dumped to
+    `dumpdir`."""
+    files = []
+
+    def walk(root, prefix):
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, root)
+            for fn in sorted(filenames):
+                pth = join(dirpath, fn)
+                if os.path.isfile(pth) and not os.path.islink(pth):
+                    files.append((os.path.normpath(join(prefix, rel, fn)), pth))
+
+    walk(dumpdir, DUMP_DIRNAME)
+    for sub in SNAPSHOT_DIRS:
+        pth = join(project_dir, sub)
+        if os.path.isdir(pth):
+            walk(pth, sub)
+    for fn in sorted(os.listdir(project_dir)):
+        if fn.endswith('.py') or fn.endswith('.sh'):
+            files.append((fn, join(project_dir, fn)))
+    return files
+
+
+def get_repository(compression='auto', level=None):
+    return Repository(join(DEFAULTSECTION.get('backups_base'), REPOSITORY_DIRNAME),
+                      compression, level)
+
+
+def format_size(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            break
+        n /= 1024
+    return "{:.1f} {}".format(n, unit) if unit != 'B' else "{} B".format(n)
+
+
+def format_rate(n, seconds):
+    """Return the throughput of `n` bytes in `seconds`."""
+    return format_size(n / max(seconds, 0.001)) + "/s"
+
+
+@click.command()
+@click.argument('prjname')
+@click.option('--keep-daily', default=KEEP_DAILY, type=int,
+              help="Number of daily snapshots to keep.")
+@click.option('--keep-weekly', default=KEEP_WEEKLY, type=int,
+              help="Number of weekly snapshots to keep.")
+@click.option('--keep-monthly', default=KEEP_MONTHLY, type=int,
+              help="Number of monthly snapshots to keep.")
+@click.option('--list', 'list_only', is_flag=True,
+              help="List the existing snapshots instead of making a new one.")
+@click.option('--extract', nargs=2, type=(str, click.Path()), default=None,
+              metavar='NAME TARGET',
+              help="Write the files of snapshot NAME into directory TARGET "
+                   "instead of making a new snapshot.")
+@click.option('--archive', type=click.Path(dir_okay=False), default=None,
+              help="Also write the new snapshot into a single archive file "
+                   "(.tar.zst, .tar.gz or .tar).")
+@click.option('--compression', type=click.Choice(COMPRESSIONS), default='auto',
+              help="How to compress new chunks.  Default is zstd when "
+                   "available, otherwise zlib.")
+@click.option('--level', type=int, default=None,
+              help="The compression level.")
+@click.option('--jobs', default=4, type=int,
+              help="Number of threads for compressing and decompressing.")
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+def snapshot(prjname, keep_daily, keep_weekly, keep_monthly, list_only,
+             extract, archive, compression, level, jobs, batch):
+    """
+    Make a snapshot of a site.
+
+    PRJNAME is the name of the site.  The snapshot is stored in the snapshot
+    repository of this server.  Older snapshots are deleted according to the
+    retention policy.
+    """
+    repo = get_repository(compression, level)
+    if list_only:
+        for name in repo.list_snapshots(prjname):
+            click.echo(name)
+        return
+    if extract:
+        name, target = extract
+        repo.extract(prjname, name, target, jobs)
+        click.echo("Extracted snapshot {} of {} to {}.".format(
+            name, prjname, target))
+        return
+
+    i = Installer(batch)
+    project_dir = get_project_dir(prjname)
+    if not os.path.isdir(project_dir):
+        raise click.ClickException(
+            "Project directory {} does not exist!".format(project_dir))
+    envdir = join(project_dir, DEFAULTSECTION.get('env_link'))
+
+    os.umask(0o007)  # make new files writable for other group members
+    os.makedirs(repo.root, exist_ok=True)
+
+    with i.lock():
+        # the dump is on the same file system as the repository
+        with tempfile.TemporaryDirectory(dir=repo.root) as tmp:
+            dumpdir = join(tmp, DUMP_DIRNAME)
+            i.run_in_env(envdir, "python manage.py dump2py {}".format(dumpdir),
+                         cwd=project_dir)
+            i.run_in_env(envdir, "pip freeze > {}".format(
+                join(dumpdir, 'requirements.txt')), cwd=project_dir)
+            name, stats = repo.make_snapshot(
+                prjname, site_files(project_dir, dumpdir), jobs=jobs)
+        click.echo(
+            "Snapshot {} of {}: {} files, {} read ({}), {} unchanged, "
+            "{} written ({}) in {:.1f} seconds.".format(
+                name, prjname, stats['files'], format_size(stats['read']),
+                format_rate(stats['read'], stats['seconds']),
+                format_size(stats['reused']), format_size(stats['written']),
+                repo.compression, stats['seconds']))
+
+        if archive:
+            started = time.monotonic()
+            size = repo.write_archive(prjname, name, archive, jobs, level)
+            seconds = time.monotonic() - started
+            click.echo("Wrote {} ({} from {}) in {:.1f} seconds ({}).".format(
+                archive, format_size(os.path.getsize(archive)),
+                format_size(size), seconds, format_rate(size, seconds)))
+
+        deleted = repo.prune(prjname, keep_daily, keep_weekly, keep_monthly)
+        if deleted:
+            count, freed = repo.collect_garbage()
+            click.echo("Deleted {} old snapshots and {} chunks ({}).".format(
+                len(deleted), count, format_size(freed)))
@@ -2,19 +2,30 @@
 # License: BSD (see file COPYING for details)
 
 import os
+import sys
 import shutil
 import secrets
+import hashlib
 import click
 
 from os.path import join
 
 from .utils import APPNAMES, FOUND_CONFIG_FILES, DEFAULTSECTION, USE_NGINX
-from .utils import DB_ENGINES, BATCH_HELP, REPOS_DICT, KNOWN_REPOS
-from .utils import Installer, ifroot
+from .utils import DB_ENGINES, BATCH_HELP, JOBS_HELP, PLAN_HELP, TRACE_HELP
+from .utils import REPOS_DICT, KNOWN_REPOS
+from .utils import Installer, ifroot, get_project_dir
+from .wheelhouse import pip_options, get_wheelhouse
+from .tuning import LOAD_CLASSES, LOAD_HELP, DEFAULT_LOAD
+from .tuning import tune_uwsgi, describe_uwsgi
+from .compress import compress_static
+from .pgbouncer import use_pgbouncer, register_databases
+from .pgbouncer import PGBOUNCER_HOST, PGBOUNCER_PORT
 
 SITES_AVAILABLE = '/etc/nginx/sites-available'
 SITES_ENABLED = '/etc/nginx/sites-enabled'
 
+ENV_TEMPLATES_DIRNAME = 'envtemplates'
+
 COOKIECUTTER_URL = "https://github.com/lino-framework/cookiecutter-startsite"
 
 UWSGI_SUPERVISOR_CONF = """
@@ -44,35 +55,51 @@ def default_shared_env():
     return DEFAULTSECTION.get('shared_env')
 
 
-@click.command()
-@click.argument('appname', metavar="APPNAME", type=click.Choice(APPNAMES))
-@click.argument('prjname')
-@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
-@click.option('--dev-repos', default='',
-              help="List of packages for which to install development version")
-@click.option('--shared-env', default=default_shared_env,
-              help="Directory with shared virtualenv")
-@click.pass_context
-def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
-    """
-    Create a new Lino site.
-
-    Two mandatory arguments must be given:
-
-    APPNAME : The application to run on the new site.
-
-    SITENAME : The internal name for the new site. It must be unique for this
-    Lino server. We recommend lower-case only and maybe digits but no "-" or
-    "_". Examples:  foo, foo2, mysite, first,
+def env_template_dir(appname, packages, pip_options):
+    """Return the directory of the template virtualenv to use for a new
+    site of the given application with the given Python packages.
 
+    The name of the directory changes when the packages or the pip options
+    change, and when the wheelhouse is used and contains other wheels (e.g.
+    newer versions of the application).
+    """
+    h = hashlib.sha1()
+    h.update(' '.join(sorted(packages)).encode('utf-8'))
+    h.update(pip_options.encode('utf-8'))
+    wh = get_wheelhouse()
+    if wh in pip_options:
+        h.update(' '.join(sorted(os.listdir(wh))).encode('utf-8'))
+    name = "{}-{}".format(appname, h.hexdigest()[:12])
+    return join(DEFAULTSECTION.get('sites_base'), ENV_TEMPLATES_DIRNAME, name)
+
+
+def add_site_steps(i, appname, prjname, dev_repos='', shared_env=None,
+                   env_template=False, jobs=1, prefix='', shared=None,
+                   load=DEFAULT_LOAD):
+    """Add the steps for creating a new site `prjname` running application
+    `appname` to the plan of the :class:`Installer <getlino.utils.Installer>`
+    `i`.  Return the context used for rendering the templates of the new site.
+
+    `prefix` is prepended to the names of the steps, which makes it possible
+    to add several sites to a same plan.  `shared` is a dict that collects the
+    work to be done in the shared virtualenv.  This work is done by steps that
+    are shared by all the sites of the plan that use this virtualenv.
+
+    `load` is the load class of the new site (see :mod:`getlino.tuning`).
 
-    """ # .format(appnames=' '.join(APPNAMES))
+    """
 
     # if len(FOUND_CONFIG_FILES) == 0:
     #     raise click.UsageError(
     #         "This server is not yet configured. Did you run `sudo -H getlino configure`?")
 
-    i = Installer(batch)
+    if shared is None:
+        shared = {}
+    # the load classes of the sites in this plan
+    planned_loads = shared.setdefault('uwsgi_loads', {})
+    planned_loads[prjname] = load
+
+    batch = i.batch
 
     # if os.path.exists(prjpath):
     #     raise click.UsageError("Project directory {} already exists.".format(prjpath))
@@ -119,6 +146,7 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
 
     # i.check_usergroup(usergroup)
 
+    repos = []
     if dev_repos:
         for k in dev_repos.split():
             repo = REPOS_DICT.get(k, None)
@@ -128,9 +156,7 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
                     "Invalid repository name {}. "
                     "Allowed names are one or more of ({})".format(
                         k, nicknames))
-
-    if not i.check_overwrite(project_dir):
-        raise click.Abort()
+            repos.append(repo)
 
     # if not i.asroot and not shared_env:
     #     raise click.ClickException(
@@ -157,6 +183,10 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
     for pkgname in db_engine.python_packages.split():
         pip_packages.add(pkgname)
 
+    redis = DEFAULTSECTION.getboolean('redis', False)
+    if redis:
+        pip_packages.add('django-redis')
+
     context.update({
         "prjname": prjname,
         "appname": appname,
@@ -169,8 +199,12 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
         "server_url": server_url,
         "dev_packages": ' '.join([a.nickname for a in KNOWN_REPOS if a.nickname in dev_repos]),
         "pip_packages": ' '.join(pip_packages),
+        "pip_options": pip_options(pip_packages),
+        "wheelhouse": get_wheelhouse(),
         "db_name": prjname,
         "python_path": sites_base,
+        # the command to use in scripts that run getlino
+        "getlino_cmd": "{} -m getlino.cli".format(sys.executable),
         "usergroup": usergroup
     })
 
@@ -210,84 +244,151 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
         "db_user": db_user,
         "db_password": db_password,
         "secret_key": secret_key,
+        "pgbouncer": False,
+        "redis": redis,
     })
 
-    if not i.yes_or_no("OK to create {} with above options?".format(project_dir)):
-        raise click.Abort()
+    pgbouncer = ifroot() and use_pgbouncer()
+    if pgbouncer:
+        # the site connects to the local connection pooler, which connects
+        # to the database server
+        context.update(db_host=PGBOUNCER_HOST, db_port=PGBOUNCER_PORT,
+                       pgbouncer=True)
 
-    os.umask(0o002)
+    # The steps below are first added to a plan and then run.  Independent
+    # steps can run in parallel when in batch mode.
 
-    os.makedirs(project_dir, exist_ok=True)
-    i.jinja_write(join(project_dir, "settings.py"), **context)
-    i.jinja_write(join(project_dir, "manage.py"), **context)
-    # pull.sh script is now in the virtualenv's bin folder
-    #i.jinja_write(join(project_dir, "pull.sh"), **context)
-    if ifroot():
-        i.jinja_write(join(project_dir, "make_snapshot.sh"), **context)
-        i.make_file_executable(join(project_dir, "make_snapshot.sh"))
-        os.makedirs(join(project_dir, "nginx"), exist_ok=True)
-        i.jinja_write(join(project_dir, "wsgi.py"), **context)
-        i.jinja_write(join(project_dir, "nginx", "uwsgi.ini"), **context)
-        i.jinja_write(join(project_dir, "nginx", "uwsgi_params"), **context)
-
-        logdir = join(DEFAULTSECTION.get("log_base"), prjname)
-        os.makedirs(logdir, exist_ok=True)
-        with i.override_batch(True):
-            i.check_permissions(logdir)
-            os.symlink(logdir, join(project_dir, 'log'))
-            i.write_logrotate_conf(
-                'lino-{}.conf'.format(prjname),
-                join(logdir, "lino.log"))
-
-        backups_base_dir = join(DEFAULTSECTION.get("backups_base"), prjname)
-        os.makedirs(backups_base_dir, exist_ok=True)
-        with i.override_batch(True):
-            i.check_permissions(backups_base_dir)
-
-        content = """
-        #!/bin/sh
-        # generated by getlino
-        {project_dir}/make_snapshot.sh > /dev/null
-        """.format(**context)
-        fn = 'make_snapshot_{prjname}.sh'.format(**context)
-        i.write_daily_cron_job(fn, content)
-
-
-
-    if DEFAULTSECTION.getboolean('linod'):
-        i.write_file(
-            join(project_dir, 'linod.sh'),
-            LINOD_SH.format(**context), executable=True)
-        if ifroot():
-            i.write_supervisor_conf(
-                'linod_{}.conf'.format(prjname),
-                LINOD_SUPERVISOR_CONF.format(**context))
-            i.must_restart('supervisor')
+    def step(name):
+        return prefix + name
 
-    os.makedirs(join(project_dir, 'media'), exist_ok=True)
+    def write_files():
+        i.jinja_write(join(project_dir, "settings.py"), **context)
+        i.jinja_write(join(project_dir, "manage.py"), **context)
+        # pull.sh script is now in the virtualenv's bin folder
+        #i.jinja_write(join(project_dir, "pull.sh"), **context)
+        if ifroot():
+            i.jinja_write(join(project_dir, "make_snapshot.sh"), **context)
+            i.make_file_executable(join(project_dir, "make_snapshot.sh"))
+            os.makedirs(join(project_dir, "nginx"), exist_ok=True)
+            i.jinja_write(join(project_dir, "wsgi.py"), **context)
+            uwsgi = tune_uwsgi(i.facts, prjname, load, planned_loads)
+            i.echo("Site {} ({} load) gets {}.".format(
+                prjname, load, describe_uwsgi(uwsgi)))
+            i.jinja_write(join(project_dir, "nginx", "uwsgi.ini"),
+                          uwsgi=uwsgi, **context)
+            i.jinja_write(join(project_dir, "nginx", "uwsgi_params"), **context)
+
+            logdir = join(DEFAULTSECTION.get("log_base"), prjname)
+            os.makedirs(logdir, exist_ok=True)
+            with i.override_batch(True):
+                i.check_permissions(logdir)
+                os.symlink(logdir, join(project_dir, 'log'))
+                i.write_logrotate_conf(
+                    'lino-{}.conf'.format(prjname),
+                    join(logdir, "lino.log"))
+
+            backups_base_dir = join(DEFAULTSECTION.get("backups_base"), prjname)
+            os.makedirs(backups_base_dir, exist_ok=True)
+            with i.override_batch(True):
+                i.check_permissions(backups_base_dir)
+
+            content = """
+            #!/bin/sh
+            # generated by getlino
+            {project_dir}/make_snapshot.sh > /dev/null
+            """.format(**context)
+            fn = 'make_snapshot_{prjname}.sh'.format(**context)
+            i.write_daily_cron_job(fn, content)
+
+        if DEFAULTSECTION.getboolean('linod'):
+            i.write_file(
+                join(project_dir, 'linod.sh'),
+                LINOD_SH.format(**context), executable=True)
+            if ifroot():
+                i.write_supervisor_conf(
+                    'linod_{}.conf'.format(prjname),
+                    LINOD_SUPERVISOR_CONF.format(**context))
+
+        os.makedirs(join(project_dir, 'media'), exist_ok=True)
+
+        if shared_env:
+            os.symlink(shared_env, join(project_dir, DEFAULTSECTION.get('env_link')))
+
+    i.add_step(step('files'), write_files)
 
     if shared_env:
+        # The virtualenv, the development repositories and the Python
+        # packages are shared by all sites of the plan that use this
+        # virtualenv.  We add their steps only once.
         envdir = shared_env
+        env_step = 'virtualenv:' + envdir
+        repos_step = 'dev-repos:' + envdir
+        pip_step = 'pip:' + envdir
+        work = shared.get(envdir)
+        if work is None:
+            work = dict(repos=[], packages=set(), context=context)
+            shared[envdir] = work
+
+            def create_shared_env():
+                ctx = dict(work['context'])
+                ctx.update(pip_packages=' '.join(sorted(work['packages'])))
+                i.check_virtualenv(envdir, ctx)
+                static_root = join(envdir, 'static_root')
+                if not os.path.exists(static_root):
+                    os.makedirs(static_root, exist_ok=True)
+
+            i.add_step(env_step, create_shared_env)
+            # The sites added later might add repositories or packages, so
+            # these steps must exist even when they have nothing to do yet.
+            i.add_step(repos_step, lambda: install_dev_repos(work['repos']),
+                       [env_step])
+            i.add_step(pip_step, lambda: install_pip_packages(work['packages']),
+                       [env_step, repos_step])
+        for repo in repos:
+            if repo not in work['repos']:
+                work['repos'].append(repo)
+        work['packages'] |= pip_packages
     else:
         envdir = join(project_dir, DEFAULTSECTION.get('env_link'))
-
-    i.check_virtualenv(envdir, context)
-
-    if shared_env:
-        os.symlink(envdir, join(project_dir, DEFAULTSECTION.get('env_link')))
-        static_root = join(shared_env, 'static_root')
-        if not os.path.exists(static_root):
-            os.makedirs(static_root, exist_ok=True)
-
-    if dev_repos:
-        click.echo("dev_repos is {} --> {}".format(dev_repos, dev_repos.split()))
-        repos = []
-        for nickname in dev_repos.split():
-            lib = REPOS_DICT.get(nickname, None)
-            if lib is None:
-                raise click.ClickException("Invalid repository nickname {} in --dev-repos".format(nickname))
-            repos.append(lib)
-
+        env_step = step('virtualenv')
+        repos_step = step('dev-repos')
+        pip_step = step('pip')
+
+    # whether the virtualenv has been cloned from a template
+    cloned = []
+
+    if env_template and not shared_env and len(pip_packages):
+        tpldir = env_template_dir(appname, pip_packages, context['pip_options'])
+        # sites of a same application share their template
+        tpl_step = 'env-template:' + os.path.basename(tpldir)
+        # the templates used by the sites of this plan
+        planned_templates = shared.setdefault('env_templates', set())
+        planned_templates.add(os.path.basename(tpldir))
+
+        def make_env_template():
+            i.make_env_template(tpldir, pip_packages, context['pip_options'])
+            # remove older templates for this application, but not those
+            # from which other sites of this plan are being cloned
+            base = os.path.dirname(tpldir)
+            for fn in os.listdir(base):
+                if fn not in planned_templates and fn.startswith(appname + '-'):
+                    shutil.rmtree(join(base, fn))
+
+        if tpl_step not in i._steps:
+            i.add_step(tpl_step, make_env_template)
+    else:
+        tpldir = None
+        tpl_step = None
+
+    def create_virtualenv():
+        if tpldir and not os.path.exists(envdir):
+            if i.clone_virtualenv(tpldir, envdir):
+                cloned.append(envdir)
+        i.check_virtualenv(envdir, context)
+
+    def install_dev_repos(repos):
+        if not repos:
+            return
         click.echo("Installing {} repositories...".format(len(repos)))
         full_repos_dir = DEFAULTSECTION.get('repos_base')
         if not full_repos_dir:
@@ -295,45 +396,119 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
             if not os.path.exists(full_repos_dir):
                 os.makedirs(full_repos_dir, exist_ok=True)
         i.check_permissions(full_repos_dir)
-        os.chdir(full_repos_dir)
-        for lib in repos:
-            i.clone_repo(lib)
-        for lib in repos:
-            i.install_repo(lib, envdir)
-
-    if len(pip_packages):
-        click.echo("Installing {} Python packages...".format(len(pip_packages)))
-        i.run_in_env(envdir, "pip install --upgrade {}".format(' '.join(pip_packages)))
+        i.clone_repos(repos, full_repos_dir, jobs)
+        i.install_repos(repos, envdir, full_repos_dir)
+
+    def install_pip_packages(packages):
+        if not packages:
+            return
+        if cloned:
+            click.echo("No need to install Python packages: "
+                       "virtualenv was cloned from a template.")
+            return
+        click.echo("Installing {} Python packages...".format(len(packages)))
+        i.run_in_env(envdir, "pip install --upgrade {} {}".format(
+            pip_options(packages), ' '.join(sorted(packages))))
+
+    if not shared_env:
+        i.add_step(env_step, create_virtualenv, [tpl_step])
+        if repos:
+            click.echo("dev_repos is {} --> {}".format(dev_repos, dev_repos.split()))
+            i.add_step(repos_step, lambda: install_dev_repos(repos), [env_step])
+        if len(pip_packages):
+            i.add_step(pip_step, lambda: install_pip_packages(pip_packages),
+                       [env_step, repos_step])
 
     if ifroot():
         if USE_NGINX:
-            filename = "{}.conf".format(prjname)
-            avpth = join(SITES_AVAILABLE, filename)
-            enpth = join(SITES_ENABLED, filename)
-            # shutil.copyfile(join(project_dir, 'nginx', filename), avpth)
-            if i.jinja_write(avpth, "nginx.conf", **context):
-                if i.override_batch(True):
-                    if i.check_overwrite(enpth):
-                        os.symlink(avpth, enpth)
-            i.write_supervisor_conf('{}-uwsgi.conf'.format(prjname),
-                 UWSGI_SUPERVISOR_CONF.format(**context))
-            i.must_restart("supervisor")
-            i.must_restart("nginx")
-
-    os.chdir(project_dir)
-    i.run_in_env(envdir, "python manage.py install --noinput")
+            def write_nginx_conf():
+                filename = "{}.conf".format(prjname)
+                avpth = join(SITES_AVAILABLE, filename)
+                enpth = join(SITES_ENABLED, filename)
+                # shutil.copyfile(join(project_dir, 'nginx', filename), avpth)
+                if i.jinja_write(avpth, "nginx.conf", **context):
+                    i.must_reload("nginx")
+                if os.path.realpath(enpth) != avpth:
+                    with i.override_batch(True):
+                        if i.check_overwrite(enpth):
+                            os.symlink(avpth, enpth)
+                            i.must_reload("nginx")
+                i.write_supervisor_conf('{}-uwsgi.conf'.format(prjname),
+                     UWSGI_SUPERVISOR_CONF.format(**context))
+
+            i.add_step(step('nginx'), write_nginx_conf)
+
+    def run_manage(cmd):
+        i.run_in_env(envdir, "python manage.py " + cmd, cwd=project_dir)
+
+    i.add_step(step('install'), lambda: run_manage("install --noinput"),
+               [step('files'), env_step, repos_step, pip_step])
+
+    # The database users and databases of all sites of the plan are created
+    # by a single step, which runs all statements in one client session.
+    statements = []
     if not shared_user:
-        db_engine.setup_user(i, context)
-    db_engine.setup_database(i, prjname, db_user, db_host)
-    i.run_in_env(envdir, "python manage.py migrate --noinput")
-    i.run_in_env(envdir, "python manage.py prep --noinput")
-    db_engine.after_prep(i, context)
+        statements += db_engine.user_statements(db_user, db_password, db_host)
+    statements += db_engine.database_statements(prjname, db_user, db_host)
+    if statements:
+        db_statements = shared.get('db')
+        if db_statements is None:
+            db_statements = shared['db'] = []
+            i.add_step('db', lambda: db_engine.provision(i, db_statements),
+                       interactive=db_engine.interactive)
+        db_statements.extend(statements)
+    if pgbouncer:
+        pooled = shared.get('pgbouncer')
+        if pooled is None:
+            pooled = shared['pgbouncer'] = []
+            i.add_step('pgbouncer', lambda: register_databases(i, pooled), ['db'])
+        pooled.append((prjname, db_user, db_password))
+    i.add_step(step('migrate'), lambda: run_manage("migrate --noinput"),
+               [step('install'), 'db', 'pgbouncer'])
+    i.add_step(step('prep'), lambda: run_manage("prep --noinput"),
+               [step('migrate')])
+    i.add_step(step('after-prep'), lambda: db_engine.after_prep(i, context),
+               [step('prep')])
     if ifroot():
-        i.run_in_env(envdir, "python manage.py collectstatic --noinput")
-
-    i.run_apt_install()
-    i.restart_services()
-
+        def collectstatic(project_dirs):
+            for pd in project_dirs:
+                i.run_in_env(envdir, "python manage.py collectstatic --noinput",
+                             cwd=pd)
+
+        def precompress():
+            # STATIC_ROOT is defined in the shared settings, relative to the
+            # project directory
+            static_root = join(envdir, 'static_root')
+            written, checked, removed = compress_static(static_root, jobs)
+            i.echo("Compressed {} of {} static files into {} ({} removed).".format(
+                written, checked, static_root, removed))
+
+        if shared_env:
+            # The sites of a shared virtualenv share their static files.  We
+            # collect them one site after the other and compress them once.
+            collect_step = 'collectstatic:' + envdir
+            compress_step = 'compress-static:' + envdir
+            static_sites = work.get('static_sites')
+            if static_sites is None:
+                static_sites = work['static_sites'] = []
+                i.add_step(collect_step, lambda: collectstatic(static_sites))
+                i.add_step(compress_step, precompress, [collect_step])
+            static_sites.append(project_dir)
+            i.add_deps(collect_step, [step('install')])
+            i.add_deps(compress_step, [])
+        else:
+            i.add_step(step('collectstatic'),
+                       lambda: collectstatic([project_dir]), [step('install')])
+            i.add_step(step('compress-static'), precompress,
+                       [step('collectstatic')])
+
+    return context
+
+
+def run_certbot(i, context):
+    """Get a certificate for the site.  This must run after nginx has been
+    reloaded, and the caller must then call :meth:`restart_services` again
+    because certbot changes the nginx configuration."""
     if ifroot() and USE_NGINX:
         # I imagine that we need to actually restart nginx
         # before running certbot-auto because otherwise certbot would add
@@ -341,7 +516,72 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env):
         # new site.
 
         if DEFAULTSECTION.getboolean('https'):
-            i.runcmd("sudo certbot-auto --nginx -d {}".format(server_domain))
-            i.must_restart("nginx")
+            i.runcmd("sudo certbot-auto --nginx -d {}".format(
+                context['server_domain']))
+            i.must_reload("nginx")
+
+
+@click.command()
+@click.argument('appname', metavar="APPNAME", type=click.Choice(APPNAMES))
+@click.argument('prjname')
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+@click.option('--jobs', default=4, type=int, help=JOBS_HELP)
+@click.option('--plan/--no-plan', default=False, help=PLAN_HELP)
+@click.option('--trace', type=click.Path(dir_okay=False), help=TRACE_HELP)
+@click.option('--dev-repos', default='',
+              help="List of packages for which to install development version")
+@click.option('--shared-env', default=default_shared_env,
+              help="Directory with shared virtualenv")
+@click.option('--env-template/--no-env-template',
+              default=lambda: DEFAULTSECTION.getboolean('env_templates', False),
+              help="Whether to clone the virtualenv from a template virtualenv")
+@click.option('--load', type=click.Choice(list(LOAD_CLASSES)),
+              default=DEFAULT_LOAD, help=LOAD_HELP)
+@click.pass_context
+def startsite(ctx, appname, prjname, batch, jobs, plan, trace, dev_repos,
+              shared_env, env_template, load):
+    """
+    Create a new Lino site.
+
+    Two mandatory arguments must be given:
+
+    APPNAME : The application to run on the new site.
+
+    SITENAME : The internal name for the new site. It must be unique for this
+    Lino server. We recommend lower-case only and maybe digits but no "-" or
+    "_". Examples:  foo, foo2, mysite, first,
+
+
+    """ # .format(appnames=' '.join(APPNAMES))
+
+    i = Installer(batch)
+
+    project_dir = get_project_dir(prjname)
+    context = add_site_steps(i, appname, prjname, dev_repos, shared_env,
+                             env_template, jobs, load=load)
+
+    if plan:
+        i.print_plan()
+        return
+
+    if not i.yes_or_no("OK to create {} with above options?".format(project_dir)):
+        raise click.Abort()
+
+    if not i.check_overwrite(project_dir):
+        raise click.Abort()
+
+    os.umask(0o002)
+
+    with i.lock():
+        os.makedirs(project_dir, exist_ok=True)
+        i.run_plan(jobs)
+
+        i.run_apt_install()
+        i.restart_services()
+        i.print_summary()
+
+        run_certbot(i, context)
+        i.restart_services()
+        i.write_trace(trace)
 
     click.echo("The new site {} has been created.".format(prjname))
@@ -0,0 +1,193 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""The :cmd:`getlino startsites` command.
+
+Creates several sites at once, as described in a manifest file.  The steps of
+all sites are run as a single plan, so that independent steps of different
+sites run in parallel, while work shared by several sites (e.g. installing the
+Python packages into a shared virtualenv or building a template virtualenv)
+is done only once.
+
+"""
+
+import os
+import json
+import click
+
+from .utils import APPNAMES, DEFAULTSECTION, BATCH_HELP, JOBS_HELP, PLAN_HELP, TRACE_HELP
+from .utils import Installer, get_project_dir
+from .startsite import add_site_steps, run_certbot, default_shared_env
+from .tuning import LOAD_CLASSES, DEFAULT_LOAD
+
+# the options of startsite that can be given per site in a manifest
+SITE_OPTIONS = ('dev_repos', 'shared_env', 'env_template', 'load')
+
+
+def read_manifest(fn):
+    """Read the manifest file `fn` and return a list of dicts with the keys
+    ``appname``, ``prjname`` and :data:`SITE_OPTIONS`.
+
+    The manifest is either a list of sites or a dict with a list of sites
+    under ``sites`` and optional default values under ``defaults``.  Every
+    site is a dict with at least ``app`` and ``prjname``.  Files ending with
+    :file:`.json` are read as JSON, others as YAML.
+
+    """
+    with open(fn) as fd:
+        if fn.endswith('.json'):
+            data = json.load(fd)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise click.ClickException(
+                    "Reading {} requires PyYAML (pip install pyyaml), "
+                    "or use a JSON manifest.".format(fn))
+            data = yaml.safe_load(fd)
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get('defaults') or {}
+        data = data.get('sites')
+    if not isinstance(data, list) or len(data) == 0:
+        raise click.ClickException("{} contains no list of sites.".format(fn))
+    sites = []
+    seen = set()
+    for n, entry in enumerate(data, start=1):
+        if not isinstance(entry, dict):
+            raise click.ClickException(
+                "Site #{} in {} is not a mapping.".format(n, fn))
+        site = dict(dev_repos='', shared_env=default_shared_env(),
+                    env_template=DEFAULTSECTION.getboolean('env_templates', False),
+                    load=DEFAULT_LOAD)
+        site.update(defaults)
+        site.update(entry)
+        site['appname'] = site.pop('app', site.get('appname'))
+        unknown = set(site) - set(('appname', 'prjname') + SITE_OPTIONS)
+        if unknown:
+            raise click.ClickException(
+                "Invalid option(s) {} for site #{} in {}.".format(
+                    ', '.join(sorted(unknown)), n, fn))
+        if site['appname'] not in APPNAMES:
+            raise click.ClickException(
+                "Invalid application '{}' for site #{} in {}. "
+                "Choose one of {}.".format(
+                    site['appname'], n, fn, ' '.join(APPNAMES)))
+        if site['load'] not in LOAD_CLASSES:
+            raise click.ClickException(
+                "Invalid load class '{}' for site #{} in {}. "
+                "Choose one of {}.".format(
+                    site['load'], n, fn, ' '.join(LOAD_CLASSES)))
+        if not site.get('prjname'):
+            raise click.ClickException(
+                "No prjname for site #{} in {}.".format(n, fn))
+        site['prjname'] = str(site['prjname'])
+        if site['prjname'] in seen:
+            raise click.ClickException(
+                "Duplicate prjname {} in {}.".format(site['prjname'], fn))
+        seen.add(site['prjname'])
+        if isinstance(site['dev_repos'], list):
+            site['dev_repos'] = ' '.join(site['dev_repos'])
+        sites.append(site)
+    return sites
+
+
+def site_results(sites, failed, skipped):
+    """Return a dict mapping every created site to a short description of
+    its result."""
+    results = {}
+    for site in sites:
+        prefix = site['prjname'] + ':'
+        f = [n[len(prefix):] for n in failed if n.startswith(prefix)]
+        s = [n for n in skipped if n.startswith(prefix)]
+        if f:
+            results[site['prjname']] = "failed ({})".format(' '.join(f))
+        elif s:
+            results[site['prjname']] = "failed (skipped {} steps)".format(len(s))
+        else:
+            results[site['prjname']] = "ok"
+    return results
+
+
+def print_table(rows):
+    widths = [max([len(r[n]) for r in rows]) for n in range(len(rows[0]))]
+    for r in rows:
+        click.echo('  '.join([v.ljust(w) for v, w in zip(r, widths)]).rstrip())
+
+
+@click.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+@click.option('--jobs', default=4, type=int, help=JOBS_HELP)
+@click.option('--plan/--no-plan', default=False, help=PLAN_HELP)
+@click.option('--trace', type=click.Path(dir_okay=False), help=TRACE_HELP)
+def startsites(manifest, batch, jobs, plan, trace):
+    """
+    Create several new Lino sites.
+
+    MANIFEST is a YAML or JSON file with the list of sites to create.  Sites
+    whose project directory exists already are left unchanged.
+    """
+    sites = read_manifest(manifest)
+    i = Installer(batch)
+    project_dirs = {}
+    existing = []
+    shared = {}
+    todo = []
+    with i.override_batch(True):
+        for site in sites:
+            prjname = site['prjname']
+            project_dir = get_project_dir(prjname)
+            if os.path.exists(project_dir):
+                click.echo("Skip {} because {} exists.".format(
+                    prjname, project_dir))
+                existing.append(site)
+                continue
+            project_dirs[prjname] = project_dir
+            site['context'] = add_site_steps(
+                i, site['appname'], prjname, site['dev_repos'],
+                site['shared_env'], site['env_template'], jobs,
+                prefix=prjname + ':', shared=shared, load=site['load'])
+            todo.append(site)
+
+    if plan:
+        i.print_plan()
+        return
+
+    if todo:
+        if not i.yes_or_no("OK to create {} sites?".format(len(todo))):
+            raise click.Abort()
+
+        os.umask(0o002)
+
+        with i.lock():
+            for project_dir in project_dirs.values():
+                os.makedirs(project_dir, exist_ok=True)
+            # The steps run in parallel, so they cannot ask questions.  The
+            # user has confirmed above.
+            with i.override_batch(True):
+                failed, skipped = i.run_steps(jobs)
+                results = site_results(todo, failed, skipped)
+                i.run_apt_install()
+                i.restart_services()
+            i.print_summary()
+            for site in todo:
+                if results[site['prjname']] == "ok":
+                    run_certbot(i, site['context'])
+            i.restart_services()
+            i.write_trace(trace)
+    else:
+        results = {}
+
+    for site in existing:
+        results[site['prjname']] = "exists"
+
+    rows = [("Site", "Application", "Result")]
+    for site in sites:
+        rows.append((site['prjname'], site['appname'], results[site['prjname']]))
+    print_table(rows)
+
+    nok = len([r for r in results.values() if r.startswith("failed")])
+    if nok:
+        raise click.ClickException(
+            "{} of {} sites failed.".format(nok, len(sites)))
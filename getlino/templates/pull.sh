@@ -33,5 +33,11 @@ pull {{name}}
 {%- endif %}
 
 {% if pip_packages -%}
-pip install -U {{pip_packages}}
+# Prefer the wheels of the wheelhouse, but use the package index for what is
+# not in it.
+PIP_OPTIONS=
+if [ -d {{wheelhouse}} ] ; then
+    PIP_OPTIONS="--find-links {{wheelhouse}}"
+fi
+pip install -U $PIP_OPTIONS {{pip_packages}}
 {%- endif %}
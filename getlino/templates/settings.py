@@ -45,12 +45,51 @@ DATABASES = {
             'HOST': '{{db_host}}',
             'PORT': {{db_port}},
         {% endif -%}
+        {%- if pgbouncer %}
+        # PgBouncer runs in transaction pooling mode
+        'DISABLE_SERVER_SIDE_CURSORS': True,
+        {% endif -%}
         {%- if db_engine == "mysql" %}
         'OPTIONS': {
-           "init_command": "SET default_storage_engine=MyISAM",
+           "init_command": "SET default_storage_engine=InnoDB",
+        }
+        {% endif -%}
+        {%- if db_engine == "sqlite3" %}
+        'OPTIONS': {
+            # seconds to wait when another process is writing
+            'timeout': 20,
         }
         {% endif -%}
     }
 }
+{% if db_engine == "sqlite3" %}
+
+def init_sqlite(sender, connection, **kwargs):
+    # Let readers and a writer work at the same time (the journal mode is
+    # stored in the database file) and don't sync after every transaction.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+            cursor.execute("PRAGMA cache_size=-65536")  # 64 MB
+
+from django.db.backends.signals import connection_created
+connection_created.connect(init_sqlite)
+{% endif %}
+
+{% if redis %}
+# The cache is shared by the uwsgi workers of this site.  The key prefix
+# separates it from the caches of the other sites on this server.  REDIS_URL
+# is missing in shared settings written by older versions of getlino.
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': globals().get('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+        'KEY_PREFIX': '{{prjname}}',
+    }
+}
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+{% endif %}
 
 EMAIL_SUBJECT_PREFIX = '[{{prjname}}] '
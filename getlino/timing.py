@@ -0,0 +1,120 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Measure where getlino spends its time.
+
+Every :class:`Installer <getlino.utils.Installer>` has a :class:`Tracer`,
+which records a *span* for every step, subprocess, template and database
+operation.  Spans nest: a subprocess run by a step is a child of the span of
+that step.  At the end of a run, getlino prints a summary of the slowest
+phases, and :option:`--trace` writes all spans to a file in the Chrome trace
+event format, which you can inspect e.g. in :file:`chrome://tracing` or
+https://ui.perfetto.dev.
+
+"""
+
+import os
+import json
+import time
+import threading
+import click
+from contextlib import contextmanager
+
+# the categories of spans that are listed in the summary
+PHASES = ('step', 'phase')
+
+# the category of spans that measure the wall time of a subprocess
+SUBPROCESS = 'subprocess'
+
+
+class Tracer(object):
+    """Records the spans of a getlino run."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, cat, parent=None, **args):
+        """Record the time spent in the body as a span `name` of category
+        `cat`.
+
+        The span is a child of the innermost span of the current thread, or
+        of the span with id `parent` when this is the first span of a thread
+        that runs a step.  The keyword arguments are stored with the span.
+
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        if stack:
+            parent = stack[-1]['id']
+        span = dict(name=name, cat=cat, args=args, parent=parent,
+                    tid=threading.get_ident())
+        with self._lock:
+            span['id'] = len(self.spans)
+            self.spans.append(span)
+        stack.append(span)
+        span['start'] = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span['dur'] = time.perf_counter() - span['start']
+            stack.pop()
+
+    def finished_spans(self):
+        return [s for s in self.spans if 'dur' in s]
+
+    def subprocess_time(self, span, children):
+        """Return the wall time spent in subprocesses of `span`."""
+        if span['cat'] == SUBPROCESS:
+            return span['dur']
+        return sum([self.subprocess_time(c, children)
+                    for c in children.get(span['id'], [])])
+
+    def summary(self):
+        """Return a list of `(name, total, subprocess)` tuples for every
+        phase, sorted by decreasing total time."""
+        spans = self.finished_spans()
+        children = {}
+        for s in spans:
+            children.setdefault(s['parent'], []).append(s)
+        rows = []
+        for s in spans:
+            if s['cat'] in PHASES:
+                rows.append((s['name'], s['dur'],
+                             self.subprocess_time(s, children)))
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return rows
+
+    def print_summary(self, limit=15):
+        rows = self.summary()
+        if not rows:
+            return
+        click.echo("Time spent (wall time, slowest first):")
+        for name, total, sub in rows[:limit]:
+            click.echo("{:8.1f}s  {}  ({:.1f}s in subprocesses, "
+                       "{:.1f}s in getlino)".format(total, name, sub, total - sub))
+        if len(rows) > limit:
+            click.echo("          ... and {} more".format(len(rows) - limit))
+        click.echo("Total {:.1f}s.".format(time.perf_counter() - self.started))
+
+    def as_trace_events(self):
+        """Return the spans as a list of Chrome trace events."""
+        pid = os.getpid()
+        events = []
+        tids = {}
+        for s in self.finished_spans():
+            # short thread numbers are easier to read than thread idents
+            tid = tids.setdefault(s['tid'], len(tids) + 1)
+            events.append(dict(
+                name=s['name'], cat=s['cat'], ph='X', pid=pid, tid=tid,
+                ts=round((s['start'] - self.started) * 1e6),
+                dur=round(s['dur'] * 1e6), args=s['args']))
+        return events
+
+    def write_trace(self, fn):
+        """Write the spans to file `fn` in Chrome trace event format."""
+        with open(fn, 'w') as fd:
+            json.dump(dict(traceEvents=self.as_trace_events(),
+                           displayTimeUnit='ms'), fd)
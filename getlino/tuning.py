@@ -0,0 +1,388 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Compute server settings that depend on the machine and on the sites
+running on it (uwsgi workers, database server), and the :cmd:`getlino tune`
+and :cmd:`getlino db-tune` commands.
+
+The number of CPUs and the amount of RAM are taken from the cached
+:mod:`getlino.facts`.
+
+"""
+
+import os
+import re
+import glob
+import click
+from os.path import join
+
+from .utils import DEFAULTSECTION, BATCH_HELP, DB_ENGINES
+from .utils import Installer, get_project_dir, ifroot
+
+# The load classes of a site.  `weight` is used to share the RAM among the
+# sites of a server, `min` and `max` are the minimum and maximum number of
+# uwsgi workers, `idle` is the number of seconds of inactivity after which
+# uwsgi stops the workers of the site, `threads` is the number of threads per
+# worker.
+LOAD_CLASSES = {
+    'low': dict(weight=1, min=1, max=2, idle=600, threads=0),
+    'medium': dict(weight=2, min=2, max=4, idle=0, threads=0),
+    'high': dict(weight=4, min=2, max=8, idle=0, threads=2),
+}
+
+DEFAULT_LOAD = 'medium'
+
+LOAD_HELP = "The expected load of the site ({}). Used to compute the number "\
+            "of uwsgi workers.".format(', '.join(LOAD_CLASSES))
+
+# Estimated amount of RAM used by one uwsgi worker running a Lino site, in MB.
+WORKER_MB = 150
+
+# The part of the RAM that may be used by the uwsgi workers of all sites.
+# The remaining part is for the database server, nginx, the page cache, ...
+UWSGI_RAM_SHARE = 0.5
+
+# The part of the RAM that may be used by the database server for caching.
+DB_RAM_SHARE = 0.25
+
+# Number of database connections per site in addition to those of its uwsgi
+# workers (linod, cron jobs, manage.py commands).
+EXTRA_CONNECTIONS = 3
+
+MYSQL_CNF = """
+# generated by getlino
+[mysqld]
+default_storage_engine = InnoDB
+innodb_file_per_table = 1
+innodb_buffer_pool_size = {buffer_pool_mb}M
+innodb_log_file_size = {log_file_mb}M
+innodb_flush_method = O_DIRECT
+innodb_flush_log_at_trx_commit = 1
+max_connections = {max_connections}
+table_open_cache = {table_open_cache}
+"""
+
+# Parameters that MySQL reads only when the server starts.  The others in
+# MYSQL_CNF are changed on the running server using SET GLOBAL.
+MYSQL_RESTART_PARAMS = {'innodb_log_file_size', 'innodb_flush_method'}
+
+MEGABYTES_RE = re.compile(r'^(\d+)M$')
+
+# The types of storage on which the database server keeps its data.
+STORAGE_TYPES = ('ssd', 'hdd')
+
+# The directories where Debian's PostgreSQL packages read additional
+# configuration files.  There is one directory per PostgreSQL version.
+POSTGRESQL_CONF_DIRS = '/etc/postgresql/*/main/conf.d'
+
+POSTGRESQL_CONF_NAME = '90-getlino.conf'
+
+# Parameters that PostgreSQL reads only when the server starts.  Changing
+# other parameters needs only a reload.
+POSTMASTER_PARAMS = {'shared_buffers', 'max_connections', 'max_worker_processes'}
+
+CONF_LINE_RE = re.compile(r"^\s*(\w+)\s*=\s*'?([^'#]*?)'?\s*(#.*)?$")
+
+LOAD_RE = re.compile(r'^# load class: (\w+)', re.MULTILINE)
+
+
+def uwsgi_settings(cpu_count, mem_total_mb, load=DEFAULT_LOAD, other_loads=()):
+    """Return a dict with the uwsgi settings for a site of the given load
+    class on a server with `cpu_count` CPUs and `mem_total_mb` MB of RAM
+    where other sites with the given `other_loads` are running.
+
+    The maximum number of workers is limited by the load class, by the
+    number of CPUs (2 per CPU, plus one) and by the share of the RAM for
+    this site.  At least one worker always runs, except after the idle
+    timeout.  When the maximum is higher than the minimum, uwsgi starts with
+    the minimum and spawns more workers when needed ("cheaper" mode).
+
+    """
+    lc = LOAD_CLASSES[load]
+    weights = lc['weight'] + sum(
+        [LOAD_CLASSES.get(l, LOAD_CLASSES[DEFAULT_LOAD])['weight']
+         for l in other_loads])
+    ram_share = mem_total_mb * UWSGI_RAM_SHARE * lc['weight'] / weights
+    processes = min(lc['max'], 2 * cpu_count + 1, int(ram_share // WORKER_MB))
+    processes = max(1, processes)
+    cheaper = min(lc['min'], processes)
+    if cheaper == processes:
+        cheaper = 0
+    return dict(load=load, processes=processes, cheaper=cheaper,
+                idle=lc['idle'], threads=lc['threads'])
+
+
+def read_load(pth):
+    """Return the load class stored in the :xfile:`uwsgi.ini` file `pth`, or
+    `None` if there is no such file or if it doesn't specify a load class."""
+    try:
+        with open(pth) as fd:
+            mo = LOAD_RE.search(fd.read())
+    except OSError:
+        return None
+    if mo is None or mo.group(1) not in LOAD_CLASSES:
+        return None
+    return mo.group(1)
+
+
+def site_loads():
+    """Return a dict mapping the name of every site of this server that runs
+    under uwsgi to its load class."""
+    base = join(DEFAULTSECTION.get('sites_base'), DEFAULTSECTION.get('local_prefix'))
+    loads = {}
+    if not os.path.isdir(base):
+        return loads
+    for prjname in sorted(os.listdir(base)):
+        pth = join(base, prjname, 'nginx', 'uwsgi.ini')
+        if os.path.exists(pth):
+            loads[prjname] = read_load(pth) or DEFAULT_LOAD
+    return loads
+
+
+def site_names():
+    """Return the names of all sites of this server."""
+    base = join(DEFAULTSECTION.get('sites_base'), DEFAULTSECTION.get('local_prefix'))
+    if not os.path.isdir(base):
+        return []
+    return [prjname for prjname in sorted(os.listdir(base))
+            if os.path.exists(join(base, prjname, 'settings.py'))]
+
+
+def db_connections(loads):
+    """Return the maximum number of database connections needed by sites of
+    the given load classes, plus some reserve for the administrator."""
+    n = 10
+    for load in loads:
+        lc = LOAD_CLASSES.get(load, LOAD_CLASSES[DEFAULT_LOAD])
+        n += lc['max'] * max(1, lc['threads']) + EXTRA_CONNECTIONS
+    return n
+
+
+def mysql_settings(mem_total_mb, loads):
+    """Return a dict with the settings of a MySQL or MariaDB server with
+    `mem_total_mb` MB of RAM running the databases of sites with the given
+    load classes.
+
+    The InnoDB buffer pool gets the share of the RAM reserved for the
+    database server, rounded down to a multiple of 128 MB (the InnoDB chunk
+    size).  The redo log is a quarter of the buffer pool (between 48 MB and
+    1 GB).
+
+    """
+    buffer_pool_mb = int(mem_total_mb * DB_RAM_SHARE) // 128 * 128
+    buffer_pool_mb = max(128, buffer_pool_mb)
+    return dict(
+        buffer_pool_mb=buffer_pool_mb,
+        log_file_mb=min(1024, max(48, buffer_pool_mb // 4)),
+        max_connections=max(151, db_connections(loads)),
+        table_open_cache=max(2000, 400 * len(loads)))
+
+
+def postgresql_settings(cpu_count, mem_total_mb, loads, storage='ssd',
+                        version=None):
+    """Return a dict with the parameters of a PostgreSQL server with
+    `cpu_count` CPUs and `mem_total_mb` MB of RAM running the databases of
+    sites with the given load classes.
+
+    `shared_buffers` gets the share of the RAM reserved for the database
+    server, and the planner assumes that most of the remaining RAM is used by
+    the page cache.  `work_mem` is computed so that every connection can run
+    a few sorts in parallel without exhausting the RAM.  `storage` (one of
+    :data:`STORAGE_TYPES`) tells the planner how expensive random reads are.
+    The parameters for parallel queries are written only for PostgreSQL 10 and
+    later (`version` is the major version, as a string).
+
+    """
+    max_connections = max(100, db_connections(loads))
+    shared_buffers_mb = max(128, int(mem_total_mb * DB_RAM_SHARE))
+    gather = min(4, cpu_count // 2)
+    work_mem_kb = (mem_total_mb - shared_buffers_mb) * 1024 // (
+        max_connections * 3) // max(1, gather)
+    settings = dict(
+        max_connections=max_connections,
+        shared_buffers="{}MB".format(shared_buffers_mb),
+        effective_cache_size="{}MB".format(max(
+            shared_buffers_mb, mem_total_mb * 3 // 4)),
+        maintenance_work_mem="{}MB".format(min(2048, max(64, mem_total_mb // 16))),
+        work_mem="{}kB".format(max(4096, work_mem_kb)),
+        min_wal_size='1GB',
+        max_wal_size='4GB',
+        checkpoint_completion_target='0.9',
+        random_page_cost='1.1' if storage == 'ssd' else '4',
+        effective_io_concurrency=200 if storage == 'ssd' else 2)
+    if version is not None and float(version) >= 10:
+        settings.update(
+            max_worker_processes=max(8, cpu_count),
+            max_parallel_workers=cpu_count,
+            max_parallel_workers_per_gather=gather)
+    return settings
+
+
+def postgresql_conf(settings):
+    """Return the content of the tuning file for the given PostgreSQL
+    parameters."""
+    lines = ["# generated by getlino"]
+    for k, v in sorted(settings.items()):
+        if isinstance(v, str):
+            v = "'{}'".format(v)
+        lines.append("{} = {}".format(k, v))
+    return '\n'.join(lines) + '\n'
+
+
+def read_conf(pth):
+    """Return a dict with the parameters set in the PostgreSQL configuration
+    file `pth`, or an empty dict if there is no such file."""
+    settings = {}
+    try:
+        with open(pth) as fd:
+            for ln in fd:
+                mo = CONF_LINE_RE.match(ln)
+                if mo is not None:
+                    settings[mo.group(1)] = mo.group(2)
+    except OSError:
+        pass
+    return settings
+
+
+def needs_restart(old, new, params=POSTMASTER_PARAMS):
+    """Whether changing the parameters `old` into `new` (two dicts as returned
+    by :func:`read_conf`) needs a restart of the server.  `params` are the
+    parameters that the server reads only when it starts."""
+    return any([old.get(k) != new.get(k) for k in params])
+
+
+def mysql_set_global(old, new):
+    """Return the :cmd:`SET GLOBAL` statements that apply the changes from
+    `old` to `new` (two dicts as returned by :func:`read_conf`) to a running
+    MySQL server.  The parameters in :data:`MYSQL_RESTART_PARAMS` are
+    ignored."""
+    statements = []
+    for k, v in sorted(new.items()):
+        if k in MYSQL_RESTART_PARAMS or old.get(k) == v:
+            continue
+        mo = MEGABYTES_RE.match(v)
+        if mo is not None:
+            v = str(int(mo.group(1)) * 1024 * 1024)
+        elif not v.isdigit():
+            v = "'{}'".format(v)
+        statements.append("SET GLOBAL {} = {};".format(k, v))
+    return statements
+
+
+def postgresql_conf_dir():
+    """Return the configuration directory and the major version of the newest
+    PostgreSQL cluster on this server, or `(None, None)` if there is none."""
+    dirs = []
+    for pth in glob.glob(POSTGRESQL_CONF_DIRS):
+        version = pth.split(os.sep)[-3]
+        try:
+            dirs.append((float(version), pth, version))
+        except ValueError:
+            continue
+    if not dirs:
+        return None, None
+    _, pth, version = max(dirs)
+    return pth, version
+
+
+def site_db_loads(planned=None):
+    """Return the load classes of the sites that use the database server,
+    including those in `planned` (a dict of sites being created).
+
+    When the server is configured for more sites (:option:`getlino configure
+    --expected-sites`), the missing sites count with the default load class.
+    """
+    loads = site_loads()
+    for prjname in site_names():
+        loads.setdefault(prjname, DEFAULT_LOAD)
+    loads.update(planned or {})
+    loads = list(loads.values())
+    expected = int(DEFAULTSECTION.get('expected_sites') or 0)
+    loads += [DEFAULT_LOAD] * (expected - len(loads))
+    return loads
+
+
+def tune_uwsgi(facts, prjname, load=DEFAULT_LOAD, planned=None):
+    """Return the uwsgi settings for site `prjname`.
+
+    `planned` is a dict mapping the names of other sites being created
+    together with this one to their load class.
+    """
+    planned = planned or {}
+    others = [l for n, l in site_loads().items()
+              if n != prjname and n not in planned]
+    others += [l for n, l in planned.items() if n != prjname]
+    return uwsgi_settings(facts.cpu_count, facts.mem_total_mb, load, others)
+
+
+def describe_uwsgi(settings):
+    msg = "{processes} uwsgi workers".format(**settings)
+    if settings['cheaper']:
+        msg += " (starting with {cheaper})".format(**settings)
+    if settings['threads']:
+        msg += " with {threads} threads each".format(**settings)
+    if settings['idle']:
+        msg += ", stopped after {idle} seconds of inactivity".format(**settings)
+    return msg
+
+
+@click.command()
+@click.argument('prjname')
+@click.option('--load', type=click.Choice(list(LOAD_CLASSES)), default=None,
+              help=LOAD_HELP + " Default is to keep the current load class.")
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+def tune(prjname, load, batch):
+    """
+    Adapt the uwsgi configuration of a site to this server.
+
+    PRJNAME is the name of the site.  Use this after changing the load class
+    of a site, after adding or removing sites, or after adding CPUs or RAM.
+    """
+    i = Installer(batch)
+    project_dir = get_project_dir(prjname)
+    pth = join(project_dir, 'nginx', 'uwsgi.ini')
+    if not os.path.exists(pth):
+        raise click.ClickException(
+            "{} does not exist.  Is {} a site on this server?".format(
+                pth, prjname))
+    load = load or read_load(pth) or DEFAULT_LOAD
+    settings = tune_uwsgi(i.facts, prjname, load)
+    click.echo("Site {} ({} load) gets {}.".format(
+        prjname, load, describe_uwsgi(settings)))
+    context = dict(DEFAULTSECTION)
+    context.update(prjname=prjname, project_dir=project_dir, uwsgi=settings)
+    with i.lock():
+        if i.jinja_write(pth, **context):
+            # uwsgi re-reads its configuration on a graceful reload
+            if i.batch or i.yes_or_no("Reload site {}?".format(prjname)):
+                with i.override_batch(True):
+                    i.runcmd("sudo supervisorctl signal HUP {}-uwsgi".format(
+                        prjname))
+        i.print_summary()
+
+
+@click.command('db-tune')
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+def db_tune(batch):
+    """
+    Adapt the configuration of the database server to this server.
+
+    Use this after adding or removing sites, after changing the load class of
+    a site, or after adding CPUs or RAM.  The database server is reloaded or
+    restarted only when its configuration has changed.
+    """
+    if not ifroot():
+        raise click.ClickException("This command must run as root.")
+    i = Installer(batch)
+    for db_engine in DB_ENGINES:
+        if db_engine.name == DEFAULTSECTION.get('db_engine'):
+            break
+    else:
+        raise click.ClickException(
+            "Invalid db_engine '{}'.".format(DEFAULTSECTION.get('db_engine')))
+    with i.lock():
+        if not db_engine.tune(i, site_db_loads()):
+            click.echo("The configuration of {} is up to date.".format(
+                db_engine.name))
+        i.restart_services()
+        i.print_summary()
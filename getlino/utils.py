@@ -6,6 +6,7 @@
 """
 
 import os
+import re
 from os.path import join, expanduser
 from pathlib import Path
 import stat
@@ -14,19 +15,30 @@ try:
     import grp
 except ImportError:
     grp = None  # e.g. on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # e.g. on Windows
 import configparser
 import subprocess
+import threading
+import hashlib
+import time
+import secrets
 import click
 # import platform
-import distro
 import collections
 import getpass
 from contextlib import contextmanager
-import virtualenv
-from jinja2 import Environment, PackageLoader
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import lru_cache
 from .setup_info import SETUP_INFO
+from .facts import get_facts, invalidate_facts, is_root, default_cache_dir
+from .timing import Tracer
+from .executor import Executor
 
-JINJA_ENV = Environment(loader=PackageLoader('getlino', 'templates'))
+# Note that virtualenv, jinja2 and distro are imported only where needed
+# because importing them takes more time than running `getlino --help`.
 
 # currently getlino supports only nginx, maybe we might add other web servers
 USE_NGINX = True
@@ -34,6 +46,24 @@ USE_NGINX = True
 BATCH_HELP = "Whether to run in batch mode, i.e. without asking any questions.  "\
              "Don't use this on a machine that is already being used."
 
+JOBS_HELP = "Maximum number of commands (e.g. git clone) or independent steps "\
+            "to run in parallel. Steps run in parallel only in batch mode."
+
+# the file that marks a template virtualenv as complete
+ENV_TEMPLATE_STAMP = 'getlino-template.txt'
+
+# the file used by :meth:`Installer.lock`
+LOCK_FILENAME = 'getlino.lock'
+
+TRACE_HELP = "Write the timing of all steps, subprocesses, templates and "\
+    "database operations to the given file in Chrome trace event format."
+
+PLAN_HELP = "Print the steps that would be run, with their dependencies, "\
+            "and don't run them."
+
+# where apt-get update stores the package lists
+APT_LISTS = '/var/lib/apt/lists'
+
 # note that we double curly braces because we will run format() on this string:
 LOGROTATE_CONF = """
 # generated by getlino
@@ -51,24 +81,87 @@ LOGROTATE_CONF = """
 """
 
 
+def apt_lists_age(lists_dir=APT_LISTS):
+    """Return the age in hours of the newest package list downloaded by
+    :cmd:`apt-get update`, or `None` if there is no package list."""
+    newest = None
+    try:
+        entries = list(os.scandir(lists_dir))
+    except OSError:
+        return None
+    for e in entries:
+        if e.name in ('lock', 'partial') or not e.is_file():
+            continue
+        mtime = e.stat().st_mtime
+        if newest is None or mtime > newest:
+            newest = mtime
+    if newest is None:
+        return None
+    return max(0, time.time() - newest) / 3600
+
+
+def apt_update_reason(age, max_age, refresh=False):
+    """Return why we must run :cmd:`apt-get update` when the package lists
+    are `age` hours old, or `None` if we don't need to."""
+    if refresh:
+        return "--refresh was given"
+    if age is None:
+        return "there are no package lists"
+    if age > max_age:
+        return "package lists are {:.1f} hours old (more than {})".format(
+            age, max_age)
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_jinja_env():
+    from jinja2 import Environment, PackageLoader
+    return Environment(loader=PackageLoader('getlino', 'templates'))
+
+
 class DbEngine(object):
     name = None  # Note that the DbEngine.name field must match the Django engine name
     service = None
     apt_packages = ''
     python_packages = ''
+    client_command = None  # the command that reads SQL statements from stdin
 
-    def runcmd(self, i, sqlcmd):
-        pass
+    def user_statements(self, user, password, host):
+        """Return the SQL statements that create the database user `user`
+        unless it exists."""
+        return []
 
-    def setup_database(self, i, database, user, db_host):
-        click.echo("No setup needed for " + self.name)
+    def database_statements(self, database, user, host):
+        """Return the SQL statements that create the database `database`
+        for `user` unless it exists."""
+        return []
+
+    def provision(self, i, statements):
+        """Run the given SQL statements in a single client session."""
+        if statements:
+            with i.span('provision', 'db', engine=self.name,
+                        statements=len(statements)):
+                i.runcmd(self.client_command, input='\n'.join(statements) + '\n')
 
     def setup_user(self, i, context):
-        click.echo("No need to setup user for " + self.name)
+        self.provision(i, self.user_statements(
+            context['db_user'], context['db_password'], context['db_host']))
+
+    def setup_database(self, i, database, user, db_host):
+        self.provision(i, self.database_statements(database, user, db_host))
 
     def after_prep(self, i, context):
         pass
 
+    def tune(self, i, loads):
+        """Adapt the configuration of the database server to this machine
+        and to sites of the given load classes.  Return True if it has
+        changed."""
+        return False
+
+    # whether provision() might ask questions
+    interactive = False
+
 class SQLite(DbEngine):
     name = 'sqlite3'
     default_port = ""
@@ -78,38 +171,117 @@ class SQLite(DbEngine):
         prjname = context['prjname']
         pth = os.path.join(project_dir, prjname)
         if os.path.exists(pth):
+            self.set_wal_mode(i, pth)
             with i.override_batch(True):
                 i.check_permissions(pth)
 
+    def set_wal_mode(self, i, pth):
+        """Switch the database `pth` to write-ahead logging unless it uses
+        it already.  Return True if the journal mode has changed.
+
+        The :xfile:`settings.py` of new sites does this as well when
+        connecting, but that of sites created by older versions of getlino
+        doesn't.
+        """
+        import sqlite3
+        with i.span('wal', 'db', pth=pth):
+            con = sqlite3.connect(pth, timeout=20)
+            try:
+                mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+                if mode.lower() == 'wal':
+                    return False
+                click.echo("Switch {} from {} to WAL mode.".format(pth, mode))
+                con.execute("PRAGMA journal_mode=WAL")
+                return True
+            finally:
+                con.close()
+
 
 
 class MySQL(DbEngine):
     name = 'mysql'
-    service = 'mysql'
     default_port = "3306"
-    apt_packages = "mysql-server libmysqlclient-dev"
     python_packages = "mysqlclient"
 
-    def __init__(self):
-        super(MySQL, self).__init__()
-        # apt_packages = "mysql-server libmysqlclient-dev"
-        # TODO: support different platforms (Debian, Ubuntu, Elementary, ...)
-        # apt_packages += " python-dev libffi-dev libssl-dev python-mysqldb"
-        if distro.id() == "debian":
-            self.service = 'mariadb'
-            self.apt_packages = "mariadb-server libmariadb-dev-compat libmariadb-dev "\
+    # The service name and system packages depend on the platform.  We compute
+    # them only when needed because collecting the facts takes time.
+
+    # TODO: support different platforms (Debian, Ubuntu, Elementary, ...)
+
+    @property
+    def service(self):
+        if get_facts().distro_id == "debian":
+            return 'mariadb'
+        return 'mysql'
+
+    @property
+    def apt_packages(self):
+        if get_facts().distro_id == "debian":
+            return "mariadb-server libmariadb-dev-compat libmariadb-dev "\
                 "python-dev libffi-dev libssl-dev"
                 # "python-dev libffi-dev libssl-dev python-mysqldb"
+        # apt_packages += " python-dev libffi-dev libssl-dev python-mysqldb"
+        return "mysql-server libmysqlclient-dev"
+
+    @property
+    def tuning_file(self):
+        if get_facts().distro_id == "debian":
+            return '/etc/mysql/mariadb.conf.d/90-getlino.cnf'
+        return '/etc/mysql/mysql.conf.d/90-getlino.cnf'
+
+    def tune(self, i, loads):
+        from .tuning import mysql_settings, read_conf, needs_restart
+        from .tuning import mysql_set_global, MYSQL_CNF, MYSQL_RESTART_PARAMS
+        pth = self.tuning_file
+        if not os.path.isdir(os.path.dirname(pth)):
+            click.echo("Cannot tune {} because {} doesn't exist.".format(
+                self.name, os.path.dirname(pth)))
+            return False
+        settings = mysql_settings(i.facts.mem_total_mb, loads)
+        click.echo("Tune {} for {} sites: {buffer_pool_mb} MB buffer pool, "
+                   "{max_connections} connections.".format(
+                       self.name, len(loads), **settings))
+        old = read_conf(pth)
+        if not i.write_file(pth, MYSQL_CNF.format(**settings)):
+            return False
+        new = read_conf(pth)
+        if needs_restart(old, new, MYSQL_RESTART_PARAMS):
+            # e.g. the size of the redo log can change only at startup
+            i.must_restart(self.service)
+        else:
+            # don't interrupt the sites when e.g. a new site needs more
+            # connections
+            statements = mysql_set_global(old, new)
+            click.echo("Apply {} changed settings to the running {} server "
+                       "without restarting it.".format(len(statements),
+                                                       self.name))
+            self.provision(i, statements)
+        return True
 
-    def run(self, i, sqlcmd):
-        return i.runcmd('mysql -u root -p -e "{};"'.format(sqlcmd))
+    # mysql -p asks for the root password (once per session, on the terminal)
+    interactive = True
 
-    def setup_user(self, i, context):
-        self.run(i, "create user '{db_user}'@'{db_host}' identified by '{db_password}'".format(**context))
+    # the statements are read from stdin
+    client_command = "mysql -u root -p"
 
-    def setup_database(self, i, database, user, db_host):
-        self.run(i, "create database {database} charset 'utf8'".format(**locals()))
-        self.run(i, "grant all PRIVILEGES on {database}.* to '{user}'@'{db_host}'".format(**locals()))
+    @staticmethod
+    def literal(s):
+        return "'" + s.replace('\\', '\\\\').replace("'", "''") + "'"
+
+    @staticmethod
+    def ident(s):
+        return '`' + s.replace('`', '``') + '`'
+
+    def user_statements(self, user, password, host):
+        return ["CREATE USER IF NOT EXISTS {}@{} IDENTIFIED BY {};".format(
+            self.literal(user), self.literal(host), self.literal(password))]
+
+    def database_statements(self, database, user, host):
+        return [
+            "CREATE DATABASE IF NOT EXISTS {} CHARACTER SET utf8;".format(
+                self.ident(database)),
+            "GRANT ALL PRIVILEGES ON {}.* TO {}@{};".format(
+                self.ident(database), self.literal(user), self.literal(host))]
 
 class PostgreSQL(DbEngine):
     name = 'postgresql'
@@ -119,22 +291,62 @@ class PostgreSQL(DbEngine):
     python_packages = "psycopg2-binary"
     default_port = "5432"
 
-    def run(self, i, cmd):
-        assert '"' not in cmd
-        # self.runcmd('sudo -u postgres bash -c "psql -c \\\"{}\\\""'.format(cmd))
-        i.runcmd('sudo -u postgres psql -c "{}"'.format(cmd))
-
-    def setup_user(self, i, context):
-        self.run(i, "CREATE USER {db_user} WITH PASSWORD '{db_password}';".format(**context))
-
-    def setup_database(self, i, database, user, db_host):
-        self.run(i, "CREATE DATABASE {database};".format(**locals()))
-        self.run(i, "GRANT ALL PRIVILEGES ON DATABASE {database} TO {user};".format(**locals()))
+    # The statements are read from stdin.  We stop at the first error.
+    client_command = "sudo -u postgres psql -X -q -v ON_ERROR_STOP=1"
+
+    @staticmethod
+    def literal(s):
+        return "'" + s.replace("'", "''") + "'"
+
+    # PostgreSQL has no CREATE ROLE IF NOT EXISTS, and CREATE DATABASE cannot
+    # run in a DO block.  So we let a SELECT generate the statement only when
+    # needed and execute its result using \gexec.
+
+    def user_statements(self, user, password, host):
+        return [
+            "SELECT format('CREATE ROLE %I LOGIN PASSWORD %L', {0}, {1}) "
+            "WHERE NOT EXISTS (SELECT FROM pg_roles WHERE rolname = {0})"
+            "\\gexec".format(self.literal(user), self.literal(password))]
+
+    def database_statements(self, database, user, host):
+        return [
+            "SELECT format('CREATE DATABASE %I', {0}) "
+            "WHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = {0})"
+            "\\gexec".format(self.literal(database)),
+            "SELECT format('GRANT ALL PRIVILEGES ON DATABASE %I TO %I', "
+            "{}, {})\\gexec".format(self.literal(database), self.literal(user))]
+
+    def tune(self, i, loads):
+        from .tuning import postgresql_settings, postgresql_conf, read_conf
+        from .tuning import postgresql_conf_dir, needs_restart
+        from .tuning import POSTGRESQL_CONF_NAME
+        conf_dir, version = postgresql_conf_dir()
+        if conf_dir is None:
+            click.echo("Cannot tune {} because there is no cluster.".format(
+                self.name))
+            return False
+        pth = os.path.join(conf_dir, POSTGRESQL_CONF_NAME)
+        settings = postgresql_settings(
+            i.facts.cpu_count, i.facts.mem_total_mb, loads,
+            DEFAULTSECTION.get('db_storage') or 'ssd', version)
+        click.echo("Tune {} {} for {} sites: {shared_buffers} shared buffers, "
+                   "{max_connections} connections.".format(
+                       self.name, version, len(loads), **settings))
+        old = read_conf(pth)
+        if not i.update_file(pth, postgresql_conf(settings)):
+            return False
+        if needs_restart(old, read_conf(pth)):
+            i.must_restart(self.service)
+        else:
+            i.must_reload(self.service)
+        return True
 
 
 DB_ENGINES = [MySQL(), PostgreSQL(), SQLite()]
 
 
+Step = collections.namedtuple('Step', 'name func deps interactive')
+
 Repo = collections.namedtuple(
     'Repo', 'nickname package_name git_repo settings_module front_end')
 REPOS_DICT = {}
@@ -196,33 +408,123 @@ CONFIG = configparser.ConfigParser()
 FOUND_CONFIG_FILES = CONFIG.read(CONF_FILES)
 DEFAULTSECTION = CONFIG[CONFIG.default_section]
 
+def get_project_dir(prjname):
+    """Return the project directory of the site `prjname`."""
+    return join(DEFAULTSECTION.get('sites_base'),
+                DEFAULTSECTION.get('local_prefix'), prjname)
+
+
+def atomic_write(pth, data, si=None):
+    """Write the bytes `data` to a temporary file in the same directory as
+    `pth`, then rename it to `pth`.
+
+    If `si` is given, it is the result of :func:`os.stat` on the old file, and
+    the new file gets the same mode and ownership.
+    """
+    head, tail = os.path.split(pth)
+    tmp = join(head, ".{}.{}.tmp".format(tail, secrets.token_hex(4)))
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if si is not None:
+            # preserve mode and ownership of the existing file
+            os.chmod(tmp, stat.S_IMODE(si.st_mode))
+            if ifroot():
+                os.chown(tmp, si.st_uid, si.st_gid)
+        os.replace(tmp, pth)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def link_or_copy(src, dst):
+    """Create `dst` as a hard link to `src`, or as a copy if that's not
+    possible (e.g. on another file system)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def clone_virtualenv(src, dst):
+    """Create a virtualenv `dst` as a clone of the virtualenv `src`.
+
+    The files are hard links to those of `src`, so they share their pages on
+    disk and in the page cache.  The activation scripts and the other files
+    that contain the path of `src` are rewritten as new files (not in place),
+    so that `src` remains unchanged.  Note that pip never modifies installed
+    files in place, it removes them and creates new ones.
+    """
+    shutil.copytree(src, dst, symlinks=True, copy_function=link_or_copy)
+    old = os.fsencode(os.path.abspath(src))
+    new = os.fsencode(os.path.abspath(dst))
+    candidates = [join(dst, 'pyvenv.cfg')]
+    bindir = join(dst, 'bin')
+    if os.path.isdir(bindir):
+        candidates += [join(bindir, fn) for fn in os.listdir(bindir)]
+    for pth in candidates:
+        if os.path.islink(pth) or not os.path.isfile(pth):
+            continue
+        with open(pth, 'rb') as fd:
+            data = fd.read()
+        if old in data:
+            atomic_write(pth, data.replace(old, new), os.stat(pth))
+
+
 def ifroot(true=True, false=False):
-    if not hasattr(os, 'geteuid'):
-        return false
-    if os.geteuid() == 0:
+    if is_root():
         return true
     return false
 
 def has_usergroup(usergroup):
-    for gid in os.getgroups():
-        if grp.getgrgid(gid).gr_name == usergroup:
-            return True
-    return False
+    return usergroup in get_facts().groups
 
 
 class Installer(object):
     """Volatile object used by :mod:`getlino.configure` and :mod:`getlino.startsite`.
     """
+
+    # runs the shell commands, see :mod:`getlino.executor`
+    executor = Executor()
+
     def __init__(self, batch=False):
         self.batch = batch
         # self.asroot = ifroot()
         self._services = set()
+        self._reloads = set()
+        self._supervisor_groups = set()
+        self._services_lock = threading.Lock()  # protects the three sets above
         self._system_packages = set()
+        self._installed_packages = []  # installed by us
+        self._present_packages = []  # already installed before
+        self._echo_lock = threading.RLock()
+        self._local = threading.local()  # the step run by the current thread
+        self._steps = collections.OrderedDict()
+        self._changed_files = []
+        self._unchanged_files = []
+        self.tracer = Tracer()
         if ifroot():
             click.echo("Running as root.")
+        facts = self.facts
         click.echo("This is getlino version {} running on {} ({} {}).".format(
-            SETUP_INFO['version'], distro.name(pretty=True),
-            distro.id(), distro.codename()))
+            SETUP_INFO['version'], facts.distro_name,
+            facts.distro_id, facts.distro_codename))
+
+    @property
+    def facts(self):
+        """The :class:`getlino.facts.Facts` about this machine."""
+        return get_facts()
+
+    def span(self, name, cat='phase', **args):
+        """Measure the time spent in the body.  See :mod:`getlino.timing`."""
+        return self.tracer.span(name, cat, **args)
+
+    def write_trace(self, fn):
+        """Write the timing of this run to the given file, if any."""
+        if fn:
+            self.tracer.write_trace(fn)
+            click.echo("Wrote trace to {}.".format(fn))
 
 
     def check_overwrite(self, pth):
@@ -256,7 +558,20 @@ class Installer(object):
                 return False
 
     def must_restart(self, srvname):
-        self._services.add(srvname)
+        with self._services_lock:
+            self._services.add(srvname)
+
+    def must_reload(self, srvname):
+        with self._services_lock:
+            self._reloads.add(srvname)
+
+    def must_update_supervisor(self, content):
+        """Remember that the supervisor program groups defined in `content`
+        have changed."""
+        names = re.findall(r'^\[program:([^\]]+)\]', content, re.MULTILINE)
+        with self._services_lock:
+            for name in names:
+                self._supervisor_groups.add(name.strip())
 
     def runcmd(self, cmd, **kw):
         """Run the cmd similar as os.system(), but stop when Ctrl-C.
@@ -266,30 +581,232 @@ class Installer(object):
         subprocess is responsible for reporting the reason of the error.
 
         """
-        # kw.update(stdout=subprocess.PIPE)
-        # kw.update(stderr=subprocess.STDOUT)
-        kw.update(shell=True)
-        kw.update(universal_newlines=True)
         # kw.update(check=True)
         # subprocess.check_output(cmd, **kw)
         if self.batch or self.yes_or_no("run {}".format(cmd), default=True):
-            click.echo(cmd)
-            cp = subprocess.run(cmd, **kw)
-            if cp.returncode != 0:
+            step = getattr(self._local, 'step', None)
+            if step is None:
+                click.echo(cmd)
+                with self.span(cmd, 'subprocess'):
+                    returncode = self.executor.run(cmd, **kw)
+            elif step.interactive:
+                # keep the terminal for us while the subprocess might ask
+                # questions
+                with self._echo_lock:
+                    self.echo(cmd, step.name)
+                    with self.span(cmd, 'subprocess'):
+                        returncode = self.executor.run(cmd, **kw)
+            else:
+                returncode = self.run_prefixed(step.name, cmd, **kw)
+            if returncode != 0:
                 # subprocess.run("sudo journalctl -xe", **kw)
                 raise click.ClickException(
-                "{} ended with return code {}".format(cmd, cp.returncode))
+                "{} ended with return code {}".format(cmd, returncode))
+
+    def echo(self, msg, label=None):
+        """Echo a message, prefixed by `label` if given.
+
+        Safe to be called from several threads at the same time.
+        """
+        if label is not None:
+            msg = "[{}] {}".format(label, msg)
+        with self._echo_lock:
+            click.echo(msg)
+
+    def run_prefixed(self, label, cmd, **kw):
+        """Run `cmd` and echo its output line by line, prefixed by `label`.
+
+        Return the return code of the subprocess. Unlike :meth:`runcmd` this
+        doesn't ask for confirmation and doesn't raise an exception when the
+        subprocess fails.
+        """
+        self.echo(cmd, label)
+        with self.span(cmd, 'subprocess', label=label):
+            return self.executor.run(
+                cmd, lambda ln: self.echo(ln, label), **kw)
+
+    def run_parallel(self, commands, jobs=1):
+        """Run the given `(label, cmd)` tuples using a pool of `jobs` threads.
+
+        Return the sorted list of labels whose command failed.  A failing
+        command does not stop the others.
+        """
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = {
+                pool.submit(self.run_prefixed, label, cmd): label
+                for label, cmd in commands}
+            for f in as_completed(futures):
+                label = futures[f]
+                try:
+                    rc = f.result()
+                except Exception as e:
+                    self.echo("Oops: {}".format(e), label)
+                    rc = -1
+                if rc != 0:
+                    failed.append(label)
+        return sorted(failed)
+
+    def add_step(self, name, func, deps=(), interactive=False):
+        """Add a step to the plan.
+
+        `func` is a callable without arguments.  `deps` is a list of names of
+        the steps that must have finished before this step can start.
+        Dependencies on steps that are not part of the plan are ignored, which
+        makes it easier to add optional steps.  `interactive` means that the
+        step might ask questions in a subprocess, so its output must not be
+        captured.
+
+        """
+        if name in self._steps:
+            raise Exception("Duplicate step {}".format(name))
+        deps = tuple([d for d in deps if d in self._steps])
+        self._steps[name] = Step(name, func, deps, interactive)
+
+    def add_deps(self, name, deps):
+        """Add the steps `deps` to the dependencies of the step `name`.
+
+        The step is moved to the end of the plan, so that it comes after its
+        dependencies when the plan runs sequentially.  As in
+        :meth:`add_step`, dependencies on steps that are not part of the plan
+        are ignored.
+        """
+        step = self._steps.pop(name)
+        deps = step.deps + tuple(
+            [d for d in deps if d in self._steps and d not in step.deps])
+        self._steps[name] = step._replace(deps=deps)
+
+    def print_plan(self):
+        """Print the steps of the plan with their dependencies.
+
+        The level of a step is the number of steps that must run before it.
+        Steps of a same level can run in parallel.
+        """
+        levels = {}
+        click.echo("Plan with {} steps:".format(len(self._steps)))
+        for step in self._steps.values():
+            levels[step.name] = 1 + max([levels[d] for d in step.deps] or [0])
+            msg = "{:>3} {}".format(levels[step.name], step.name)
+            if step.deps:
+                msg += " (after {})".format(', '.join(step.deps))
+            click.echo(msg)
+
+    def run_step(self, step, captured=False, parent=None):
+        if captured:
+            self._local.step = step
+        try:
+            with self.tracer.span(step.name, 'step', parent=parent):
+                step.func()
+        finally:
+            self._local.step = None
+
+    def run_plan(self, jobs=1):
+        """Run the steps of the plan and then forget them.
+
+        When `jobs` is 1 or when we are not in batch mode, run the steps one
+        after the other in the order they have been added, and stop at the
+        first failure.  Otherwise run independent steps in parallel using a
+        pool of `jobs` threads, capture their output, and report the failed
+        steps at the end.  The steps that depend on a failed step are skipped.
+
+        """
+        if jobs <= 1 or not self.batch:
+            steps = list(self._steps.values())
+            self._steps = collections.OrderedDict()
+            self._changed_files = []
+            self._unchanged_files = []
+            with self.span('plan'):
+                for step in steps:
+                    self.run_step(step)
+            return
+        failed, skipped = self.run_steps(jobs)
+        if failed:
+            msg = "{} steps failed: {}".format(len(failed), ' '.join(failed))
+            if skipped:
+                msg += " (skipped {})".format(' '.join(skipped))
+            raise click.ClickException(msg)
+
+    def run_steps(self, jobs=1):
+        """Run the steps of the plan in parallel using a pool of `jobs`
+        threads, and then forget them.
+
+        Unlike :meth:`run_plan` this doesn't raise an exception when a step
+        fails.  Return a tuple `(failed, skipped)` with the names of the steps
+        that failed and of those that have been skipped because they depend on
+        a failed step.
+
+        """
+        steps = list(self._steps.values())
+        self._steps = collections.OrderedDict()
+        self._changed_files = []
+        self._unchanged_files = []
+        done = set()
+        failed = []
+        skipped = []
+        running = {}
+        with self.span('plan', jobs=jobs) as plan, \
+                ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            while steps or running:
+                for step in list(steps):
+                    if any([d in failed or d in skipped for d in step.deps]):
+                        steps.remove(step)
+                        skipped.append(step.name)
+                    elif all([d in done for d in step.deps]):
+                        steps.remove(step)
+                        f = pool.submit(self.run_step, step, True, plan['id'])
+                        running[f] = step
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    step = running.pop(f)
+                    try:
+                        f.result()
+                        done.add(step.name)
+                    except Exception as e:
+                        self.echo("Step failed: {}".format(e), step.name)
+                        failed.append(step.name)
+        return failed, skipped
+
+    @contextmanager
+    def lock(self):
+        """Hold the lock file of this server while running the body.
+
+        Two getlino processes that run at the same time might corrupt shared
+        state (configuration files, the shared virtualenv, the wheelhouse,
+        ...).  When another process holds the lock, we wait until it releases
+        it.  The lock is released automatically when the process ends.
+
+        """
+        if fcntl is None:
+            yield self
+            return
+        pth = join(default_cache_dir(), LOCK_FILENAME)
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        with open(pth, 'a') as fd:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                click.echo("Waiting for another getlino process "
+                           "(lock file {})...".format(pth))
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
 
     def apt_install(self, packages):
+        """Remember that the given system packages must be installed.  They
+        get installed by :meth:`run_apt_install`."""
         for pkg in packages.split():
-            # no check for if package is already installed:
             self._system_packages.add(pkg)
 
-    def run_in_env(self, env, cmd):
+    def run_in_env(self, env, cmd, **kw):
         """env is the path of the virtualenv"""
         # click.echo(cmd)
         cmd = ". {}/bin/activate && {}".format(env, cmd)
-        self.runcmd(cmd)
+        with self.span(cmd, 'env', env=env):
+            self.runcmd(cmd, **kw)
 
     def check_permissions(self, pth, executable=False):
         si = os.stat(pth)
@@ -297,7 +814,7 @@ class Installer(object):
         if grp and ifroot():
             # check whether group owner is what we want
             usergroup = DEFAULTSECTION.get('usergroup')
-            if grp.getgrgid(si.st_gid).gr_name != usergroup:
+            if usergroup and grp.getgrgid(si.st_gid).gr_name != usergroup:
                 if self.batch or self.yes_or_no("Set group owner for {}".format(pth),
                                                 default=True):
                     shutil.chown(pth, group=usergroup)
@@ -327,13 +844,49 @@ class Installer(object):
         finally:
             self.batch = old
 
+    def update_file(self, pth, content):
+        """Write `content` to the file `pth` unless the file already has this
+        content.
+
+        Return True if the file has been written, False if it was unchanged
+        or if the user refused to overwrite it.
+
+        We compare the hash of the new content with that of the file on disk.
+        The new content is written to a temporary file in the same directory,
+        which is then renamed, so that other processes (e.g. nginx or
+        supervisor) never see a half-written file.
+        """
+        with self.span(str(pth), 'file'):
+            return self._update_file(pth, content)
+
+    def _update_file(self, pth, content):
+        pth = os.path.realpath(str(pth))
+        data = content.encode('utf-8')
+        si = None
+        if os.path.isfile(pth):
+            with open(pth, 'rb') as fd:
+                old = fd.read()
+            if hashlib.sha256(old).digest() == hashlib.sha256(data).digest():
+                self._unchanged_files.append(pth)
+                return False
+            if not self.yes_or_no("Overwrite existing file {} ?".format(pth)):
+                return False
+            si = os.stat(pth)
+        elif not self.check_overwrite(pth):  # e.g. a directory
+            return False
+        atomic_write(pth, data, si)
+        self._changed_files.append(pth)
+        return True
+
     def write_file(self, pth, content, **kwargs):
-        if self.check_overwrite(pth):
-            with open(pth, 'w') as fd:
-                fd.write(content)
+        """Write `content` to the file `pth` unless the file already has this
+        content, then check its permissions.  Return True if the file has been
+        written."""
+        changed = self.update_file(pth, content)
+        if os.path.exists(pth):
             with self.override_batch(True):
                 self.check_permissions(pth, **kwargs)
-            return True
+        return changed
 
     def write_daily_cron_job(self, filename, content):
         fn = Path('/etc/cron.daily') / filename
@@ -343,9 +896,9 @@ class Installer(object):
         self.check_permissions(fn, executable=True)
 
     def write_supervisor_conf(self, filename, content):
-        self.write_file(
-            join(DEFAULTSECTION.get('supervisor_dir'), filename), content)
-        self.must_restart('supervisor')
+        if self.write_file(
+                join(DEFAULTSECTION.get('supervisor_dir'), filename), content):
+            self.must_update_supervisor(content)
 
     def make_file_executable(self,file_path):
         """ Make a file executable """
@@ -366,26 +919,126 @@ class Installer(object):
                 # create an empty directory and fix permissions
                 os.makedirs(envdir)
                 self.check_permissions(envdir)
+                import virtualenv
                 virtualenv.cli_run([envdir,'--python','python3'])
                 ok = True
         if ok:
-            context.update(envdir=envdir)
+            context = dict(context, envdir=envdir)
             if not os.path.exists(pull_sh_path):
                 self.jinja_write(pull_sh_path, **context)
             self.make_file_executable(pull_sh_path)
         return ok
 
-    def clone_repo(self, repo):
-        branch = DEFAULTSECTION.get('branch')
-        if not os.path.exists(repo.nickname):
-            self.runcmd("git clone --depth 1 -b {} {} {}".format(branch, repo.git_repo, repo.nickname))
-        else:
+    def make_env_template(self, tpldir, packages, pip_options=''):
+        """Create a template virtualenv in `tpldir` with the given Python
+        packages installed, unless it exists already.
+
+        A template is complete only when it contains a
+        :data:`ENV_TEMPLATE_STAMP` file.  An incomplete template (e.g. after a
+        failed pip install) is removed and built again.
+        """
+        stamp = join(tpldir, ENV_TEMPLATE_STAMP)
+        if os.path.exists(stamp):
+            return
+        if os.path.exists(tpldir):
+            shutil.rmtree(tpldir)
+        click.echo("Create template virtualenv {}".format(tpldir))
+        os.makedirs(tpldir)
+        self.check_permissions(tpldir)
+        import virtualenv
+        virtualenv.cli_run([tpldir, '--python', 'python3'])
+        self.run_in_env(tpldir, "pip install {} {}".format(
+            pip_options, ' '.join(packages)))
+        self.run_in_env(tpldir, "pip freeze > {}".format(stamp))
+
+    def clone_virtualenv(self, tpldir, envdir):
+        """Create the virtualenv `envdir` by cloning the template virtualenv
+        `tpldir`.  Return True if the virtualenv has been created."""
+        msg = "Create virtualenv in {} from template {}"
+        if self.batch or self.yes_or_no(msg.format(envdir, tpldir), default=True):
+            clone_virtualenv(tpldir, envdir)
+            os.remove(join(envdir, ENV_TEMPLATE_STAMP))
+            self.check_permissions(envdir)
+            return True
+        return False
+
+    def clone_command(self, repo, repos_base=''):
+        """Return the command for cloning the given repository, or `None` if
+        the repository has already been cloned.
+
+        """
+        pth = join(repos_base, repo.nickname)
+        if os.path.exists(pth):
             click.echo(
                 "No need to clone {} : directory exists.".format(
                     repo.nickname))
-
-    def install_repo(self, repo, env):
-        self.run_in_env(env, "pip install -e {}".format(repo.nickname))
+            return None
+        branch = DEFAULTSECTION.get('branch', 'master')
+        url = repo.git_repo
+        if os.path.isdir(url):
+            # a local (bare) repository. Use a file:// url because otherwise
+            # git ignores the --depth option.
+            url = Path(os.path.abspath(url)).as_uri()
+        return "git clone --depth 1 -b {} {} {}".format(branch, url, pth)
+
+    def clone_repo(self, repo, repos_base=''):
+        cmd = self.clone_command(repo, repos_base)
+        if cmd is not None:
+            self.runcmd(cmd)
+
+    def clone_repos(self, repos, repos_base='', jobs=1):
+        """Clone the given repositories into `repos_base`, running up to
+        `jobs` clones in parallel.
+
+        Report all failed clones at the end.
+        """
+        commands = []
+        for repo in repos:
+            cmd = self.clone_command(repo, repos_base)
+            if cmd is not None:
+                commands.append((repo.nickname, cmd))
+        if len(commands) == 0:
+            return
+        click.echo("Cloning {} repositories using {} jobs...".format(
+            len(commands), min(jobs, len(commands))))
+        failed = self.run_parallel(commands, jobs)
+        if failed:
+            raise click.ClickException(
+                "Failed to clone {} of {} repositories: {}".format(
+                    len(failed), len(commands), ' '.join(failed)))
+
+    def install_repo(self, repo, env, repos_base=''):
+        self.run_in_env(env, "pip install -e {}".format(
+            join(repos_base, repo.nickname)))
+
+    def install_repos(self, repos, env, repos_base=''):
+        """Install the given repositories in editable mode into the virtualenv
+        `env` using a single pip invocation.
+
+        pip then resolves the dependencies only once for all repositories.
+        If this fails, install the repositories one by one in order to find
+        out which of them failed.
+        """
+        if len(repos) == 0:
+            return
+        editables = ' '.join(["-e {}".format(join(repos_base, r.nickname))
+                              for r in repos])
+        try:
+            self.run_in_env(env, "pip install " + editables)
+            return
+        except click.ClickException:
+            click.echo("Batched install failed. "
+                       "Installing {} repositories one by one...".format(len(repos)))
+        failed = []
+        for repo in repos:
+            try:
+                self.install_repo(repo, env, repos_base)
+            except click.ClickException:
+                failed.append(repo.nickname)
+        if failed:
+            raise click.ClickException(
+                "Failed to install {} of {} repositories: {}".format(
+                    len(failed), len(repos), ' '.join(failed)))
 
     def check_usergroup(self, usergroup):
         # not used since 20200720
@@ -413,46 +1066,123 @@ sudo adduser `whoami` {1}"""
         """
         pth : the full path of the file to generate.
         tplname : name of the template file to render.  If tplname is not specified, use the tail of the output file.
+
+        Return True if the file has been written, False if it was unchanged
+        or if the user refused to overwrite it.
         """
-        if not self.check_overwrite(pth):
-            return False
         if tplname is None:
             head, tplname = os.path.split(pth)
-        tpl = JINJA_ENV.get_template(tplname)
-        s = tpl.render(**context)
-        with open(pth, 'w') as fh:
-            fh.write(s)
-        return True
+        with self.span(tplname, 'template', pth=str(pth)):
+            tpl = get_jinja_env().get_template(tplname)
+            ctx = dict(facts=self.facts)
+            ctx.update(context)
+            s = tpl.render(**ctx)
+            return self.update_file(pth, s)
+
+    def print_summary(self):
+        """Print a summary of what has been done."""
+        if self._changed_files:
+            click.echo("Changed {} files:".format(len(self._changed_files)))
+            for pth in self._changed_files:
+                click.echo("- " + pth)
+        else:
+            click.echo("No files changed.")
+        if self._unchanged_files:
+            click.echo("{} files were unchanged.".format(
+                len(self._unchanged_files)))
+        if self._installed_packages:
+            click.echo("Installed {} system packages: {}".format(
+                len(self._installed_packages),
+                ' '.join(self._installed_packages)))
+        if self._present_packages:
+            click.echo("{} system packages were already installed.".format(
+                len(self._present_packages)))
+        self.tracer.print_summary()
 
     def run_apt_install(self):
+        """Install the system packages requested by :meth:`apt_install`
+        that are not yet installed, then forget them.
+
+        The installed packages are known from the facts (a single call to
+        :cmd:`dpkg-query`), so we don't run :cmd:`apt-get` at all when
+        nothing is missing.
+        """
         if len(self._system_packages) == 0:
             return
+        installed = self.facts.packages
+        missing = sorted([p for p in self._system_packages if p not in installed])
+        present = sorted([p for p in self._system_packages if p in installed])
+        self._system_packages = set()
+        self._present_packages.extend(present)
+        if not missing:
+            click.echo("All {} system packages are already installed.".format(
+                len(present)))
+            return
         if not ifroot() and not has_usergroup('sudo'):
             click.echo(
                 "The following system packages were not "
                 "installed because you cannot sudo:\n{}".format(
-                    ' '.join(list(self._system_packages))))
+                    ' '.join(missing)))
             return
-        # click.echo("Must install {} system packages: {}".format(
-        #     len(self._system_packages), ' '.join(self._system_packages)))
+        click.echo("Must install {} system packages ({} already installed).".format(
+            len(missing), len(present)))
         cmd = "sudo apt-get install "
         if self.batch:
             cmd += "-y "
-        self.runcmd(cmd + ' '.join(self._system_packages))
+        with self.span('apt'):
+            self.runcmd(cmd + ' '.join(missing))
+        self._installed_packages.extend(missing)
+        invalidate_facts()
 
     def restart_services(self):
-        if len(self._services) == 0:
+        """Run the actions needed to activate the changes, then forget them.
+
+        Do nothing when nothing has changed.  Rather than restarting
+        supervisor (which would stop the processes of all sites on this
+        server), we ask it to reread its configuration and update only the
+        program groups whose configuration has changed.  nginx gets reloaded
+        after testing its configuration.  Other services are reloaded or
+        restarted as requested.
+
+        Steps running in parallel may request other actions meanwhile.  These
+        are not forgotten and will be done by the next call.
+        """
+        with self._services_lock:
+            groups = sorted(self._supervisor_groups)
+            reloads = sorted(self._reloads)
+            restarts = sorted(self._services)
+        if not (groups or reloads or restarts):
             return
         if not ifroot() and not has_usergroup('sudo'):
             click.echo(
                 "The following system services were not "
-                "restarted because you cannot sudo:\n{}".format(
-                    ' '.join(list(self._services))))
+                "updated because you cannot sudo:\n{}".format(
+                    ' '.join(groups + reloads + restarts)))
             return
-        msg = "Restart services {}".format(self._services)
+        msg = "Activate changes"
+        if groups:
+            msg += ", update supervisor programs {}".format(' '.join(groups))
+        if reloads:
+            msg += ", reload services {}".format(' '.join(reloads))
+        if restarts:
+            msg += ", restart services {}".format(' '.join(restarts))
         if self.batch or self.yes_or_no(msg, default=True):
-            with self.override_batch(True):
-                for srv in self._services:
+            with self.override_batch(True), self.span('activate'):
+                if groups:
+                    self.runcmd("sudo supervisorctl reread")
+                    self.runcmd("sudo supervisorctl update {}".format(
+                        ' '.join(groups)))
+                for srv in reloads:
+                    if srv == 'nginx':
+                        # don't reload nginx with a broken configuration
+                        self.runcmd("sudo nginx -t")
+                        self.runcmd("sudo nginx -s reload")
+                        continue
+                    try:
+                        self.runcmd("sudo service {} reload".format(srv))
+                    except Exception:
+                        restarts.append(srv)
+                for srv in restarts:
                     try:
                         self.runcmd("sudo service {} restart".format(srv))
                     except Exception:
@@ -460,3 +1190,7 @@ sudo adduser `whoami` {1}"""
                             self.runcmd("sudo /etc/init.d/{}  restart".format(srv))
                         except Exception:
                             continue
+        with self._services_lock:
+            self._supervisor_groups.difference_update(groups)
+            self._reloads.difference_update(reloads)
+            self._services.difference_update(restarts)
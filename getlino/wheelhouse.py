@@ -0,0 +1,182 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""The :cmd:`getlino wheelhouse` command.
+
+A wheelhouse is a directory with pre-built wheels of the Python packages
+needed by the Lino sites on this server.  When it contains everything a new
+site needs, :cmd:`getlino startsite` and :xfile:`pull.sh` install from it
+without downloading or building anything.
+
+"""
+
+import os
+import re
+import click
+from os.path import join
+
+from .utils import DEFAULTSECTION, DB_ENGINES, BATCH_HELP
+from .utils import APPNAMES, REPOS_DICT, FRONT_ENDS
+from .utils import Installer
+
+WHEELHOUSE_DIRNAME = 'wheelhouse'
+
+# the file in the wheelhouse that lists the packages it has been built for
+REQUIREMENTS_FILENAME = 'requirements.txt'
+
+# see https://www.python.org/dev/peps/pep-0427/#file-name-convention
+WHEEL_RE = re.compile(r'^(?P<name>[^-]+)-(?P<version>[^-]+)-.*\.whl$')
+
+
+def get_wheelhouse():
+    """Return the path of the wheelhouse of this server."""
+    return join(DEFAULTSECTION.get('sites_base'), WHEELHOUSE_DIRNAME)
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def read_requirements(wh):
+    """Return the list of packages for which the wheelhouse `wh` has been
+    built, or an empty list if it has never been built."""
+    pth = join(wh, REQUIREMENTS_FILENAME)
+    if not os.path.exists(pth):
+        return []
+    with open(pth) as fd:
+        return [ln.strip() for ln in fd if ln.strip() and not ln.startswith('#')]
+
+
+def is_complete(wh, packages):
+    """Whether the wheelhouse `wh` has been built for all the given
+    packages."""
+    if not os.path.isdir(wh):
+        return False
+    available = set([normalize(p) for p in read_requirements(wh)])
+    return all([normalize(p) in available for p in packages])
+
+
+def pip_options(packages):
+    """Return the options to give to :cmd:`pip install` when installing the
+    given packages.
+
+    When the wheelhouse contains all of them, install from it without
+    accessing the package index.  When it contains only some of them, prefer
+    its wheels but use the index for the others.
+
+    """
+    wh = get_wheelhouse()
+    if not os.path.isdir(wh):
+        return ''
+    if is_complete(wh, packages):
+        return "--no-index --find-links {}".format(wh)
+    return "--find-links {}".format(wh)
+
+
+def default_packages():
+    """Return the packages needed by the applications, front ends and database
+    engines known to getlino."""
+    packages = set()
+    for nickname in APPNAMES:
+        if REPOS_DICT[nickname].package_name:
+            packages.add(REPOS_DICT[nickname].package_name)
+    for fe in FRONT_ENDS:
+        packages.add(fe.package_name)
+    for e in DB_ENGINES:
+        packages.update(e.python_packages.split())
+    return sorted(packages)
+
+
+def prune_wheels(wh):
+    """Remove all but the newest wheel of every package in `wh`.
+    Return the number of removed files."""
+    latest = dict()
+    removed = 0
+    for fn in os.listdir(wh):
+        mo = WHEEL_RE.match(fn)
+        if mo is None:
+            continue
+        name = normalize(mo.group('name'))
+        pth = join(wh, fn)
+        other = latest.get(name)
+        if other is None:
+            latest[name] = pth
+            continue
+        if os.path.getmtime(other) > os.path.getmtime(pth):
+            pth, other = other, pth
+        latest[name] = pth
+        os.remove(other)
+        removed += 1
+    return removed
+
+
+def build_wheels(i, wh, packages, refresh=False):
+    """Build wheels for the given packages and their dependencies into the
+    wheelhouse `wh`.
+
+    Unless `refresh` is True, wheels that are already in the wheelhouse are
+    reused.  We use the :cmd:`python3` which is also used for creating the
+    virtualenvs of new sites.
+
+    """
+    if not os.path.exists(wh):
+        os.makedirs(wh, exist_ok=True)
+    i.check_permissions(wh)
+    cmd = "python3 -m pip wheel --wheel-dir {}".format(wh)
+    if not refresh:
+        cmd += " --find-links {}".format(wh)
+    i.runcmd("{} {}".format(cmd, ' '.join(packages)))
+    requirements = sorted(set(read_requirements(wh)) | set(packages))
+    i.write_file(join(wh, REQUIREMENTS_FILENAME),
+                 "# generated by getlino\n" + "\n".join(requirements) + "\n")
+
+
+@click.group()
+def wheelhouse():
+    """
+    Manage the wheelhouse of this server.
+    """
+
+
+@wheelhouse.command()
+@click.argument('packages', nargs=-1)
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+def build(packages, batch):
+    """
+    Add wheels to the wheelhouse.
+
+    PACKAGES is the list of Python packages to build wheels for.  Default
+    is all applications, front ends and database drivers known to getlino.
+    """
+    i = Installer(batch)
+    wh = get_wheelhouse()
+    packages = list(packages) or default_packages()
+    if not i.yes_or_no("Build wheels for {} packages into {}?".format(
+            len(packages), wh)):
+        raise click.Abort()
+    with i.lock(), i.override_batch(True):
+        build_wheels(i, wh, packages)
+    i.print_summary()
+    click.echo("The wheelhouse {} has been built.".format(wh))
+
+
+@wheelhouse.command()
+@click.option('--batch/--no-batch', default=False, help=BATCH_HELP)
+def refresh(batch):
+    """
+    Update the wheels in the wheelhouse to the latest versions.
+    """
+    i = Installer(batch)
+    wh = get_wheelhouse()
+    packages = read_requirements(wh)
+    if len(packages) == 0:
+        raise click.ClickException(
+            "The wheelhouse {} is empty. Run getlino wheelhouse build.".format(wh))
+    if not i.yes_or_no("Refresh wheels for {} packages in {}?".format(
+            len(packages), wh)):
+        raise click.Abort()
+    with i.lock(), i.override_batch(True):
+        build_wheels(i, wh, packages, refresh=True)
+        click.echo("Removed {} outdated wheels.".format(prune_wheels(wh)))
+    i.print_summary()
+    click.echo("The wheelhouse {} has been refreshed.".format(wh))
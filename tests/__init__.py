@@ -0,0 +1,44 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Utilities shared by the test cases."""
+
+from contextlib import contextmanager
+from atelier.test import TestCase
+
+from getlino.utils import DEFAULTSECTION
+
+# the getlino configuration used by the tests, which may override some values
+CONFIG = dict(
+    sites_base='/tmp/sites', local_prefix='lino_local', db_engine='sqlite3',
+    front_end='lino_react.react', server_domain='localhost', env_link='env',
+    repos_link='repositories', log_base='/tmp/log', backups_base='/tmp/backups',
+    https='false', linod='false', usergroup='', env_templates='false',
+    db_user='', db_host='localhost', db_port='')
+
+
+@contextmanager
+def getlino_config(**kwargs):
+    """Use :data:`CONFIG`, updated with the given values, as the getlino
+    configuration, and restore the previous configuration afterwards."""
+    saved = dict(DEFAULTSECTION)
+    DEFAULTSECTION.update(CONFIG, **kwargs)
+    try:
+        yield DEFAULTSECTION
+    finally:
+        for k in list(DEFAULTSECTION):
+            DEFAULTSECTION.pop(k)
+        DEFAULTSECTION.update(saved)
+
+
+class ConfigTestCase(TestCase):
+    """A test case whose tests run with :data:`CONFIG`, updated with the
+    values of :attr:`config`, as the getlino configuration."""
+
+    config = {}
+
+    def setUp(self):
+        super().setUp()
+        cm = getlino_config(**self.config)
+        cm.__enter__()
+        self.addCleanup(cm.__exit__, None, None, None)
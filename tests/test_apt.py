@@ -0,0 +1,60 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import time
+import tempfile
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino import utils
+from getlino.utils import Installer, apt_lists_age, apt_update_reason
+from getlino.executor import RecordingExecutor
+
+
+class AptTests(TestCase):
+
+    def test_skip_installed(self):
+        i = Installer(batch=True)
+        i.executor = RecordingExecutor()
+        installed = sorted(i.facts.packages)[:2]
+        if len(installed) < 2:
+            self.skipTest("No dpkg on this machine")
+        with mock.patch.object(utils, 'is_root', lambda: True), \
+                mock.patch.object(utils, 'invalidate_facts', lambda: None):
+            # nothing is missing: apt-get doesn't run
+            i.apt_install(' '.join(installed))
+            i.run_apt_install()
+            self.assertEqual(i.executor.commands, [])
+
+            i.apt_install(' '.join(installed) + " getlino-no-such-package")
+            i.run_apt_install()
+            self.assertEqual([c['cmd'] for c in i.executor.commands], [
+                "sudo apt-get install -y getlino-no-such-package"])
+
+            # the requested packages are forgotten after installing them
+            i.run_apt_install()
+            self.assertEqual(len(i.executor.commands), 1)
+
+        self.assertEqual(i._installed_packages, ["getlino-no-such-package"])
+        self.assertEqual(i._present_packages, installed + installed)
+
+    def test_update_freshness(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(join(root, 'partial'))
+            open(join(root, 'lock'), 'w').close()
+            self.assertEqual(apt_lists_age(root), None)
+            fn = join(root, 'deb.debian.org_debian_dists_buster_InRelease')
+            open(fn, 'w').close()
+            t = time.time() - 5 * 3600
+            os.utime(fn, (t, t))
+            age = apt_lists_age(root)
+            self.assertAlmostEqual(age, 5, places=1)
+
+        self.assertEqual(apt_update_reason(age, 24), None)
+        self.assertEqual(apt_update_reason(age, 2),
+                         "package lists are 5.0 hours old (more than 2)")
+        self.assertEqual(apt_update_reason(age, 24, True), "--refresh was given")
+        self.assertEqual(apt_update_reason(None, 24),
+                         "there are no package lists")
@@ -0,0 +1,203 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Benchmarks for getlino's own overhead.
+
+Run them using::
+
+  $ pytest tests/test_benchmarks.py --benchmark-autosave
+  $ pytest tests/test_benchmarks.py --benchmark-compare
+
+The :cmd:`getlino configure` and :cmd:`getlino startsite` flows run as a
+normal user against a temporary directory tree, and their shell commands are
+recorded by a :class:`RecordingExecutor <getlino.executor.RecordingExecutor>`
+instead of being run.  So we measure only the time spent by getlino itself.
+The number of steps and of commands is checked as well.
+
+These benchmarks are skipped when :mod:`pytest_benchmark` is not installed.
+
+"""
+
+import os
+import sys
+import sqlite3
+import fnmatch
+import subprocess
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from click.testing import CliRunner
+
+from getlino import utils, facts
+from getlino.utils import Installer, DEFAULTSECTION
+from getlino.utils import get_jinja_env, get_project_dir
+from getlino.executor import RecordingExecutor
+import getlino.configure
+from getlino.configure import CONFIGURE_OPTIONS
+from getlino.startsite import add_site_steps
+from getlino.tuning import uwsgi_settings
+from getlino.cli import main
+from tests import getlino_config
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(utils.__file__), 'templates')
+
+# the commands run by `getlino startsite` for a site with a shared virtualenv
+STARTSITE_COMMANDS = [
+    "*pip install --upgrade *",
+    "*python manage.py install --noinput",
+    "*python manage.py migrate --noinput",
+    "*python manage.py prep --noinput",
+]
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    """A temporary directory tree for a getlino run as a normal user, with
+    an executor that records the commands."""
+    home = tmp_path / 'home'
+    env = tmp_path / 'env'
+    (env / 'bin').mkdir(parents=True)
+    home.mkdir()
+    monkeypatch.setattr(utils, 'is_root', lambda: False)
+    monkeypatch.setattr(facts, 'is_root', lambda: False)
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.delenv('VIRTUAL_ENV', raising=False)
+    conffile = str(home / '.getlino.conf')
+    monkeypatch.setattr(getlino.configure, 'CONF_FILES', ['', conffile])
+    executor = RecordingExecutor()
+    monkeypatch.setattr(Installer, 'executor', executor)
+    with getlino_config(
+            sites_base=str(tmp_path / 'sites'), shared_env=str(env),
+            repos_base='', log_base=str(tmp_path / 'log'),
+            backups_base=str(tmp_path / 'backups'), linod='true',
+            devtools='false', monit='false', redis='false', appy='false',
+            ldap='false', webdav='false', db_password='',
+            admin_name='Joe', admin_email='joe@example.com',
+            time_zone='Europe/Brussels', languages='en'):
+        facts.get_facts()  # don't measure the collection of facts
+        yield dict(root=tmp_path, env=str(env), conffile=conffile,
+                   executor=executor)
+
+
+def invoke(*args):
+    result = CliRunner().invoke(main, list(args), catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def configure_args(tree):
+    return ['configure', '--batch', '--no-clone',
+            '--sites-base', DEFAULTSECTION['sites_base'],
+            '--shared-env', tree['env'],
+            '--log-base', DEFAULTSECTION['log_base'],
+            '--backups-base', DEFAULTSECTION['backups_base'],
+            '--db-engine', 'sqlite3']
+
+
+def test_configure(benchmark, tree):
+    benchmark(invoke, *configure_args(tree))
+    assert os.path.exists(tree['conffile'])
+    assert os.path.exists(os.path.join(
+        DEFAULTSECTION['sites_base'], 'lino_local', 'settings.py'))
+
+
+def test_configure_options(benchmark, tree):
+    """Parse every option of :cmd:`getlino configure` and build the plan."""
+    args = configure_args(tree) + ['--plan']
+    for p in CONFIGURE_OPTIONS:
+        default = p.default() if callable(p.default) else p.default
+        if p.is_flag:
+            args.append(p.opts[0] if default else p.secondary_opts[0])
+        elif p.name not in ('sites_base', 'shared_env', 'log_base',
+                            'backups_base', 'db_engine'):
+            args += [p.opts[0], '' if default is None else str(default)]
+    result = benchmark(invoke, *args)
+    assert "Plan with" in result.output
+    assert tree['executor'].commands == []
+
+
+def test_startsite(benchmark, tree):
+    executor = tree['executor']
+
+    def startsite():
+        executor.commands = []
+        invoke('startsite', 'noi', 'mysite', '--batch', '--shared-env',
+               tree['env'])
+
+    benchmark(startsite)
+    cmds = [c['cmd'] for c in executor.commands]
+    assert len(cmds) == len(STARTSITE_COMMANDS), cmds
+    for cmd, pattern in zip(cmds, STARTSITE_COMMANDS):
+        assert fnmatch.fnmatchcase(cmd, pattern), cmd
+    prj = get_project_dir('mysite')
+    assert sorted(os.listdir(prj)) == [
+        'env', 'linod.sh', 'manage.py', 'media', 'settings.py']
+    benchmark.extra_info.update(commands=len(cmds))
+
+
+def test_site_steps(benchmark, tree):
+    """Add the steps of 20 sites to a plan, as :cmd:`getlino startsites`
+    does."""
+    def plan():
+        i = Installer(batch=True)
+        shared = {}
+        for n in range(20):
+            add_site_steps(i, 'noi', 'site{}'.format(n),
+                           shared_env=tree['env'], prefix='site{}:'.format(n),
+                           shared=shared)
+        return i
+
+    i = benchmark(plan)
+    # 3 shared steps plus 5 steps per site (SQLite needs no db step)
+    assert len(i._steps) == 3 + 20 * 5
+    benchmark.extra_info.update(steps=len(i._steps))
+
+
+def test_render_templates(benchmark, tree):
+    """Render every template of :mod:`getlino`."""
+    i = Installer(batch=True)
+    context = add_site_steps(i, 'noi', 'mysite', shared_env=tree['env'])
+    context.update(facts=i.facts, envdir=tree['env'],
+                   uwsgi=uwsgi_settings(4, 8000))
+    names = sorted(os.listdir(TEMPLATES_DIR))
+
+    def render():
+        env = get_jinja_env()
+        return [env.get_template(name).render(**context) for name in names]
+
+    rendered = benchmark(render)
+    assert len(rendered) == len(names)
+    assert all(rendered)
+
+
+@pytest.mark.parametrize('pragmas', [
+    [],
+    ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL",
+     "PRAGMA mmap_size=268435456", "PRAGMA cache_size=-65536"],
+], ids=['default', 'getlino'])
+def test_sqlite_commits(benchmark, tmp_path, pragmas):
+    """Commit 100 small transactions to a SQLite database, once with the
+    defaults of SQLite (rollback journal, full sync) and once with the
+    pragmas of the :xfile:`settings.py` of a getlino site."""
+    con = sqlite3.connect(str(tmp_path / 'db.sqlite3'), timeout=20)
+    for sql in pragmas:
+        con.execute(sql)
+    con.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    con.commit()
+
+    def commit():
+        for n in range(100):
+            con.execute("INSERT INTO t (name) VALUES (?)", ("row %d" % n,))
+            con.commit()
+
+    benchmark(commit)
+    con.close()
+
+
+def test_import_time(benchmark):
+    """Import :mod:`getlino.cli` in a fresh Python process."""
+    def run():
+        subprocess.run([sys.executable, '-c', 'import getlino.cli'], check=True)
+
+    benchmark.pedantic(run, rounds=5, iterations=1)
@@ -0,0 +1,49 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+import subprocess
+from os.path import join
+
+import click
+from atelier.test import TestCase
+
+from getlino.utils import Installer, Repo
+
+
+def make_bare_repo(root, name):
+    """Create a bare git repository with one commit on branch master."""
+    work = join(root, 'work', name)
+    bare = join(root, 'bare', name + '.git')
+    os.makedirs(work)
+    cmds = [
+        "git init -q -b master {work}",
+        "git -C {work} -c user.name=x -c user.email=x@example.com "
+        "commit -q --allow-empty -m init",
+        "git clone -q --bare {work} {bare}"]
+    for cmd in cmds:
+        subprocess.check_call(cmd.format(**locals()), shell=True)
+    return bare
+
+
+class CloneTests(TestCase):
+
+    def test_parallel_clone(self):
+        with tempfile.TemporaryDirectory() as root:
+            repos = [Repo(name, name, make_bare_repo(root, name), '', '')
+                     for name in ('foo', 'bar', 'baz')]
+            repos.append(Repo('oops', 'oops', join(root, 'missing.git'), '', ''))
+            repos_base = join(root, 'repositories')
+            os.makedirs(repos_base)
+            i = Installer(batch=True)
+            with self.assertRaises(click.ClickException) as cm:
+                i.clone_repos(repos, repos_base, jobs=3)
+            self.assertEqual(
+                cm.exception.message,
+                "Failed to clone 1 of 4 repositories: oops")
+            self.assertEqual(
+                sorted(os.listdir(repos_base)), ['bar', 'baz', 'foo'])
+
+            # a second run has nothing to do for existing clones
+            self.assertEqual(i.clone_command(repos[0], repos_base), None)
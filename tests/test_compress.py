@@ -0,0 +1,74 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import gzip
+import tempfile
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino.compress import compress_static, compress_file, gzip_compress
+
+
+class CompressTests(TestCase):
+
+    def test_compress_static(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(join(root, 'js'))
+            big = "var x = 1;\n" * 1000
+            with open(join(root, 'js', 'app.js'), 'w') as fd:
+                fd.write(big)
+            with open(join(root, 'small.css'), 'w') as fd:
+                fd.write("body {}\n")
+            with open(join(root, 'logo.png'), 'wb') as fd:
+                fd.write(os.urandom(2000))
+            with open(join(root, 'old.js.gz'), 'wb') as fd:
+                fd.write(b'')
+
+            written, checked, removed = compress_static(root, jobs=2)
+            self.assertEqual((checked, removed), (1, 1))
+            self.assertEqual(written >= 1, True)
+            gz = join(root, 'js', 'app.js.gz')
+            with gzip.open(gz, 'rt') as fd:
+                self.assertEqual(fd.read(), big)
+            self.assertEqual(os.stat(gz).st_mtime_ns,
+                             os.stat(join(root, 'js', 'app.js')).st_mtime_ns)
+            self.assertEqual(os.path.exists(join(root, 'small.css.gz')), False)
+            self.assertEqual(os.path.exists(join(root, 'old.js.gz')), False)
+
+            # unchanged files are not compressed again
+            self.assertEqual(compress_static(root, jobs=2), (0, 1, 0))
+
+            # changed files are
+            with open(join(root, 'js', 'app.js'), 'a') as fd:
+                fd.write("var y = 2;\n")
+            os.utime(join(root, 'js', 'app.js'), ns=(0, 10 ** 9))
+            self.assertEqual(compress_static(root, jobs=2)[0], written)
+
+    def test_incompressible(self):
+        calls = []
+
+        def compress(data):
+            calls.append(data)
+            return gzip_compress(data)
+
+        with tempfile.TemporaryDirectory() as root:
+            pth = join(root, 'random.js')
+            with open(pth, 'wb') as fd:
+                fd.write(os.urandom(2000))
+            incompressible = {}
+            self.assertEqual(compress_file(pth, {'.gz': compress}, incompressible), 0)
+            self.assertEqual(incompressible, {pth + '.gz': os.stat(pth).st_mtime_ns})
+            # not compressed again as long as the file doesn't change
+            self.assertEqual(compress_file(pth, {'.gz': compress}, incompressible), 0)
+            self.assertEqual(len(calls), 1)
+
+            # compress_static remembers them from one run to the next
+            self.assertEqual(compress_static(root), (0, 1, 0))
+            self.assertIn('.getlino-incompressible', os.listdir(root))
+            with mock.patch('getlino.compress.gzip_compress') as gz:
+                self.assertEqual(compress_static(root), (0, 1, 0))
+                gz.assert_not_called()
+            self.assertEqual(sorted(os.listdir(root)),
+                             ['.getlino-incompressible', 'random.js'])
@@ -0,0 +1,60 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import sqlite3
+import tempfile
+from os.path import join
+
+from getlino.utils import Installer, MySQL, PostgreSQL, SQLite
+from getlino.executor import RecordingExecutor
+from getlino.startsite import add_site_steps
+from tests import ConfigTestCase
+
+
+class DbTests(ConfigTestCase):
+
+    config = dict(db_engine='postgresql')
+
+    def test_statements(self):
+        e = MySQL()
+        self.assertEqual(e.user_statements("joe", "it's", "localhost"), [
+            "CREATE USER IF NOT EXISTS 'joe'@'localhost' IDENTIFIED BY 'it''s';"])
+        self.assertEqual(e.database_statements("foo", "joe", "localhost"), [
+            "CREATE DATABASE IF NOT EXISTS `foo` CHARACTER SET utf8;",
+            "GRANT ALL PRIVILEGES ON `foo`.* TO 'joe'@'localhost';"])
+        e = PostgreSQL()
+        self.assertEqual(e.user_statements("joe", "it's", "localhost"), [
+            "SELECT format('CREATE ROLE %I LOGIN PASSWORD %L', 'joe', 'it''s') "
+            "WHERE NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'joe')"
+            "\\gexec"])
+
+    def test_one_session(self):
+        # the databases of several sites are created in one session
+        i = Installer(batch=True)
+        i.executor = RecordingExecutor()
+        shared = {}
+        for prjname in ('foo', 'bar'):
+            add_site_steps(i, 'noi', prjname, shared_env='/tmp/env',
+                           prefix=prjname + ':', shared=shared)
+        self.assertEqual(i._steps['foo:migrate'].deps, ('foo:install', 'db'))
+        i._steps['db'].func()
+        self.assertEqual(len(i.executor.commands), 1)
+        cmd = i.executor.commands[0]
+        self.assertEqual(cmd['cmd'], PostgreSQL.client_command)
+        lines = cmd['input'].splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertIn("CREATE DATABASE %I', 'bar')", lines[4])
+
+    def test_sqlite_wal(self):
+        i = Installer(batch=True)
+        with tempfile.TemporaryDirectory() as root:
+            pth = join(root, 'foo')
+            con = sqlite3.connect(pth)
+            con.execute("CREATE TABLE t (x)")
+            con.close()
+            SQLite().after_prep(i, dict(project_dir=root, prjname='foo'))
+            con = sqlite3.connect(pth)
+            mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+            con.close()
+            self.assertEqual(mode, 'wal')
+            self.assertFalse(SQLite().set_wal_mode(i, pth))
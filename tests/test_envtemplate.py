@@ -0,0 +1,43 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+import subprocess
+from os.path import join
+from atelier.test import TestCase
+
+import virtualenv
+from getlino.utils import clone_virtualenv
+
+
+class EnvTemplateTests(TestCase):
+
+    def test_clone_virtualenv(self):
+        with tempfile.TemporaryDirectory() as root:
+            src = join(root, 'template')
+            dst = join(root, 'site', 'env')
+            virtualenv.cli_run([src, '--no-seed'])
+            # simulate an installed package
+            pkgfile = join('lib', 'foo.py')
+            with open(join(src, pkgfile), 'w') as fd:
+                fd.write("# installed by pip\n")
+            with open(join(src, 'bin', 'activate')) as fd:
+                activate = fd.read()
+            clone_virtualenv(src, dst)
+
+            # the activation script refers to the new location, and the
+            # template remains unchanged
+            with open(join(dst, 'bin', 'activate')) as fd:
+                self.assertIn(dst, fd.read())
+            with open(join(src, 'bin', 'activate')) as fd:
+                self.assertEqual(fd.read(), activate)
+
+            # other files are shared
+            self.assertEqual(os.stat(join(src, pkgfile)).st_ino,
+                             os.stat(join(dst, pkgfile)).st_ino)
+
+            out = subprocess.check_output(
+                ". {}/bin/activate && python -c 'import sys; print(sys.prefix)'".format(dst),
+                shell=True, universal_newlines=True)
+            self.assertEqual(out.strip(), dst)
@@ -0,0 +1,46 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import tempfile
+from os.path import join
+import click
+from atelier.test import TestCase
+
+from getlino.utils import Installer
+from getlino.executor import RecordingExecutor
+
+
+class ExecutorTests(TestCase):
+
+    def test_recording(self):
+        i = Installer(batch=True)
+        i.executor = RecordingExecutor([
+            dict(cmd="pip install *", returncode=0, output=["Installed foo"]),
+            dict(cmd="false", returncode=1, output=[])])
+        i.runcmd("pip install foo")
+        with self.assertRaises(click.ClickException):
+            i.runcmd("false")
+        # unknown commands succeed without being run
+        i.runcmd("rm -rf /nonexistent")
+        self.assertEqual(i.run_prefixed('x', "false"), 0)
+        self.assertEqual([c['cmd'] for c in i.executor.commands], [
+            "pip install foo", "false", "rm -rf /nonexistent", "false"])
+        self.assertEqual(i.executor.commands[0]['output'], ["Installed foo"])
+
+        # a passthrough executor runs the commands and records their output
+        i.executor = RecordingExecutor(passthrough=True)
+        lines = []
+        self.assertEqual(i.executor.run("echo hello", lines.append), 0)
+        self.assertEqual(lines, ["hello"])
+        lines = []
+        self.assertEqual(i.executor.run("cat", lines.append, "a\nb\n"), 0)
+        self.assertEqual(lines, ["a", "b"])
+
+        with tempfile.TemporaryDirectory() as root:
+            fn = join(root, 'recording.json')
+            i.executor.save(fn)
+            replay = RecordingExecutor.load(fn)
+            lines = []
+            self.assertEqual(replay.run("echo hello", lines.append), 0)
+            self.assertEqual(lines, ["hello"])
+            self.assertEqual([e['cmd'] for e in replay.replay], ["cat"])
@@ -0,0 +1,30 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+from os.path import join
+from atelier.test import TestCase
+
+from getlino.facts import (collect_facts, load_facts, save_facts,
+                           invalidation_key, CACHE_FILENAME)
+
+
+class FactsTests(TestCase):
+
+    def test_cache(self):
+        key = invalidation_key()
+        self.assertEqual(key, invalidation_key())
+        facts = collect_facts(key)
+        self.assertGreater(facts.cpu_count, 0)
+        with tempfile.TemporaryDirectory() as root:
+            fn = join(root, 'getlino', CACHE_FILENAME)
+            self.assertEqual(load_facts(fn, key), None)
+            save_facts(fn, facts)
+            # no temporary file is left behind
+            self.assertEqual(os.listdir(join(root, 'getlino')), [CACHE_FILENAME])
+            cached = load_facts(fn, key)
+            self.assertEqual(cached.as_dict(), facts.as_dict())
+            self.assertEqual(cached.packages, facts.packages)
+            # a different key means that the cache is outdated
+            self.assertEqual(load_facts(fn, key + 'x'), None)
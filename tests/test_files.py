@@ -0,0 +1,34 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+from os.path import join
+from atelier.test import TestCase
+
+from getlino.utils import Installer
+
+
+class WriteFileTests(TestCase):
+
+    def test_write_file(self):
+        i = Installer(batch=True)
+        with tempfile.TemporaryDirectory() as root:
+            fn = join(root, 'foo.conf')
+            self.assertEqual(i.write_file(fn, "foo\n"), True)
+            os.chmod(fn, 0o640)
+            mtime = os.stat(fn).st_mtime_ns
+
+            # same content: nothing is written
+            self.assertEqual(i.update_file(fn, "foo\n"), False)
+            self.assertEqual(os.stat(fn).st_mtime_ns, mtime)
+
+            # new content is written atomically, keeping the file mode and
+            # without leaving temporary files
+            self.assertEqual(i.update_file(fn, "bar\n"), True)
+            self.assertEqual(open(fn).read(), "bar\n")
+            self.assertEqual(os.stat(fn).st_mode & 0o777, 0o640)
+            self.assertEqual(os.listdir(root), ['foo.conf'])
+
+            self.assertEqual(i._changed_files, [fn, fn])
+            self.assertEqual(i._unchanged_files, [fn])
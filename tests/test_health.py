@@ -0,0 +1,118 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import time
+import socket
+import struct
+import tempfile
+import threading
+import subprocess
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino.health import uwsgi_request, uwsgi_packet, evaluate
+from getlino.health import supervisor_results
+from getlino.health import OK, WARNING, CRITICAL
+
+
+def parse_packet(data):
+    modifier1, size, modifier2 = struct.unpack('<BHB', data[:4])
+    body = data[4:4 + size]
+    variables = {}
+    while body:
+        n = struct.unpack('<H', body[:2])[0]
+        k = body[2:2 + n].decode()
+        body = body[2 + n:]
+        n = struct.unpack('<H', body[:2])[0]
+        variables[k] = body[2:2 + n].decode()
+        body = body[2 + n:]
+    return variables
+
+
+class HealthTests(TestCase):
+
+    def serve(self, sockpath, response, delay=0):
+        """Start a fake uwsgi server that answers one request."""
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(sockpath)
+        server.listen(1)
+        received = {}
+
+        def run():
+            conn, _ = server.accept()
+            with conn:
+                received.update(parse_packet(conn.recv(65536)))
+                time.sleep(delay)
+                try:
+                    conn.sendall(response)
+                except OSError:
+                    pass  # the client gave up waiting
+            server.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return received
+
+    def test_uwsgi_request(self):
+        with tempfile.TemporaryDirectory() as root:
+            sockpath = join(root, 'nginx.sock')
+            received = self.serve(
+                sockpath, b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\nHi")
+            status = uwsgi_request(sockpath, 'foo.example.com', '/api?x=1')
+            self.assertEqual(status, 200)
+            self.assertEqual(received['HTTP_HOST'], 'foo.example.com')
+            self.assertEqual(received['PATH_INFO'], '/api')
+            self.assertEqual(received['QUERY_STRING'], 'x=1')
+
+            sockpath = join(root, 'slow.sock')
+            self.serve(sockpath, b"HTTP/1.1 200 OK\r\n\r\n", delay=2)
+            with self.assertRaises(socket.timeout):
+                uwsgi_request(sockpath, 'foo.example.com', timeout=0.5)
+
+    def test_uwsgi_packet(self):
+        self.assertEqual(uwsgi_packet({'A': 'bc'}),
+                         b'\x00\x07\x00\x00\x01\x00A\x02\x00bc')
+
+    def test_evaluate(self):
+        def result(status=200, seconds=0.1, error=None):
+            return dict(site='foo', status=status, seconds=seconds, error=error)
+
+        self.assertEqual(evaluate(result()), OK)
+        self.assertEqual(evaluate(result(302)), OK)
+        self.assertEqual(evaluate(result(500)), CRITICAL)
+        self.assertEqual(evaluate(result(seconds=3)), WARNING)
+        self.assertEqual(evaluate(result(seconds=3), warning=5), OK)
+        self.assertEqual(evaluate(result(seconds=12)), CRITICAL)
+        self.assertEqual(evaluate(result(None, error="timed out")), CRITICAL)
+
+    def test_supervisor_results(self):
+        def status(stdout, returncode=3):
+            return mock.patch('getlino.health.subprocess.run',
+                              return_value=subprocess.CompletedProcess(
+                                  [], returncode, stdout))
+
+        with status("""\
+linod_a                          RUNNING   pid 123, uptime 1:02:03
+linod_b                          FATAL     Exited too quickly
+linod_c                          STOPPED   Not started
+error: <class 'ConnectionResetError'>, something happened
+"""):
+            self.assertEqual(
+                [(r['site'], r['error']) for r in supervisor_results()],
+                [('linod_b', "supervisor program is FATAL"),
+                 ('linod_c', "supervisor program is STOPPED")])
+        with status("linod_a  RUNNING   pid 123, uptime 1:02:03\n", 0):
+            self.assertEqual(supervisor_results(), [])
+
+        # supervisord is not running
+        with status("unix:///var/run/supervisor.sock no such file\n", 7):
+            results = supervisor_results()
+        self.assertEqual([r['site'] for r in results], ['supervisor'])
+        self.assertEqual(evaluate(results[0]), CRITICAL)
+
+        # supervisorctl is not installed
+        with mock.patch('getlino.health.subprocess.run',
+                        side_effect=FileNotFoundError(2, "No such file")):
+            results = supervisor_results()
+        self.assertEqual([r['site'] for r in results], ['supervisor'])
+        self.assertEqual(evaluate(results[0]), CRITICAL)
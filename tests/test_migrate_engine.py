@@ -0,0 +1,50 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+from os.path import join
+from unittest import mock
+from click.testing import CliRunner
+from atelier.test import TestCase
+
+from getlino.utils import Installer, DEFAULTSECTION
+from getlino.executor import RecordingExecutor
+from getlino.migrate_engine import migrate_engine
+
+SETTINGS = """
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.mysql',
+        'OPTIONS': {
+           "init_command": "SET default_storage_engine=MyISAM",
+        }
+    }
+}
+"""
+
+
+class MigrateEngineTests(TestCase):
+
+    def test_migrate_engine(self):
+        executor = RecordingExecutor()
+        with tempfile.TemporaryDirectory() as root:
+            prj = join(root, 'lino_local', 'foo')
+            os.makedirs(prj)
+            with open(join(prj, 'settings.py'), 'w') as fd:
+                fd.write(SETTINGS)
+            config = dict(sites_base=root, local_prefix='lino_local',
+                          env_link='env')
+            with mock.patch.dict(DEFAULTSECTION, config), \
+                    mock.patch.object(Installer, 'executor', executor):
+                result = CliRunner().invoke(migrate_engine, ['foo', '--batch'])
+                self.assertEqual(result.exit_code, 0, result.output)
+                result = CliRunner().invoke(migrate_engine, ['bar', '--batch'])
+                self.assertEqual(result.exit_code, 1)
+            with open(join(prj, 'settings.py')) as fd:
+                self.assertIn("default_storage_engine=InnoDB", fd.read())
+        self.assertEqual(len(executor.commands), 1)
+        cmd = executor.commands[0]['cmd']
+        self.assertTrue(cmd.startswith(
+            ". {}/env/bin/activate && python manage.py shell -c ".format(prj)))
+        self.assertIn("ENGINE=InnoDB", cmd)
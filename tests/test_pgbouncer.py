@@ -0,0 +1,48 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import tempfile
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino import pgbouncer
+from getlino.utils import Installer, DEFAULTSECTION, get_jinja_env
+from getlino.executor import RecordingExecutor
+
+
+class PgBouncerTests(TestCase):
+
+    def test_register_databases(self):
+        i = Installer(batch=True)
+        i.executor = RecordingExecutor()
+        with tempfile.TemporaryDirectory() as root:
+            databases_ini = join(root, 'getlino-databases.ini')
+            userlist_txt = join(root, 'userlist.txt')
+            with mock.patch.multiple(
+                    pgbouncer, DATABASES_INI=databases_ini,
+                    USERLIST_TXT=userlist_txt, ifroot=lambda: False):
+                pgbouncer.register_databases(
+                    i, [('foo', 'foo', 'secret'), ('bar', 'bar', 'it"s')])
+                # a same site again replaces its entry, and when nothing
+                # changed, PgBouncer is not reloaded
+                pgbouncer.register_databases(i, [('foo', 'foo', 'new')])
+                pgbouncer.register_databases(i, [('foo', 'foo', 'new')])
+            with open(databases_ini) as fd:
+                self.assertEqual(fd.read().splitlines(), [
+                    "bar = host=localhost port=5432 dbname=bar",
+                    "foo = host=localhost port=5432 dbname=foo"])
+            with open(userlist_txt) as fd:
+                self.assertEqual(fd.read().splitlines(), [
+                    '"bar" "it""s"', '"foo" "new"'])
+        self.assertEqual([c['cmd'] for c in i.executor.commands],
+                         ["sudo service pgbouncer reload"] * 2)
+
+    def test_settings(self):
+        tpl = get_jinja_env().get_template('settings.py')
+        s = tpl.render(db_engine='postgresql', db_host='127.0.0.1',
+                       db_port=6432, pgbouncer=True, prjname='foo',
+                       local_prefix='lino_local', app_settings_module='x')
+        compile(s, 'settings.py', 'exec')
+        self.assertIn("'PORT': 6432,", s)
+        self.assertIn("'DISABLE_SERVER_SIDE_CURSORS': True,", s)
@@ -0,0 +1,92 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import threading
+import click
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino.utils import Installer, REPOS_DICT
+from getlino.executor import RecordingExecutor
+
+
+class PlanTests(TestCase):
+
+    def test_run_plan(self):
+        i = Installer(batch=True)
+        done = []
+        lock = threading.Lock()
+
+        def step(name, cmd="true"):
+            def func():
+                i.runcmd(cmd)
+                with lock:
+                    done.append(name)
+            return func
+
+        i.add_step('a', step('a'))
+        i.add_step('b', step('b', "echo oops && false"))
+        i.add_step('c', step('c'), ['a', 'unknown'])
+        i.add_step('d', step('d'), ['b'])
+        i.add_step('e', step('e'), ['d'])
+        i.add_step('f', step('f'), ['c'])
+        with self.assertRaises(click.ClickException) as cm:
+            i.run_plan(jobs=3)
+        self.assertEqual(
+            cm.exception.message, "1 steps failed: b (skipped d e)")
+        self.assertEqual(sorted(done), ['a', 'c', 'f'])
+        self.assertEqual(done.index('a') < done.index('c') < done.index('f'), True)
+
+        # the plan is empty after running it
+        i.run_plan(jobs=3)
+
+    def test_sequential(self):
+        # when not in batch mode, steps run in the order they were added
+        i = Installer(batch=False)
+        done = []
+        i.add_step('x', lambda: done.append('x'))
+        i.add_step('y', lambda: done.append('y'), ['x'])
+        i.add_step('z', lambda: done.append('z'))
+        i.run_plan(jobs=3)
+        self.assertEqual(done, ['x', 'y', 'z'])
+
+    def test_restart_services(self):
+        # a service requested by a parallel step while the others are being
+        # activated is not forgotten
+        i = Installer(batch=True)
+
+        class Executor(RecordingExecutor):
+            def run(self, cmd, output=None, input=None, **kw):
+                if cmd == "sudo service nginx restart":
+                    i.must_reload('monit')
+                return super().run(cmd, output, input, **kw)
+
+        i.executor = Executor()
+        i.must_restart('nginx')
+        with mock.patch('getlino.utils.ifroot', return_value=True):
+            i.restart_services()
+            self.assertEqual(i._reloads, {'monit'})
+            self.assertEqual(i._services, set())
+            i.restart_services()
+        self.assertEqual([c['cmd'] for c in i.executor.commands], [
+            "sudo service nginx restart", "sudo service monit reload"])
+
+    def test_install_repos(self):
+        # when the batched install fails, the repositories are installed one
+        # by one and the error names those that failed
+        i = Installer(batch=True)
+        i.executor = RecordingExecutor([
+            dict(cmd=". /env/bin/activate && pip install -e /repos/lino -e /repos/xl",
+                 returncode=1, output=["ERROR: No matching distribution"]),
+            dict(cmd=". /env/bin/activate && pip install -e /repos/xl",
+                 returncode=1, output=["ERROR: No matching distribution"])])
+        repos = [REPOS_DICT['lino'], REPOS_DICT['xl']]
+        with self.assertRaises(click.ClickException) as cm:
+            i.install_repos(repos, '/env', '/repos')
+        self.assertEqual(
+            cm.exception.message, "Failed to install 1 of 2 repositories: xl")
+        self.assertEqual([c['cmd'] for c in i.executor.commands], [
+            ". /env/bin/activate && pip install -e /repos/lino -e /repos/xl",
+            ". /env/bin/activate && pip install -e /repos/lino",
+            ". /env/bin/activate && pip install -e /repos/xl"])
+        self.assertEqual(i.executor.replay, [])
@@ -0,0 +1,77 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import sys
+import runpy
+import tempfile
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino.utils import Installer, get_jinja_env
+from getlino.startsite import add_site_steps
+from getlino.configure import SHARED_SETTINGS, SHARED_REDIS_SETTINGS
+from tests import getlino_config
+
+# stands for the settings module of the application
+APP_SETTINGS = """
+class Site(object):
+    def __init__(self, globals_dict):
+        pass
+"""
+
+
+class RedisTests(TestCase):
+
+    def render_settings(self, redis, db_engine='sqlite3'):
+        i = Installer(batch=True)
+        with getlino_config(redis=redis, db_engine=db_engine):
+            context = add_site_steps(i, 'noi', 'foo', shared_env='/tmp/env')
+        content = get_jinja_env().get_template('settings.py').render(**context)
+        compile(content, 'settings.py', 'exec')
+        return context, content
+
+    def test_settings(self):
+        context, content = self.render_settings('true')
+        self.assertIn('django-redis', context['pip_packages'].split())
+        self.assertIn("'LOCATION': globals().get('REDIS_URL', ", content)
+        self.assertIn("'KEY_PREFIX': 'foo',", content)
+        self.assertIn("SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'",
+                      content)
+
+        context, content = self.render_settings('false')
+        self.assertNotIn('django-redis', context['pip_packages'].split())
+        self.assertNotIn("CACHES", content)
+
+    def test_old_shared_settings(self):
+        # a site created on a server whose shared settings were written by an
+        # older version of getlino (without REDIS_URL).  PostgreSQL because
+        # the settings of a SQLite site import Django.
+        context, content = self.render_settings('true', 'postgresql')
+        content = content.replace(
+            context['app_settings_module'], 'app_settings')
+        shared = SHARED_SETTINGS.format(
+            admin_name='Joe', admin_email='joe@example.com',
+            server_domain='localhost', time_zone='UTC')
+        for shared_settings, location in [
+                (shared, 'redis://127.0.0.1:6379/0'),
+                (shared + SHARED_REDIS_SETTINGS.replace('/0', '/1'),
+                 'redis://127.0.0.1:6379/1')]:
+            with tempfile.TemporaryDirectory() as root:
+                os.makedirs(join(root, 'lino_local'))
+                for fn, text in [
+                        ('app_settings.py', APP_SETTINGS),
+                        (join('lino_local', '__init__.py'), ''),
+                        (join('lino_local', 'settings.py'), shared_settings),
+                        ('settings.py', content)]:
+                    with open(join(root, fn), 'w') as fd:
+                        fd.write(text)
+                with mock.patch.object(sys, 'path', [root] + sys.path):
+                    try:
+                        ns = runpy.run_path(join(root, 'settings.py'))
+                    finally:
+                        for name in ('app_settings', 'lino_local',
+                                     'lino_local.settings'):
+                            sys.modules.pop(name, None)
+            self.assertEqual(ns['CACHES']['default']['LOCATION'], location)
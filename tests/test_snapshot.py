@@ -0,0 +1,143 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import shutil
+import tarfile
+import tempfile
+import subprocess
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino import snapshot
+from getlino.snapshot import Repository, snapshots_to_keep, site_files
+
+
+class SnapshotTests(TestCase):
+
+    def test_repository(self):
+        with tempfile.TemporaryDirectory() as root:
+            prj = join(root, 'prj')
+            dump = join(root, 'dump')
+            os.makedirs(join(prj, 'media', 'webdav'))
+            os.makedirs(dump)
+            with open(join(prj, 'settings.py'), 'w') as fd:
+                fd.write("SITE = 1\n")
+            big = os.urandom(1000) * 50
+            with open(join(prj, 'media', 'webdav', 'doc.odt'), 'wb') as fd:
+                fd.write(big)
+            with open(join(dump, 'restore.py'), 'w') as fd:
+                fd.write("# dump\n")
+
+            files = site_files(prj, dump)
+            self.assertEqual([a for a, p in files], [
+                'snapshot/restore.py', 'media/webdav/doc.odt', 'settings.py'])
+
+            repo = Repository(join(root, 'repo'))
+            saved = snapshot.CHUNK_SIZE
+            snapshot.CHUNK_SIZE = 20000
+            try:
+                name, stats = repo.make_snapshot('prj', files, '20200101_030000')
+                self.assertEqual(stats['files'], 3)
+                self.assertEqual(stats['read'], len(big) + 16)
+
+                # the second snapshot doesn't even read unchanged files, and
+                # a new dump with the same content takes no space
+                with open(join(dump, 'restore.py'), 'w') as fd:
+                    fd.write("# dump\n")
+                os.utime(join(dump, 'restore.py'), ns=(0, 10 ** 9))
+                name, stats = repo.make_snapshot('prj', files, '20200102_030000')
+                self.assertEqual(stats['reused'], len(big) + 9)
+                self.assertEqual(stats['read'], 7)
+                self.assertEqual(stats['written'], 0)
+            finally:
+                snapshot.CHUNK_SIZE = saved
+
+            self.assertEqual(repo.list_snapshots('prj'),
+                             ['20200101_030000', '20200102_030000'])
+            target = join(root, 'restored')
+            repo.extract('prj', '20200101_030000', target)
+            with open(join(target, 'media', 'webdav', 'doc.odt'), 'rb') as fd:
+                self.assertEqual(fd.read(), big)
+
+            # when the only snapshot using a chunk is deleted, the garbage
+            # collector removes the chunk
+            with open(join(dump, 'restore.py'), 'w') as fd:
+                fd.write("# another dump\n")
+            repo.make_snapshot('prj', files, '20200102_040000')
+            self.assertEqual(repo.prune('prj', daily=1, weekly=0, monthly=0),
+                             ['20200101_030000', '20200102_030000'])
+            self.assertEqual(repo.collect_garbage()[0], 1)
+
+    def test_growing_file(self):
+        # a file that grows while being read
+        with tempfile.TemporaryDirectory() as root:
+            pth = join(root, 'log.txt')
+            with open(pth, 'wb') as fd:
+                fd.write(b'a' * 100)
+            real_stat = os.stat
+
+            def stat(p, *args, **kwargs):
+                st = real_stat(p, *args, **kwargs)
+                if p == pth:
+                    with open(pth, 'ab') as fd:
+                        fd.write(b'b' * 50)
+                return st
+
+            repo = Repository(join(root, 'repo'))
+            with mock.patch('os.stat', stat):
+                name, stats = repo.make_snapshot('prj', [('log.txt', pth)])
+            entry = repo.load_snapshot('prj', name)['files'][0]
+            self.assertEqual(entry['size'], 150)
+            fn = join(root, 'prj.tar')
+            self.assertEqual(repo.write_archive('prj', name, fn), 150)
+            with tarfile.open(fn) as tar:
+                self.assertEqual(tar.extractfile('log.txt').read(),
+                                 b'a' * 100 + b'b' * 50)
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as root:
+            src = join(root, 'src')
+            os.makedirs(join(src, 'media'))
+            content = {}
+            for n in range(5):
+                fn = join('media', 'file{}.txt'.format(n))
+                content[fn] = ("line {}\n".format(n) * 50000).encode()
+                with open(join(src, fn), 'wb') as fd:
+                    fd.write(content[fn])
+            files = [(fn, join(src, fn)) for fn in sorted(content)]
+            repo = Repository(join(root, 'repo'))
+            saved = snapshot.CHUNK_SIZE
+            snapshot.CHUNK_SIZE = 100000
+            try:
+                name, stats = repo.make_snapshot('prj', files, jobs=3)
+            finally:
+                snapshot.CHUNK_SIZE = saved
+            self.assertEqual(stats['read'], sum(map(len, content.values())))
+
+            archives = ['prj.tar', 'prj.tar.gz']
+            if shutil.which('zstd'):
+                archives.append('prj.tar.zst')
+            for fn in archives:
+                pth = join(root, fn)
+                size = repo.write_archive('prj', name, pth, jobs=3)
+                self.assertEqual(size, stats['read'])
+                if fn.endswith('.zst'):
+                    tarpth = join(root, 'unzstd.tar')
+                    subprocess.run(['zstd', '-q', '-d', pth, '-o', tarpth],
+                                   check=True)
+                    pth = tarpth
+                with tarfile.open(pth) as tar:
+                    self.assertEqual(tar.getnames(), sorted(content))
+                    for fn, data in content.items():
+                        self.assertEqual(tar.extractfile(fn).read(), data)
+
+    def test_snapshots_to_keep(self):
+        names = ['20200101_030000', '20200115_030000', '20200201_030000',
+                 '20200301_030000', '20200302_030000', '20200302_150000',
+                 '20200303_030000', 'manual']
+        self.assertEqual(sorted(snapshots_to_keep(names, 2, 0, 0)), [
+            '20200302_150000', '20200303_030000', 'manual'])
+        self.assertEqual(sorted(snapshots_to_keep(names, 1, 1, 3)), [
+            '20200115_030000', '20200201_030000', '20200303_030000', 'manual'])
@@ -0,0 +1,110 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+from os.path import join
+from unittest import mock
+import click
+
+from getlino.utils import Installer, DEFAULTSECTION, ifroot
+from getlino.startsite import add_site_steps
+from getlino.startsites import read_manifest, site_results
+from tests import ConfigTestCase
+
+MANIFEST = """
+defaults:
+  shared_env: /tmp/env
+sites:
+  - app: noi
+    prjname: trial1
+  - app: noi
+    prjname: trial2
+    dev_repos: [lino, xl]
+"""
+
+
+class StartsitesTests(ConfigTestCase):
+
+    def write_manifest(self, root, content, fn='sites.yaml'):
+        fn = join(root, fn)
+        with open(fn, 'w') as fd:
+            fd.write(content)
+        return fn
+
+    def test_read_manifest(self):
+        with tempfile.TemporaryDirectory() as root:
+            sites = read_manifest(self.write_manifest(root, MANIFEST))
+            self.assertEqual([s['prjname'] for s in sites], ['trial1', 'trial2'])
+            self.assertEqual(sites[0]['appname'], 'noi')
+            self.assertEqual(sites[0]['shared_env'], '/tmp/env')
+            self.assertEqual(sites[1]['dev_repos'], 'lino xl')
+
+            fn = self.write_manifest(
+                root, '[{"app": "noi", "prjname": "a", "foo": 1}]', 'bad.json')
+            with self.assertRaises(click.ClickException) as cm:
+                read_manifest(fn)
+            self.assertEqual(cm.exception.message,
+                             "Invalid option(s) foo for site #1 in {}.".format(fn))
+
+            fn = self.write_manifest(
+                root, "- {app: noi, prjname: a}\n- {app: noi, prjname: a}\n")
+            with self.assertRaises(click.ClickException) as cm:
+                read_manifest(fn)
+            self.assertEqual(cm.exception.message,
+                             "Duplicate prjname a in {}.".format(fn))
+
+    def test_shared_steps(self):
+        # the work in the shared virtualenv is done only once
+        i = Installer(batch=True)
+        shared = {}
+        for prjname, dev_repos in (('trial1', ''), ('trial2', 'lino xl')):
+            add_site_steps(i, 'noi', prjname, dev_repos, '/tmp/env',
+                           prefix=prjname + ':', shared=shared)
+        names = list(i._steps)
+        shared_steps = ['virtualenv:/tmp/env', 'dev-repos:/tmp/env',
+                        'pip:/tmp/env']
+        if ifroot():
+            # static files are collected after every site has been
+            # installed, and compressed once
+            shared_steps += ['collectstatic:/tmp/env', 'compress-static:/tmp/env']
+            self.assertEqual(i._steps['collectstatic:/tmp/env'].deps,
+                             ('trial1:install', 'trial2:install'))
+            self.assertEqual(shared['/tmp/env']['static_sites'], [
+                '/tmp/sites/lino_local/trial1', '/tmp/sites/lino_local/trial2'])
+            self.assertEqual(names[-2:], shared_steps[-2:])
+        self.assertEqual([n for n in names if ':/' in n], shared_steps)
+        self.assertEqual(
+            i._steps['trial2:install'].deps,
+            ('trial2:files', 'virtualenv:/tmp/env', 'dev-repos:/tmp/env',
+             'pip:/tmp/env'))
+        work = shared['/tmp/env']
+        self.assertEqual([r.nickname for r in work['repos']], ['lino', 'xl'])
+        self.assertEqual('lino-noi' in work['packages'], True)
+
+        results = site_results(
+            [dict(prjname='trial1'), dict(prjname='trial2')],
+            ['trial1:migrate'], ['trial1:prep', 'trial1:after-prep'])
+        self.assertEqual(results, {
+            'trial1': 'failed (migrate)', 'trial2': 'ok'})
+
+    def test_env_templates(self):
+        # a new template doesn't remove the templates from which other sites
+        # of the same plan are being cloned
+        with tempfile.TemporaryDirectory() as root:
+            DEFAULTSECTION.update(sites_base=root)
+            i = Installer(batch=True)
+            shared = {}
+            for prjname, dev_repos in (('trial1', ''), ('trial2', 'noi')):
+                add_site_steps(i, 'noi', prjname, dev_repos, env_template=True,
+                               prefix=prjname + ':', shared=shared)
+            tpl_steps = [n for n in i._steps if n.startswith('env-template:')]
+            self.assertEqual(len(tpl_steps), 2)
+            base = join(root, 'envtemplates')
+            planned = [n.split(':')[1] for n in tpl_steps]
+            for name in planned + ['noi-old', 'amici-old']:
+                os.makedirs(join(base, name))
+            with mock.patch.object(Installer, 'make_env_template'):
+                i._steps[tpl_steps[0]].func()
+            self.assertEqual(sorted(os.listdir(base)),
+                             sorted(planned + ['amici-old']))
@@ -0,0 +1,57 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Check that the :command:`getlino` command starts fast.
+
+We call getlino from scripts and monit hooks, so its startup time matters.
+The budget can be adapted using the :envvar:`GETLINO_IMPORT_BUDGET`
+environment variable (in seconds).
+
+"""
+
+import os
+import sys
+import json
+import subprocess
+from atelier.test import TestCase
+
+IMPORT_BUDGET = float(os.environ.get('GETLINO_IMPORT_BUDGET', '0.5'))
+
+# modules that must not get imported when we just want to show the help text
+HEAVY_MODULES = ['distro', 'jinja2', 'virtualenv', 'http.client']
+
+PROBE = """
+import sys, time, json
+t = time.perf_counter()
+import getlino.cli
+t = time.perf_counter() - t
+if len(sys.argv) > 1:
+    try:
+        getlino.cli.main(sys.argv[1:], standalone_mode=False)
+    except (SystemExit, Exception):  # usage errors and --help
+        pass
+print(json.dumps(dict(seconds=t, modules=[m for m in {} if m in sys.modules])))
+"""
+
+
+def probe(*args):
+    code = PROBE.format(HEAVY_MODULES)
+    out = subprocess.check_output(
+        [sys.executable, '-c', code] + list(args), universal_newlines=True)
+    return json.loads(out.splitlines()[-1])
+
+
+class StartupTests(TestCase):
+
+    def test_import_time(self):
+        # take the best of three runs to reduce noise
+        best = min([probe()['seconds'] for i in range(3)])
+        self.assertLess(best, IMPORT_BUDGET)
+
+    def test_no_heavy_imports(self):
+        self.assertEqual(probe()['modules'], [])
+        self.assertEqual(probe('--help')['modules'], [])
+        self.assertEqual(probe('startsite', '--help')['modules'], [])
+        self.assertEqual(probe('configure', '--help')['modules'], [])
+        # a failing argument check doesn't import them either
+        self.assertEqual(probe('startsite', 'foo', 'bar')['modules'], [])
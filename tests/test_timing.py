@@ -0,0 +1,52 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import json
+import time
+import tempfile
+import threading
+from os.path import join
+from atelier.test import TestCase
+
+from getlino.timing import Tracer
+
+
+class TimingTests(TestCase):
+
+    def test_summary(self):
+        t = Tracer()
+        with t.span('plan', 'phase') as plan:
+            with t.span('install', 'step'):
+                with t.span('pip install', 'subprocess'):
+                    time.sleep(0.05)
+                time.sleep(0.02)
+
+            # a step that runs in another thread is a child of the plan
+            def run():
+                with t.span('files', 'step', parent=plan['id']):
+                    with t.span('settings.py', 'template'):
+                        time.sleep(0.01)
+            th = threading.Thread(target=run)
+            th.start()
+            th.join()
+
+        rows = t.summary()
+        self.assertEqual([r[0] for r in rows], ['plan', 'install', 'files'])
+        name, total, sub = rows[1]
+        self.assertTrue(sub >= 0.05)
+        self.assertTrue(total - sub >= 0.02)
+        self.assertEqual(rows[0][2], sub)
+        self.assertEqual(rows[2][2], 0)
+        files = [s for s in t.spans if s['name'] == 'files'][0]
+        self.assertEqual(files['parent'], plan['id'])
+
+        with tempfile.TemporaryDirectory() as root:
+            fn = join(root, 'trace.json')
+            t.write_trace(fn)
+            with open(fn) as fd:
+                events = json.load(fd)['traceEvents']
+        self.assertEqual(len(events), 5)
+        self.assertEqual(set([e['ph'] for e in events]), {'X'})
+        self.assertEqual(set([e['tid'] for e in events]), {1, 2})
+        pip = [e for e in events if e['name'] == 'pip install'][0]
+        self.assertTrue(pip['dur'] >= 50000)
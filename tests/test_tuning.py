@@ -0,0 +1,137 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+from os.path import join
+from unittest import mock
+from atelier.test import TestCase
+
+from getlino.utils import Installer, PostgreSQL, MySQL, DEFAULTSECTION
+from getlino.executor import RecordingExecutor
+from getlino.tuning import uwsgi_settings, read_load, mysql_settings
+from getlino.tuning import postgresql_settings, postgresql_conf, read_conf
+from getlino.tuning import needs_restart, mysql_set_global
+
+
+class TuningTests(TestCase):
+
+    def test_uwsgi_settings(self):
+        # a single busy site on a big server is limited by its load class
+        self.assertEqual(uwsgi_settings(8, 16000, 'high'), dict(
+            load='high', processes=8, cheaper=2, idle=0, threads=2))
+
+        # on a small server, the number of CPUs limits the workers
+        self.assertEqual(uwsgi_settings(1, 16000, 'high')['processes'], 3)
+
+        # the RAM is shared among the sites according to their weight
+        s = uwsgi_settings(8, 2000, 'medium', ['low', 'high'])
+        self.assertEqual(s['processes'], 1)
+        self.assertEqual(s['cheaper'], 0)
+        s = uwsgi_settings(8, 4000, 'high', ['low', 'medium'])
+        self.assertEqual(s['processes'], 7)
+
+        # idle sites stop their workers when nobody uses them
+        self.assertEqual(uwsgi_settings(2, 4000, 'low'), dict(
+            load='low', processes=2, cheaper=1, idle=600, threads=0))
+
+        # there is always at least one worker
+        self.assertEqual(uwsgi_settings(1, 100, 'low')['processes'], 1)
+
+    def test_mysql_settings(self):
+        self.assertEqual(mysql_settings(16000, ['medium'] * 10), dict(
+            buffer_pool_mb=3968, log_file_mb=992, max_connections=151,
+            table_open_cache=4000))
+        # a small server gets the defaults of MySQL
+        self.assertEqual(mysql_settings(1000, ['low']), dict(
+            buffer_pool_mb=128, log_file_mb=48, max_connections=151,
+            table_open_cache=2000))
+        # busy sites need more connections
+        s = mysql_settings(16000, ['high'] * 20)
+        self.assertEqual(s['max_connections'], 390)
+
+    def test_postgresql_settings(self):
+        s = postgresql_settings(8, 16000, ['medium'] * 10, 'ssd', '13')
+        self.assertEqual(s['shared_buffers'], '4000MB')
+        self.assertEqual(s['effective_cache_size'], '12000MB')
+        self.assertEqual(s['max_connections'], 100)
+        self.assertEqual(s['work_mem'], '10240kB')
+        self.assertEqual(s['random_page_cost'], '1.1')
+        self.assertEqual(s['max_parallel_workers_per_gather'], 4)
+
+        # old versions don't know the parameters for parallel queries
+        s = postgresql_settings(1, 1000, ['low'], 'hdd', '9.6')
+        self.assertEqual(s['shared_buffers'], '250MB')
+        self.assertEqual(s['work_mem'], '4096kB')
+        self.assertEqual(s['random_page_cost'], '4')
+        self.assertNotIn('max_parallel_workers', s)
+
+        # the file can be read back, and changing the work_mem needs no
+        # restart
+        with tempfile.TemporaryDirectory() as root:
+            pth = join(root, 'tuning.conf')
+            with open(pth, 'w') as fd:
+                fd.write(postgresql_conf(s))
+            old = read_conf(pth)
+        self.assertEqual(old['shared_buffers'], '250MB')
+        self.assertEqual(old['random_page_cost'], '4')
+        new = dict(old, work_mem='8MB')
+        self.assertFalse(needs_restart(old, new))
+        new.update(max_connections='200')
+        self.assertTrue(needs_restart(old, new))
+
+    def test_postgresql_tune(self):
+        with tempfile.TemporaryDirectory() as root:
+            for version in ('11', '13'):
+                os.makedirs(join(root, version, 'main', 'conf.d'))
+            i = Installer(batch=True)
+            with mock.patch('getlino.tuning.POSTGRESQL_CONF_DIRS',
+                            join(root, '*', 'main', 'conf.d')):
+                self.assertTrue(PostgreSQL().tune(i, ['low']))
+                self.assertEqual(i._services, {'postgresql'})
+                i._services.clear()
+                self.assertFalse(PostgreSQL().tune(i, ['low']))
+                self.assertFalse(i._services or i._reloads)
+                # the planner settings can change without a restart
+                with mock.patch.dict(DEFAULTSECTION, db_storage='hdd'):
+                    self.assertTrue(PostgreSQL().tune(i, ['low']))
+                self.assertEqual(i._reloads, {'postgresql'})
+                self.assertFalse(i._services)
+            self.assertEqual(os.listdir(join(root, '11', 'main', 'conf.d')), [])
+            self.assertTrue(os.path.exists(
+                join(root, '13', 'main', 'conf.d', '90-getlino.conf')))
+
+    def test_mysql_tune(self):
+        i = Installer(batch=True)
+        i.executor = RecordingExecutor()
+        with tempfile.TemporaryDirectory() as root:
+            pth = join(root, '90-getlino.cnf')
+            with mock.patch.object(MySQL, 'tuning_file', pth):
+                # the first time, the redo log changes
+                self.assertTrue(MySQL().tune(i, ['low']))
+                self.assertEqual(i._services, {MySQL().service})
+                i._services.clear()
+                self.assertFalse(MySQL().tune(i, ['low']))
+                # more sites need more connections, which doesn't need a
+                # restart
+                self.assertTrue(MySQL().tune(i, ['high'] * 20))
+                self.assertFalse(i._services)
+        self.assertEqual(i.executor.commands, [dict(
+            cmd=MySQL.client_command, returncode=0, output=[],
+            input="SET GLOBAL max_connections = 390;\n"
+                  "SET GLOBAL table_open_cache = 8000;\n")])
+
+        self.assertEqual(mysql_set_global(
+            dict(innodb_buffer_pool_size='128M', innodb_log_file_size='48M'),
+            dict(innodb_buffer_pool_size='256M', innodb_log_file_size='64M',
+                 default_storage_engine='InnoDB')), [
+            "SET GLOBAL default_storage_engine = 'InnoDB';",
+            "SET GLOBAL innodb_buffer_pool_size = 268435456;"])
+
+    def test_read_load(self):
+        with tempfile.TemporaryDirectory() as root:
+            pth = join(root, 'uwsgi.ini')
+            self.assertEqual(read_load(pth), None)
+            with open(pth, 'w') as fd:
+                fd.write("[uwsgi]\nmaster = true\n# load class: low\n")
+            self.assertEqual(read_load(pth), 'low')
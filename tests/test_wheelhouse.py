@@ -0,0 +1,45 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import tempfile
+from os.path import join
+from atelier.test import TestCase
+
+from getlino.utils import get_jinja_env
+from getlino.wheelhouse import is_complete, prune_wheels, REQUIREMENTS_FILENAME
+
+
+class WheelhouseTests(TestCase):
+
+    def test_wheelhouse(self):
+        with tempfile.TemporaryDirectory() as wh:
+            self.assertEqual(is_complete(wh, ['lino']), False)
+            with open(join(wh, REQUIREMENTS_FILENAME), 'w') as fd:
+                fd.write("# generated by getlino\nlino\nlino_noi\n")
+            self.assertEqual(is_complete(wh, ['lino', 'lino-noi']), True)
+            self.assertEqual(is_complete(wh, ['lino', 'lino-avanti']), False)
+
+            names = ['lino-20.7.0-py3-none-any.whl',
+                     'lino-20.8.0-py3-none-any.whl',
+                     'Django-2.2.14-py3-none-any.whl']
+            for n, fn in enumerate(names):
+                with open(join(wh, fn), 'w') as fd:
+                    fd.write(fn)
+                os.utime(join(wh, fn), (1000 + n, 1000 + n))
+            self.assertEqual(prune_wheels(wh), 1)
+            self.assertEqual(sorted(os.listdir(wh)), [
+                'Django-2.2.14-py3-none-any.whl',
+                'lino-20.8.0-py3-none-any.whl',
+                REQUIREMENTS_FILENAME])
+
+    def test_pull_sh(self):
+        # pull.sh decides at run time whether to use the wheelhouse, and it
+        # never forbids the package index
+        content = get_jinja_env().get_template('pull.sh').render(
+            envdir='/env', repos_link='repositories', dev_packages='',
+            pip_packages='lino-noi', wheelhouse='/lino/wheelhouse',
+            pip_options='--no-index --find-links /lino/wheelhouse')
+        self.assertNotIn('--no-index', content)
+        self.assertIn('if [ -d /lino/wheelhouse ] ; then', content)
+        self.assertIn('pip install -U $PIP_OPTIONS lino-noi', content)